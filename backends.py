@@ -0,0 +1,511 @@
+import hashlib
+import json
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+import metrics
+from compaction import Compactor
+from config import *
+from resilience import RETRYABLE_ERRORS, ServiceUnavailable, breaker, call_with_retry, pause_before_retry
+from runs import cancel_run, record_wasted_tokens
+
+# Model backends behind AssistantManager. Both take the per-session `state` mapping (Streamlit's
+# session state in the app, a plain dict elsewhere) and expose the same calls:
+#
+#   start_session()                 prepare per-session state (e.g. create a thread)
+#   stream_turn(...)                yield ("delta", text) and ("usage", usage) events for one turn
+#   record_exchange(user, reply)    add a turn that was answered without the model
+#   history()                       the conversation so far as role/content messages
+#   speculate(...)                  generate a reply off to the side, without touching the session;
+#                                   returns (text, usage), text None if the reply hit the token cap
+#
+# stream_turn only commits the turn to the conversation once the reply has finished. With
+# CONTEXT_COMPACTION on, each turn sends a rolling summary plus the most recent messages instead of
+# the whole conversation.
+#
+# Transient failures (rate limits, 5xx, dropped streams) are retried inside stream_turn. A stream may
+# also emit ("reset", None), meaning the text streamed so far is void and the reply starts over, and
+# ("run", run_id) once a server-side run exists, so the caller can cancel it if nobody reads the reply.
+# ("truncated", reason) means the reply was cut off at the turn's token cap. ("summary_usage", usage) is
+# the token usage of a context summary made for the turn, on top of the turn's own.
+
+RUN_ENDED = ("failed", "cancelled", "expired", "incomplete")
+# An incomplete run that hit its token caps still has a (cut short) reply; retrying would hit them again.
+TOKEN_LIMITS = ("max_completion_tokens", "max_prompt_tokens")
+
+
+class RunFailed(Exception):
+    """A run ended without completing; the turn can be retried with a new run."""
+
+
+def hit_token_limit(run):
+    details = getattr(run, "incomplete_details", None)
+    return run.status == "incomplete" and details is not None and details.reason in TOKEN_LIMITS
+
+
+# Scratch threads (see AssistantsBackend._scratch_turn) are deleted off the request path.
+scratch_deleter = ThreadPoolExecutor(max_workers=2, thread_name_prefix="scratch-delete")
+
+
+def delete_scratch_thread(client, thread_id):
+    metrics.count_round_trip("threads.delete")
+    try:
+        client.beta.threads.delete(thread_id=thread_id)
+    except openai.OpenAIError as e:
+        print(f"Couldn't delete scratch thread {thread_id}: {e}")
+
+
+def make_backend(name, client, assistant, state, phases=PHASES):
+    # phases is the session's debate (see debates.py); the Assistants backend rebuilds history from it.
+    if name == "assistants":
+        return AssistantsBackend(client, assistant, state, phases)
+    if name == "chat":
+        return ChatCompletionsBackend(client, state)
+    raise ValueError(f"Unknown AI_BACKEND {name!r}; expected 'assistants' or 'chat'")
+
+
+class AssistantsBackend:
+    """Server-side threads through the Assistants API. The thread lives in state['thread_obj']."""
+
+    name = "assistants"
+
+    def __init__(self, client, assistant, state, phases=PHASES):
+        self.client = client
+        self.assistant = assistant
+        self.state = state
+        self.phases = phases
+        self.compactor = Compactor(client, state) if CONTEXT_COMPACTION else None
+
+    @property
+    def thread(self):
+        return self.state.get('thread_obj') or None
+
+    def start_session(self):
+        if not self.thread:
+            if ASSISTANT_THREAD:
+                print(f"Grabbing configured thread...")
+                thread_obj = call_with_retry(self.client.beta.threads.retrieve, "threads.retrieve", thread_id=ASSISTANT_THREAD)
+            else:
+                print(f"Creating and saving new thread")
+                thread_obj = call_with_retry(self.client.beta.threads.create, "threads.create")
+                self.state['thread_messages'] = []
+            self.state['thread_obj'] = thread_obj
+            print(f"ThreadID::: {self.thread.id}")
+
+    def record_exchange(self, user_content, assistant_content):
+        # Sent with the next run instead of costing their own requests now.
+        pending = self.state.setdefault('pending_messages', [])
+        pending.append({"role": "user", "content": user_content})
+        pending.append({"role": "assistant", "content": assistant_content})
+
+    def history(self):
+        # What the thread holds (mirrored in state, since the thread is server-side), then the
+        # messages waiting to go out with the next run.
+        return list(self._thread_messages()) + list(self.state.get('pending_messages', []))
+
+    def _thread_messages(self):
+        if 'thread_messages' not in self.state:
+            # Sessions from before the thread was mirrored: rebuild it from the answers and replies
+            # they stored, less the exchanges still pending.
+            pending = len(self.state.get('pending_messages', []))
+            rebuilt = self._phase_history()
+            self.state['thread_messages'] = rebuilt[:len(rebuilt) - pending]
+        return self.state['thread_messages']
+
+    def _phase_history(self):
+        history = []
+        for phase_name in self.phases:
+            user_key = f"{phase_name}_user_input"
+            ai_key = f"{phase_name}_ai_response"
+            if user_key in self.state and ai_key in self.state:
+                if self.state[ai_key] == "This phase was skipped.":
+                    continue
+                history.append({"role": "user", "content": self.state[user_key]})
+                history.append({"role": "assistant", "content": self.state[ai_key]})
+        return history
+
+    def _open_turn(self, phase, persist, messages):
+        # A turn keeps its id until it completes, so resubmitting the same input after a failure
+        # picks up the run (and the messages) the first attempt already wrote to the thread.
+        key = hashlib.sha256(json.dumps([phase, persist, messages]).encode("utf-8")).hexdigest()
+        turn = self.state.get('open_turn')
+        if not turn or turn['key'] != key:
+            turn = {"key": key, "id": uuid.uuid4().hex, "run_id": None, "messages_sent": False}
+            self.state['open_turn'] = turn
+        return turn
+
+    def _messages_sent(self, turn, messages):
+        # The thread now holds the pending messages and this turn's; mirror them.
+        if not turn['messages_sent']:
+            self._thread_messages().extend(list(self.state.get('pending_messages', [])) + list(messages))
+            self.state['pending_messages'] = []
+            turn['messages_sent'] = True
+
+    def _find_run(self, turn, messages):
+        # runs.create can fail after the server accepted it, so look the run up by its turn id.
+        if turn['run_id'] is None:
+            runs = call_with_retry(self.client.beta.threads.runs.list, "runs.list", thread_id=self.thread.id, limit=10)
+            for run in runs.data:
+                if (run.metadata or {}).get("turn_id") == turn['id']:
+                    turn['run_id'] = run.id
+                    break
+            else:
+                return None
+        self._messages_sent(turn, messages)
+        return call_with_retry(self.client.beta.threads.runs.retrieve, "runs.retrieve", run_id=turn['run_id'], thread_id=self.thread.id)
+
+    def _resume(self, run, shown):
+        # Poll the run the dropped stream belonged to, then read its reply from the thread.
+        deadline = time.monotonic() + RESUME_TIMEOUT
+        while run.status not in ("completed",) + RUN_ENDED:
+            if time.monotonic() > deadline:
+                raise ServiceUnavailable(f"Run {run.id} did not finish within {RESUME_TIMEOUT}s")
+            time.sleep(RESUME_POLL_INTERVAL)
+            run = call_with_retry(self.client.beta.threads.runs.retrieve, "runs.retrieve", run_id=run.id, thread_id=self.thread.id)
+        if run.status != "completed" and not hit_token_limit(run):
+            raise RunFailed(run.status)
+        truncated = run.status != "completed"
+        if truncated:
+            metrics.registry.inc("debate_truncated_replies_total", reason=run.incomplete_details.reason)
+        metrics.registry.inc("debate_stream_resumes_total")
+        reply = call_with_retry(self.client.beta.threads.messages.list, "messages.list", thread_id=self.thread.id, run_id=run.id, order="asc")
+        text = "".join(
+            content.text.value
+            for message in reply.data
+            for content in message.content
+            if content.type == "text"
+            )
+        if text.startswith(shown):
+            if text[len(shown):]:
+                yield "delta", text[len(shown):]
+        else:
+            yield "reset", None
+            yield "delta", text
+        if truncated:
+            yield "truncated", run.incomplete_details.reason
+        yield "usage", run.usage
+
+    def _read_run(self, stream):
+        # The events of one streamed run, closing the stream however reading ends.
+        try:
+            for event in stream:
+                if event.event == "thread.created":
+                    # Only create_and_run makes a thread as part of the run
+                    yield "thread", event.data.id
+                elif event.event == "thread.run.created":
+                    yield "run", event.data.id
+                elif event.data.object == "thread.message.delta":
+                    for content in event.data.delta.content:
+                        if content.type == 'text':
+                            yield "delta", content.text.value
+                elif event.event == "thread.run.completed":
+                    # The completed run carries the token usage for this turn
+                    yield "usage", event.data.usage
+                elif event.event == "thread.run.incomplete" and hit_token_limit(event.data):
+                    # Cut short by the turn's token caps: keep the reply, don't retry
+                    metrics.registry.inc("debate_truncated_replies_total", reason=event.data.incomplete_details.reason)
+                    yield "truncated", event.data.incomplete_details.reason
+                    yield "usage", event.data.usage
+                elif event.event in ("thread.run.failed", "thread.run.expired", "thread.run.incomplete"):
+                    raise RunFailed(event.data.status)
+        finally:
+            # Stop reading the run's events if the caller stopped early.
+            stream.close()
+
+    def _run_options(self, instructions, temperature, max_tokens):
+        return dict(
+            assistant_id=self.assistant.id,
+            additional_instructions=instructions or None,
+            temperature=temperature,
+            max_completion_tokens=max_tokens,
+            max_prompt_tokens=MAX_PROMPT_TOKENS,
+            stream=True,
+        )
+
+    def stream_turn(self, instructions, messages, temperature=TEMPERATURE, response_format="auto", persist=True, phase="", max_tokens=MAX_TOKENS):
+        # Messages recorded without a run go first, then this turn's, all in the run-create request.
+        # additional_instructions is appended to the assistant's own instructions, where
+        # instructions would replace them.
+        extra = {}
+        history = self.history()
+        if self.compactor:
+            # The thread can't be rewritten, so older messages are cut with a truncation strategy
+            # and their summary travels with the run's instructions. history() mirrors the thread
+            # plus the pending messages, so only this turn's messages are added to the window.
+            summary, recent, summary_usage = self.compactor.compact(history, phase)
+            if summary_usage is not None:
+                yield "summary_usage", summary_usage
+            if summary is not None:
+                instructions = f"Summary of the earlier debate:\n{summary}\n\n{instructions or ''}".strip()
+                history = recent
+                extra['truncation_strategy'] = {
+                    "type": "last_messages",
+                    "last_messages": len(recent) + len(messages),
+                }
+        if response_format == "json":
+            extra['response_format'] = {"type": "json_object"}
+        if not persist:
+            # Scoring runs leave nothing on the student's thread, so rubric JSON never reaches later turns.
+            extra.pop('truncation_strategy', None)
+            yield from self._scratch_turn(history, instructions, messages, temperature, max_tokens, extra)
+            return
+        turn = self._open_turn(phase, persist, messages)
+        shown = ""
+        truncated = False
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                run = self._find_run(turn, messages) if attempt or turn['messages_sent'] else None
+                if run is not None and (run.status not in RUN_ENDED or hit_token_limit(run)):
+                    # Still running or already done: never start a second run for the same turn.
+                    yield "run", run.id
+                    for kind, value in self._resume(run, shown):
+                        if kind == "reset":
+                            shown = ""
+                        elif kind == "delta":
+                            shown += value
+                        yield kind, value
+                    break
+                # The messages go out with the first run only; a retry after a failed run reuses them.
+                additional_messages = []
+                if not turn['messages_sent']:
+                    additional_messages = list(self.state.get('pending_messages', [])) + list(messages)
+                trial = breaker.before_call()
+                try:
+                    turn['run_id'] = None
+                    metrics.count_round_trip("runs.create")
+                    stream = self.client.beta.threads.runs.create(
+                        thread_id=self.thread.id,
+                        additional_messages=additional_messages or None,
+                        metadata={"turn_id": turn['id']},
+                        **self._run_options(instructions, temperature, max_tokens),
+                        **extra
+                        )
+                    self._messages_sent(turn, messages)
+                    for kind, value in self._read_run(stream):
+                        if kind == "run":
+                            turn['run_id'] = value
+                        elif kind == "delta":
+                            shown += value
+                        yield kind, value
+                    breaker.success()
+                finally:
+                    # A trial that ends any other way (abandoned stream, bad request) is handed back.
+                    breaker.end_call(trial)
+                break
+            except openai.BadRequestError as e:
+                # A run left over on the thread (e.g. from a worker that died mid-stream) blocks new
+                # runs until it ends. Cancel it and try again.
+                blocking = re.search(r"already has an active run (\w+)", e.message or "")
+                if not blocking or attempt == RETRY_ATTEMPTS - 1:
+                    raise
+                metrics.registry.inc("debate_blocked_runs_total")
+                print(f"Thread {self.thread.id} is blocked by run {blocking.group(1)}; cancelling it")
+                final = cancel_run(self.client, self.thread.id, blocking.group(1))
+                record_wasted_tokens(final.usage.completion_tokens if final.usage else None, self.name, phase)
+            except (RunFailed,) + RETRYABLE_ERRORS as e:
+                # After a dropped stream the next attempt finds the run by its turn id and resumes it.
+                if isinstance(e, RunFailed) and shown:
+                    # Start over with a new run; the failed run's partial text is void.
+                    shown = ""
+                    yield "reset", None
+                pause_before_retry("runs.create", e, attempt)
+        # The reply is on the thread now, after the messages it answers.
+        self._thread_messages().append({"role": "assistant", "content": shown.strip()})
+        self.state.pop('open_turn', None)
+
+    def _scratch_turn(self, history, instructions, messages, temperature, max_tokens, extra):
+        # One create_and_run request per attempt: a new thread seeded with the conversation and this
+        # turn's messages, and the run on it. It has no additional_instructions, so the assistant's
+        # own instructions go first. The thread is deleted in the background once the reply is read.
+        options = self._run_options(instructions, temperature, max_tokens)
+        del options['additional_instructions']
+        options['instructions'] = f"{self.assistant.instructions or ''}\n\n{instructions or ''}".strip()
+        shown = ""
+        for attempt in range(RETRY_ATTEMPTS):
+            thread_id = None
+            try:
+                trial = breaker.before_call()
+                try:
+                    metrics.count_round_trip("threads.create_and_run")
+                    stream = self.client.beta.threads.create_and_run(
+                        thread={"messages": list(history) + list(messages)},
+                        **options,
+                        **extra
+                        )
+                    for kind, value in self._read_run(stream):
+                        # Nothing to cancel or resume later: deleting the thread ends the run.
+                        if kind == "thread":
+                            thread_id = value
+                            continue
+                        if kind == "run":
+                            continue
+                        if kind == "delta":
+                            shown += value
+                        yield kind, value
+                    breaker.success()
+                finally:
+                    breaker.end_call(trial)
+                return
+            except (RunFailed,) + RETRYABLE_ERRORS as e:
+                if shown:
+                    shown = ""
+                    yield "reset", None
+                pause_before_retry("threads.create_and_run", e, attempt)
+            finally:
+                if thread_id:
+                    scratch_deleter.submit(delete_scratch_thread, self.client, thread_id)
+
+    def speculate(self, history, user_content, instructions, cancel_event, temperature=TEMPERATURE, max_tokens=MAX_TOKENS):
+        # Run on a scratch thread seeded with the conversation, so a discarded guess leaves no trace.
+        metrics.count_round_trip("threads.create")
+        thread = self.client.beta.threads.create(messages=history)
+        try:
+            if cancel_event.is_set():
+                return None
+            metrics.count_round_trip("runs.create")
+            stream = self.client.beta.threads.runs.create(
+                thread_id=thread.id,
+                additional_messages=[{"role": "user", "content": user_content}],
+                **self._run_options(instructions, temperature, max_tokens),
+            )
+            parts = []
+            run_id = None
+            usage = None
+            truncated = False
+            for event in stream:
+                if event.event == "thread.run.created":
+                    run_id = event.data.id
+                if cancel_event.is_set():
+                    # The guess is stale: stop paying for tokens nobody will read.
+                    if run_id:
+                        metrics.count_round_trip("runs.cancel")
+                        self.client.beta.threads.runs.cancel(run_id=run_id, thread_id=thread.id)
+                    stream.close()
+                    return None
+                if event.data.object == "thread.message.delta":
+                    for content in event.data.delta.content:
+                        if content.type == "text":
+                            parts.append(content.text.value)
+                elif event.event == "thread.run.completed":
+                    usage = event.data.usage
+                elif event.event == "thread.run.incomplete":
+                    usage = event.data.usage
+                    truncated = True
+            # A guess cut off at the token cap isn't worth serving; its tokens still count.
+            return (None if truncated else "".join(parts).strip()), usage
+        finally:
+            metrics.count_round_trip("threads.delete")
+            self.client.beta.threads.delete(thread_id=thread.id)
+
+
+class ChatCompletionsBackend:
+    """Chat Completions with the transcript held locally in state['transcript'].
+
+    Each turn is a single streamed request. The system prompt always comes first and the
+    per-phase instructions last, so consecutive requests share the longest possible prefix
+    for provider-side prompt caching.
+    """
+
+    name = "chat"
+
+    def __init__(self, client, state):
+        self.client = client
+        self.state = state
+        self.compactor = Compactor(client, state) if CONTEXT_COMPACTION else None
+
+    def start_session(self):
+        self.state.setdefault('transcript', [])
+
+    def record_exchange(self, user_content, assistant_content):
+        self.state['transcript'].append({"role": "user", "content": user_content})
+        self.state['transcript'].append({"role": "assistant", "content": assistant_content})
+
+    def history(self):
+        return list(self.state.get('transcript', []))
+
+    def _messages(self, history, messages, instructions):
+        request = [{"role": "system", "content": ASSISTANT_INSTRUCTIONS}] + list(history) + list(messages)
+        if instructions:
+            request.append({"role": "system", "content": instructions})
+        return request
+
+    def _create(self, history, messages, instructions, temperature, response_format="auto", max_tokens=MAX_TOKENS):
+        kwargs = {}
+        if response_format == "json":
+            kwargs['response_format'] = {"type": "json_object"}
+        return call_with_retry(
+            self.client.chat.completions.create,
+            "chat.completions.create",
+            model=OPENAI_MODEL,
+            messages=self._messages(history, messages, instructions),
+            temperature=temperature,
+            top_p=TOP_P,
+            max_tokens=max_tokens,
+            frequency_penalty=FREQUENCY_PENALTY,
+            presence_penalty=PRESENCE_PENALTY,
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs
+        )
+
+    def stream_turn(self, instructions, messages, temperature=TEMPERATURE, response_format="auto", persist=True, phase="", max_tokens=MAX_TOKENS):
+        history = self.history()
+        if self.compactor:
+            # The full transcript stays in state; only the request is compacted.
+            summary, history, summary_usage = self.compactor.compact(history, phase)
+            if summary_usage is not None:
+                yield "summary_usage", summary_usage
+            if summary is not None:
+                history = [{"role": "system", "content": f"Summary of the earlier debate:\n{summary}"}] + history
+        parts = []
+        for attempt in range(RETRY_ATTEMPTS):
+            stream = self._create(history, messages, instructions, temperature, response_format, max_tokens)
+            try:
+                for chunk in stream:
+                    for choice in chunk.choices:
+                        if choice.delta.content:
+                            parts.append(choice.delta.content)
+                            yield "delta", choice.delta.content
+                        if choice.finish_reason == "length":
+                            metrics.registry.inc("debate_truncated_replies_total", reason="max_tokens")
+                            yield "truncated", "max_tokens"
+                    if chunk.usage is not None:
+                        yield "usage", chunk.usage
+                break
+            except RETRYABLE_ERRORS as e:
+                # Nothing is stored server-side, so a dropped stream is simply requested again.
+                if parts:
+                    parts = []
+                    yield "reset", None
+                pause_before_retry("chat.completions.create", e, attempt)
+            finally:
+                # Closing the connection stops generation if the caller stopped reading early.
+                stream.close()
+        # Scoring turns stay out of the transcript so rubric JSON never reaches later prompts.
+        if persist:
+            self.state['transcript'].extend(messages)
+            self.state['transcript'].append({"role": "assistant", "content": "".join(parts).strip()})
+
+    def speculate(self, history, user_content, instructions, cancel_event, temperature=TEMPERATURE, max_tokens=MAX_TOKENS):
+        stream = self._create(history, [{"role": "user", "content": user_content}], instructions, temperature,
+                              max_tokens=max_tokens)
+        parts = []
+        usage = None
+        truncated = False
+        for chunk in stream:
+            if cancel_event.is_set():
+                # Closing the connection is how a Chat Completions stream is abandoned.
+                stream.close()
+                return None
+            for choice in chunk.choices:
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                if choice.finish_reason == "length":
+                    truncated = True
+            if chunk.usage is not None:
+                usage = chunk.usage
+        return (None if truncated else "".join(parts).strip()), usage
@@ -0,0 +1,250 @@
+"""Run scripted debates through the model without Streamlit, to regression-test prompts and rubrics.
+
+Each line of the input file is one scripted student:
+
+    {"id": "telemedicine-pro", "inputs": {"user_name": "Sam", "round_1": "...", "round_2": "..."}}
+
+A phase missing from "inputs" gets its prefilled value (or its first option). A scored phase may
+list several inputs; they are tried in order until one passes, the way a student resubmits.
+Debates run concurrently, up to --parallel at a time, and each one is written to --out as a JSON
+line as soon as it finishes. Against the stand-in server:
+
+    python batch.py scripts.jsonl --repeat 20 --parallel 50 --start-server
+
+Replies use config.py as it is, so edit PHASES or ASSISTANT_INSTRUCTIONS and run the batch again
+to compare. --debate runs one of the definitions in debates/ instead of PHASES. The opening cache
+and speculative replies are bypassed: every turn goes to the model.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from backends import make_backend
+from compaction import estimate_tokens
+from config import *
+from loadtest import start_server, summarize
+from phases import build_scoring_instructions, score_submission
+from scheduler import AdmissionScheduler
+
+
+def scripted_inputs(phase_name, phase_dict, inputs):
+    value = inputs.get(phase_name)
+    if value is None:
+        value = phase_dict.get("value") or next(iter(phase_dict.get("options") or []), None)
+    if value is None:
+        raise ValueError(f"No input for phase {phase_name!r}")
+    return value if isinstance(value, list) else [value]
+
+
+def run_turn(backend, scheduler, session, phase, instructions, messages, kind, **kwargs):
+    # One model response, consumed off the event loop. Returns (text, timing).
+    turn = metrics.Turn(session, phase, kind)
+    ticket = scheduler.acquire(session, estimate_tokens(backend.history() + messages) + MAX_TOKENS)
+    parts = []
+    try:
+        for event, value in backend.stream_turn(instructions, messages, persist=kind == "reply", phase=phase, **kwargs):
+            if event == "delta":
+                turn.first_delta()
+                parts.append(value)
+            elif event == "reset":
+                parts = []
+            elif event == "usage":
+                turn.usage(value)
+    finally:
+        used_tokens = None
+        if turn.prompt_tokens is not None:
+            used_tokens = turn.prompt_tokens + turn.completion_tokens
+        scheduler.release(ticket, used_tokens)
+        turn.finish()
+    ended = time.monotonic()
+    timing = {
+        "kind": kind,
+        "ttft": None if turn.first_delta_at is None else turn.first_delta_at - turn.started,
+        "seconds": ended - turn.started,
+        "round_trips": turn.round_trips,
+        "prompt_tokens": turn.prompt_tokens,
+        "completion_tokens": turn.completion_tokens,
+    }
+    return "".join(parts).strip(), timing
+
+
+class Runner:
+    def __init__(self, backend_name, parallel, phases=PHASES):
+        self.backend_name = backend_name
+        self.phases = phases
+        self.semaphore = asyncio.Semaphore(parallel)
+        self.scheduler = AdmissionScheduler()
+        # Resolved once and shared, like the app's process-wide resources.
+        from main import get_assistant, get_client
+        self.client = get_client()
+        self.assistant = get_assistant() if backend_name == "assistants" else None
+
+    async def debate(self, script, repeat):
+        async with self.semaphore:
+            started = time.monotonic()
+            session = f"{script['id']}#{repeat}"
+            record = {"id": script["id"], "repeat": repeat, "backend": self.backend_name, "status": "completed", "phases": []}
+            try:
+                await self._debate(script.get("inputs", {}), session, record)
+            except Exception as e:
+                record["status"] = "error"
+                record["error"] = f"{type(e).__name__}: {e}"
+            record["seconds"] = time.monotonic() - started
+            return record
+
+    async def _debate(self, inputs, session, record):
+        # The backend keeps its per-session state in a plain dict instead of st.session_state.
+        state = {}
+        backend = make_backend(self.backend_name, self.client, self.assistant, state, self.phases)
+        await asyncio.to_thread(backend.start_session)
+        for phase_name, phase_dict in self.phases.items():
+            if phase_dict["type"] == "markdown":
+                continue
+            for attempt, value in enumerate(scripted_inputs(phase_name, phase_dict, inputs)):
+                reply, timing = await asyncio.to_thread(
+                    run_turn, backend, self.scheduler, session, phase_name, phase_dict.get("instructions", ""),
+                    [{"role": "user", "content": value}], "reply")
+                # The same keys st_store writes; the Assistants backend rebuilds history from them.
+                state[f"{phase_name}_user_input"] = value
+                state[f"{phase_name}_ai_response"] = reply
+                entry = {"phase": phase_name, "attempt": attempt, "user": value, "reply": reply, "timings": [timing]}
+                record["phases"].append(entry)
+                if not (phase_dict.get("scored_phase", False) and "rubric" in phase_dict):
+                    break
+                timings = entry["timings"]
+
+                def run_model():
+                    result, timing = run_turn(
+                        backend, self.scheduler, session, phase_name, build_scoring_instructions(phase_dict["rubric"]),
+                        [], "scoring", temperature=.2, response_format="json")
+                    timings.append(timing)
+                    return result
+                outcome = await asyncio.to_thread(score_submission, value, phase_dict, run_model)
+                entry["scoring_stage"] = outcome["stage"]
+                entry["result"] = outcome["result"]
+                entry["score"] = outcome["score"]
+                entry["passed"] = outcome["verdict"] == "pass"
+                if entry["passed"]:
+                    break
+            else:
+                # Every scripted attempt failed the rubric, so the student can't go on.
+                record["status"] = "stuck"
+                return
+
+
+def load_scripts(path):
+    scripts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                script = json.loads(line)
+                script.setdefault("id", f"line-{number}")
+                scripts.append(script)
+    return scripts
+
+
+async def run(args, scripts):
+    loop = asyncio.get_running_loop()
+    # Turns block in worker threads; size the pool so --parallel is the only limit.
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=args.parallel, thread_name_prefix="debate"))
+    from debates import library
+    runner = Runner(args.backend, args.parallel, library.get(args.debate).phases)
+    tasks = [asyncio.create_task(runner.debate(script, repeat)) for repeat in range(args.repeat) for script in scripts]
+    records = []
+    with open(args.out, "w", encoding="utf-8") as out:
+        for task in asyncio.as_completed(tasks):
+            record = await task
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            records.append(record)
+    return records
+
+
+def report(records, wall):
+    turns = [timing for record in records for entry in record["phases"] for timing in entry["timings"]]
+    replies = [timing for timing in turns if timing["kind"] == "reply"]
+    statuses = {}
+    for record in records:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+    scored = [entry for record in records for entry in record["phases"] if "scoring_stage" in entry]
+    scores = [entry["score"] for entry in scored if entry["score"] is not None]
+    stages = {}
+    for entry in scored:
+        stages[entry["scoring_stage"]] = stages.get(entry["scoring_stage"], 0) + 1
+    return {
+        "debates": len(records),
+        "statuses": statuses,
+        "wall_seconds": wall,
+        "debates_per_minute": 60.0 * statuses.get("completed", 0) / wall if wall else None,
+        "time_to_first_token": summarize([t["ttft"] for t in replies if t["ttft"] is not None]),
+        "turn_latency": summarize([t["seconds"] for t in turns]),
+        "debate_seconds": summarize([record["seconds"] for record in records]),
+        "prompt_tokens": sum(t["prompt_tokens"] or 0 for t in turns),
+        "completion_tokens": sum(t["completion_tokens"] or 0 for t in turns),
+        "mean_score": sum(scores) / len(scores) if scores else None,
+        "scoring_stages": stages,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scripts", help="JSONL file of scripted student inputs")
+    parser.add_argument("--out", default="batch_results.jsonl", help="JSONL file for finished debates")
+    parser.add_argument("--repeat", type=int, default=1, help="run every script this many times")
+    parser.add_argument("--parallel", type=int, default=20, help="debates in flight at once")
+    parser.add_argument("--backend", choices=("assistants", "chat"), default=AI_BACKEND)
+    parser.add_argument("--debate", default=None, help="debate definition to run (default: config.PHASES)")
+    parser.add_argument("--base-url", default=None, help="API base URL (default: the real API, or the stand-in with --start-server)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--start-server", action="store_true", help="launch standin_server.py for the run")
+    parser.add_argument("--log-turns", action="store_true", help="log each turn as a JSON line on stdout")
+    # Arguments after -- go to standin_server.py; split them off before the input file is parsed.
+    argv = sys.argv[1:] if argv is None else list(argv)
+    split = argv.index("--") if "--" in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+    args.server_args = argv[split + 1:]
+
+    if args.base_url or args.start_server:
+        os.environ["OPENAI_BASE_URL"] = args.base_url or f"http://127.0.0.1:{args.port}/v1"
+    if args.start_server:
+        os.environ.setdefault("OPENAI_API_KEY", "stand-in")
+    metrics.METRICS_JSON_LOGS = args.log_turns
+    scripts = load_scripts(args.scripts)
+    server = start_server(args) if args.start_server else None
+    started = time.perf_counter()
+    try:
+        records = asyncio.run(run(args, scripts))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    wall = time.perf_counter() - started
+    metrics.registry.flush(force=True)
+
+    summary = report(records, wall)
+    print(f"{summary['debates']} debates in {wall:.1f}s: {summary['debates_per_minute']:.1f} completed debates per minute")
+    print(f"{'statuses':>20}: {summary['statuses']}")
+    for name in ("time_to_first_token", "turn_latency", "debate_seconds"):
+        stats = summary[name]
+        if stats["count"]:
+            print(f"{name:>20}: p50 {stats['p50']*1000:8.1f} ms  p95 {stats['p95']*1000:8.1f} ms  "
+                  f"p99 {stats['p99']*1000:8.1f} ms  (n={stats['count']})")
+    print(f"{'tokens':>20}: {summary['prompt_tokens']} prompt, {summary['completion_tokens']} completion")
+    if summary["mean_score"] is not None:
+        print(f"{'mean score':>20}: {summary['mean_score']:.2f}")
+    if summary["scoring_stages"]:
+        print(f"{'scored by':>20}: {summary['scoring_stages']}")
+    for record in records:
+        if record["status"] == "error":
+            print(f"ERROR {record['id']}#{record['repeat']}: {record['error']}")
+    print(f"Results written to {args.out}")
+    return 0 if summary["statuses"].get("error", 0) == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
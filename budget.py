@@ -0,0 +1,274 @@
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import metrics
+import storage
+from config import *
+
+# Token budgets. Every turn's usage (from the completed run) is added to rolling totals for the
+# session, for each phase within it, and for the whole deployment (every worker process sharing
+# BUDGET_DB_PATH). Before a turn, the tightest of those budgets decides how it runs:
+#
+#   ok        the turn runs with MAX_TOKENS completion tokens
+#   degraded  less than BUDGET_DEGRADE_FRACTION of a budget is left: a short reply, capped at
+#             BUDGET_DEGRADED_MAX_TOKENS
+#   refused   not even a short reply fits; the student is told politely and no request is made
+#
+# Scoring runs are never refused, so a reply the student already got can still be scored.
+# The deployment keeps the turns of the last BUDGET_WINDOW for its cap and rolls all of them up into
+# per-phase totals, exported to BUDGET_PATH in the background for cost and capacity forecasts.
+
+
+class BudgetExhausted(Exception):
+    """No budget is left for this turn."""
+
+    def __init__(self, scope):
+        super().__init__(f"The {scope} token budget is used up")
+        self.scope = scope
+
+
+def cost(model, prompt_tokens, completion_tokens):
+    # Dollars, from TOKEN_PRICES (per million tokens). Unknown models cost nothing here.
+    prompt_price, completion_price = TOKEN_PRICES.get(model, (0, 0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+def _add(totals, prompt_tokens, completion_tokens):
+    totals["prompt_tokens"] = totals.get("prompt_tokens", 0) + prompt_tokens
+    totals["completion_tokens"] = totals.get("completion_tokens", 0) + completion_tokens
+    totals["turns"] = totals.get("turns", 0) + 1
+
+
+def _used(totals):
+    return totals.get("prompt_tokens", 0) + totals.get("completion_tokens", 0)
+
+
+def session_usage(state):
+    # Kept in the session's state (and saved with it), so a resumed debate keeps its budget.
+    return state.setdefault('token_usage', {"phases": {}})
+
+
+def plan_turn(state, phase, deployment=None, scoring_run=False):
+    """How the next turn may run: {"verdict", "scope", "max_tokens", "instructions"}."""
+    usage = session_usage(state)
+    budgets = [
+        ("session", SESSION_TOKEN_BUDGET, _used(usage)),
+        ("phase", PHASE_TOKEN_BUDGET, _used(usage["phases"].get(phase, {}))),
+    ]
+    if deployment is not None and deployment.limit:
+        budgets.append(("deployment", deployment.limit, deployment.used()))
+    plan = {"verdict": "ok", "scope": None, "max_tokens": MAX_TOKENS, "instructions": ""}
+    if scoring_run:
+        return plan
+    for scope, limit, used in budgets:
+        if not limit:
+            continue
+        left = limit - used
+        if left < BUDGET_DEGRADED_MAX_TOKENS:
+            plan.update(verdict="refused", scope=scope)
+            break
+        if left < limit * BUDGET_DEGRADE_FRACTION and plan["verdict"] == "ok":
+            plan.update(verdict="degraded", scope=scope, max_tokens=min(MAX_TOKENS, BUDGET_DEGRADED_MAX_TOKENS),
+                        instructions=BUDGET_DEGRADED_INSTRUCTIONS)
+    if plan["verdict"] != "ok":
+        metrics.registry.inc("debate_budget_decisions_total", verdict=plan["verdict"], scope=plan["scope"])
+    return plan
+
+
+def record_usage(state, phase, usage, deployment=None, session_id="", model=OPENAI_MODEL):
+    if usage is None:
+        return
+    totals = session_usage(state)
+    _add(totals, usage.prompt_tokens, usage.completion_tokens)
+    _add(totals["phases"].setdefault(phase, {}), usage.prompt_tokens, usage.completion_tokens)
+    if deployment is not None:
+        # The session's first turn counts it towards the deployment's sessions
+        deployment.record(session_id, phase, usage.prompt_tokens, usage.completion_tokens, model,
+                          new_session=totals["turns"] == 1)
+
+
+class DeploymentBudget:
+    """Token usage of every app process sharing BUDGET_DB_PATH. `recent_turns` holds one row per turn of the
+    last BUDGET_WINDOW, for the cap; older rows are deleted as new ones come in. `phase_totals` keeps
+    the running totals by phase for the export, so neither table grows with the deployment's age."""
+
+    def __init__(self, limit=DEPLOYMENT_TOKEN_BUDGET, window=BUDGET_WINDOW, path=BUDGET_PATH, db_path=BUDGET_DB_PATH):
+        self.limit = limit
+        self.window = window
+        self.path = path
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.ready = False
+        self.changed = False
+        self.exporter = None
+
+    def _connect(self):
+        # The file is created on first use, so importing this module stays free.
+        if not self.ready:
+            with self.lock:
+                if not self.ready:
+                    storage.create(
+                        self.db_path,
+                        "CREATE TABLE IF NOT EXISTS recent_turns ("
+                        " at REAL NOT NULL,"
+                        " prompt_tokens INTEGER NOT NULL,"
+                        " completion_tokens INTEGER NOT NULL)",
+                        "CREATE INDEX IF NOT EXISTS recent_turns_at ON recent_turns (at)",
+                        "CREATE TABLE IF NOT EXISTS phase_totals ("
+                        " phase TEXT PRIMARY KEY,"
+                        " prompt_tokens INTEGER NOT NULL,"
+                        " completion_tokens INTEGER NOT NULL,"
+                        " turns INTEGER NOT NULL,"
+                        " cost REAL NOT NULL,"
+                        # Sessions whose first turn was in this phase
+                        " sessions INTEGER NOT NULL,"
+                        " since REAL NOT NULL)",
+                    )
+                    self.ready = True
+        return storage.connect(self.db_path)
+
+    def record(self, session_id, phase, prompt_tokens, completion_tokens, model=OPENAI_MODEL, new_session=False):
+        turn_cost = cost(model, prompt_tokens, completion_tokens)
+        now = time.time()
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute("DELETE FROM recent_turns WHERE at <= ?", (now - self.window,))
+                    connection.execute("INSERT INTO recent_turns (at, prompt_tokens, completion_tokens) VALUES (?, ?, ?)",
+                                       (now, prompt_tokens, completion_tokens))
+                    connection.execute(
+                        "INSERT INTO phase_totals (phase, prompt_tokens, completion_tokens, turns, cost, sessions, since)"
+                        " VALUES (?, ?, ?, 1, ?, ?, ?)"
+                        " ON CONFLICT(phase) DO UPDATE SET"
+                        " prompt_tokens = prompt_tokens + excluded.prompt_tokens,"
+                        " completion_tokens = completion_tokens + excluded.completion_tokens,"
+                        " turns = turns + 1, cost = cost + excluded.cost, sessions = sessions + excluded.sessions",
+                        (phase, prompt_tokens, completion_tokens, turn_cost, int(bool(session_id and new_session)), now),
+                    )
+            finally:
+                connection.close()
+            used = self.used()
+        except sqlite3.Error as e:
+            # The reply the student is reading matters more than the books.
+            print(f"Deployment budget write failed: {e}")
+            metrics.registry.inc("debate_budget_write_errors_total")
+            return
+        metrics.registry.inc("debate_budget_tokens_total", prompt_tokens, type="prompt", phase=phase)
+        metrics.registry.inc("debate_budget_tokens_total", completion_tokens, type="completion", phase=phase)
+        metrics.registry.inc("debate_cost_dollars_total", turn_cost, phase=phase)
+        metrics.registry.set("debate_budget_window_tokens", used)
+        if self.limit:
+            metrics.registry.set("debate_budget_remaining_tokens", max(0, self.limit - used))
+        self.changed = True
+        self._start_exporter()
+
+    def used(self):
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM recent_turns WHERE at > ?",
+                (time.time() - self.window,),
+            ).fetchone()
+        finally:
+            connection.close()
+        return row[0]
+
+    def snapshot(self):
+        used = self.used()
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT phase, prompt_tokens, completion_tokens, turns, cost, sessions, since FROM phase_totals"
+            ).fetchall()
+        finally:
+            connection.close()
+        phases = {
+            phase: {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "turns": turns, "cost": phase_cost}
+            for phase, prompt_tokens, completion_tokens, turns, phase_cost, _, _ in rows
+        }
+        sessions = sum(row[5] for row in rows)
+        tokens = sum(_used(totals) for totals in phases.values())
+        total_cost = sum(totals["cost"] for totals in phases.values())
+        return {
+            "updated": time.time(),
+            "since": min((row[6] for row in rows), default=None),
+            "window_seconds": self.window,
+            "limit": self.limit,
+            "window_tokens": used,
+            "remaining": max(0, self.limit - used) if self.limit else None,
+            "sessions": sessions,
+            "tokens": tokens,
+            "cost": total_cost,
+            # Averages per session that used the model, for forecasting a cohort
+            "per_session": {
+                "tokens": tokens / sessions if sessions else None,
+                "cost": total_cost / sessions if sessions else None,
+            },
+            "phases": phases,
+        }
+
+    def export(self):
+        snapshot = self.snapshot()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _start_exporter(self):
+        # Like session writes (see session_store.WriteBehindStore), the export runs on a thread of its
+        # own rather than on a student's rerun. The snapshot covers every process, so it doesn't
+        # matter which one wrote it last.
+        if not self.path or self.exporter is not None:
+            return
+        with self.lock:
+            if self.exporter is None:
+                self.exporter = threading.Thread(target=self._run_exporter, name="budget-exporter", daemon=True)
+                self.exporter.start()
+                atexit.register(self.export_changes)
+
+    def export_changes(self):
+        if not self.changed:
+            return
+        self.changed = False
+        try:
+            self.export()
+        except (OSError, sqlite3.Error) as e:
+            self.changed = True
+            print(f"Budget export failed: {e}")
+
+    def _run_exporter(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.export_changes()
+
+
+# One per process, like metrics.registry; the usage behind it is shared
+deployment = DeploymentBudget()
+
+
+def forecast(snapshot, students):
+    per_session = snapshot["per_session"]
+    if per_session["tokens"] is None:
+        return None
+    return {"students": students, "tokens": per_session["tokens"] * students, "cost": per_session["cost"] * students}
+
+
+if __name__ == "__main__":
+    # python budget.py forecast 120   -> expected tokens and cost for a cohort of 120 students
+    if len(sys.argv) != 3 or sys.argv[1] != "forecast":
+        print("Usage: python budget.py forecast <students>")
+        sys.exit(1)
+    snapshot = deployment.snapshot()
+    estimate = forecast(snapshot, int(sys.argv[2]))
+    if estimate is None:
+        print(f"No usage recorded in {BUDGET_DB_PATH} yet")
+        sys.exit(1)
+    print(f"{estimate['students']} students: about {estimate['tokens']:,.0f} tokens, ${estimate['cost']:,.2f} "
+          f"(from {snapshot['sessions']} sessions)")
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import metrics
+from config import *
+from resilience import call_with_retry
+
+# Context budget. Once the conversation sent with a turn grows past CONTEXT_TOKEN_BUDGET, everything
+# but the last CONTEXT_KEEP_MESSAGES messages is folded into a rolling summary. The summary is
+# extended incrementally (only newly evicted messages are summarized) and kept in session state;
+# identical summarization steps are shared across sessions through a small in-process cache.
+
+_summary_cache = OrderedDict()
+_summary_lock = threading.Lock()
+
+
+def estimate_tokens(messages):
+    # About four characters per token, plus a few tokens of per-message framing.
+    return sum(len(message.get("content") or "") // 4 + 4 for message in messages)
+
+
+def _render(messages):
+    return "\n\n".join(f"{message['role'].upper()}: {message['content']}" for message in messages)
+
+
+class Compactor:
+    def __init__(self, client, state):
+        self.client = client
+        self.state = state
+
+    def compact(self, history, phase=""):
+        """Return (summary, recent, usage): the summary text (None if no compaction), the messages to send,
+        and the token usage of the summarization call made for it (None if none was needed)."""
+        estimate = estimate_tokens(history)
+        metrics.registry.observe("debate_context_tokens_estimate", estimate, buckets=metrics.TOKEN_BUCKETS, phase=phase)
+        if estimate <= CONTEXT_TOKEN_BUDGET or len(history) <= CONTEXT_KEEP_MESSAGES:
+            return None, history, None
+
+        older = history[:-CONTEXT_KEEP_MESSAGES]
+        recent = history[-CONTEXT_KEEP_MESSAGES:]
+        summary = self.state.get('context_summary') or {"covered": 0, "text": ""}
+        if summary["covered"] > len(older):
+            # The conversation was rewound (e.g. restored elsewhere); start the summary over.
+            summary = {"covered": 0, "text": ""}
+        usage = None
+        if summary["covered"] < len(older):
+            text, usage = self._extend(summary["text"], older[summary["covered"]:])
+            summary = {"covered": len(older), "text": text}
+            self.state['context_summary'] = summary
+            metrics.registry.inc("debate_compactions_total", phase=phase)
+        return summary["text"], recent, usage
+
+    def _extend(self, previous, messages):
+        key = hashlib.sha256(json.dumps([previous, messages]).encode("utf-8")).hexdigest()
+        with _summary_lock:
+            if key in _summary_cache:
+                _summary_cache.move_to_end(key)
+                return _summary_cache[key], None
+
+        prompt = f"Summary so far:\n{previous or '(none)'}\n\nNew turns:\n{_render(messages)}"
+        response = call_with_retry(
+            self.client.chat.completions.create,
+            "chat.completions.create",
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
+        text = (response.choices[0].message.content or "").strip()
+
+        with _summary_lock:
+            _summary_cache[key] = text
+            while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+                _summary_cache.popitem(last=False)
+        return text, response.usage
@@ -41,6 +41,8 @@ PHASES = {
     "user_name": {
         "type": "text_input",
         "label": """What is your name?""",
+        "speculative": True,
+        "personal": True,
         "instructions": """The user will provide you their name. In one sentence only, welcome them by name and end your statement with 'Let's try a friendly debate in order to increase your understanding and fluency in the topic.'""",
         "allow_skip": False,
         "scored": False,
@@ -51,6 +53,8 @@ PHASES = {
         "options": ['Telemedicine: I believe that the rise in telemedicine will improve health outcomes.', 'Telemedicine: I believe that the rise in telemedicine will harm health outcomes.', 'Wearables: I believe the benefits of wearable health technologies outweigh the risk of data breaches', 'Wearables: I believe the risk of data breaches outweigh the benefits of wearable health technologies.', 'Health Data Ownership: I believe that patients should have autonomy and privacy over their personal information.', 'Health Data Ownership: I believe that health information can be shared in order to improve individual and public health outcomes.'],
         "placeholder": "Select debate topic",
         "allow_skip": False,
+        "cache_opening": True,
+        "speculative": True,
         "instructions": """The user will provide you a topic and their stance on the topic. Take the opposite stance, and generate an introductory statement for the debate. Ensure your statement is clear, evidence-based, and structured to provoke thoughtful discourse. End your statement with 'Why did you choose the stance you chose?'""",
     },
     "round_1": {
@@ -61,6 +65,7 @@ PHASES = {
         "value": """The rise in telemedicine is poised to significantly improve health outcomes for several reasons. First, it greatly increases accessibility to healthcare, especially for individuals in remote or underserved areas who might otherwise face significant barriers to accessing medical services. By enabling patients to consult with doctors via video or phone, telemedicine reduces travel time and associated costs, making it easier for patients to seek care promptly. Secondly, telemedicine supports the continuous monitoring of chronic conditions, allowing for timely adjustments in treatment and preventing complications. This proactive approach can lead to better overall management of chronic diseases and improved long-term health outcomes. Additionally, telemedicine can alleviate the strain on overburdened healthcare facilities by handling routine consultations online, thus improving the quality and speed of both virtual and in-person care services. Overall, the integration of telemedicine into healthcare systems promises a more accessible, efficient, and patient-centered approach to medical care, leading to enhanced health outcomes.""",
         "scored": False,
         "allow_skip": False,
+        "dedup": True,
         "user_input": "",
     },
     "round_2": {
@@ -81,22 +86,161 @@ Regular Quality Assessments and Feedback Mechanisms: Regularly assess the qualit
 By tackling these challenges through strategic initiatives and policies, the potential of telemedicine to enhance healthcare accessibility and effectiveness can be fully realized without sacrificing the quality of care.""",
         "scored_phase": False,
         "rubric": "",
+        "prefilter": {},
         "minimum_score": 0,
         "allow_skip": False,
+        "dedup": True,
         "user_input": "",
     }
 }
 
+######## DEBATES #############
+# PHASES above is the "default" debate. Each <name>.json file in DEBATES_DIR (or <name>.yaml / .yml,
+# with PyYAML installed) adds a debate opened with ?debate=<name>: a "phases" mapping in the same
+# format as PHASES, plus an optional "title" and "intro". Run `python debates.py` to check them.
+# Files are checked for changes at most every DEBATE_RELOAD_INTERVAL seconds.
+DEBATES_DIR = "debates"
+DEBATE_RELOAD_INTERVAL = 2
+# Shown when ?debate= names a debate that doesn't exist or whose file doesn't load
+DEBATE_UNAVAILABLE_MESSAGE = "This debate isn't available. Please check the link you were given."
+
 ######## AI CONFIGURATION #############
+# "assistants" keeps the conversation in an Assistants API thread; "chat" keeps it in session state
+# and streams each turn from Chat Completions in a single request.
+AI_BACKEND = "assistants"
 OPENAI_MODEL = "gpt-4-turbo"
 ASSISTANT_ID = "asst_SLSuT2rtar3Aalu0qUPfqTnf"
 ASSISTANT_THREAD = ""
+# Seconds the resolved assistant is shared across sessions before it is retrieved again. With
+# SCORING_DEBUG_MODE on, the debug panel also has a button to re-fetch it in that process right away.
+ASSISTANT_CACHE_TTL = 3600
 FREQUENCY_PENALTY = 0
 MAX_TOKENS = 1000
 PRESENCE_PENALTY = 0
 TEMPERATURE = 1
 TOP_P = 1
 
+# Streaming responses are redrawn at most every STREAM_FLUSH_INTERVAL seconds or STREAM_FLUSH_CHARS characters
+STREAM_FLUSH_INTERVAL = 0.05
+STREAM_FLUSH_CHARS = 200
+# Cached replies are replayed in chunks of STREAM_REPLAY_CHUNK characters every STREAM_REPLAY_DELAY seconds
+STREAM_REPLAY_CHUNK = 40
+STREAM_REPLAY_DELAY = 0.02
+# Completed phases are drawn from cached read-only fragments; this many are kept per process
+TRANSCRIPT_CACHE_SIZE = 4096
+
+# Opening statements for phases with "cache_opening" are cached on disk, OPENING_CACHE_VARIANTS per option.
+# Warm the cache with `python opening_cache.py warm`, or set OPENING_CACHE_PREWARM to warm it at startup.
+OPENING_CACHE_DIR = ".cache/openings"
+OPENING_CACHE_VARIANTS = 3
+OPENING_CACHE_PREWARM = False
+
+# Replies for phases marked "dedup" are cached by the conversation so far (every earlier input except
+# phases marked "personal", this phase's input and the model settings), so students who submit the same
+# thing, such as an unchanged prefilled essay, get the stored reply. Set RESPONSE_CACHE to False to disable.
+RESPONSE_CACHE = True
+RESPONSE_CACHE_DIR = ".cache/responses"
+# Entries older than RESPONSE_CACHE_TTL seconds are regenerated
+RESPONSE_CACHE_TTL = 7 * 24 * 3600
+# Most recently used replies kept in memory per process, and the cap on the directory's size
+RESPONSE_CACHE_MEMORY_ENTRIES = 1000
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+# Opt-in: start the reply for phases marked "speculative" as soon as their input changes, before Submit.
+# Stale guesses are cancelled, but every guess still costs tokens.
+SPECULATIVE_PREFETCH = False
+SPECULATIVE_WORKERS = 8
+SPECULATIVE_WAIT_TIMEOUT = 60
+
+######## ADMISSION CONTROL #############
+# Process-wide limits on model requests. Turns beyond them wait in a fair queue (round-robin across
+# sessions) and the student sees their position. Set a per-minute limit to 0 to disable it.
+MAX_CONCURRENT_REQUESTS = 16
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 300000
+QUEUE_POLL_INTERVAL = 0.25
+
+######## RESILIENCE #############
+# Rate limits, 5xx errors and dropped connections are retried with jittered exponential backoff.
+# After RETRY_BREAKER_THRESHOLD consecutive failures the circuit breaker opens, and for
+# RETRY_BREAKER_COOLDOWN seconds students get a friendly error instead of a wait.
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8
+RETRY_BREAKER_THRESHOLD = 5
+RETRY_BREAKER_COOLDOWN = 30
+# How long a turn whose stream dropped is polled for before giving up, and how often
+RESUME_TIMEOUT = 120
+RESUME_POLL_INTERVAL = 0.5
+# Runs whose reply nobody will read (the page reran or the tab closed mid-stream) are cancelled by
+# RUN_CANCEL_WORKERS background threads. Closed browser sessions are looked for every RUN_SWEEP_INTERVAL seconds.
+RUN_CANCEL_WORKERS = 4
+RUN_SWEEP_INTERVAL = 10
+# Shown when a turn still fails after retrying. The student's input is kept, so Submit tries again.
+SERVICE_UNAVAILABLE_MESSAGE = "The AI debate partner is having trouble responding right now. Please wait a moment and press Submit again."
+
+######## SESSION STORE #############
+# Debate sessions are saved outside the app process, so a student can pick up where they left off on
+# any worker or after a restart: the page URL carries ?session=<id>. "sqlite" keeps them in
+# SESSION_DB_PATH; None keeps sessions in memory only.
+SESSION_STORE = "sqlite"
+SESSION_DB_PATH = ".cache/sessions.sqlite3"
+# Changed sessions are written in one batch by a background thread at most this often (seconds)
+SESSION_FLUSH_INTERVAL = 1.0
+# Sessions whose last written snapshot is remembered, so an unchanged rerun isn't written again
+SESSION_SAVED_CACHE_SIZE = 10000
+
+######## CONTEXT BUDGET #############
+# Once the conversation sent with a turn is estimated above CONTEXT_TOKEN_BUDGET tokens, all but the
+# last CONTEXT_KEEP_MESSAGES messages are replaced by a rolling summary, so prompt size stays bounded
+# however many phases there are.
+CONTEXT_COMPACTION = True
+CONTEXT_TOKEN_BUDGET = 3000
+CONTEXT_KEEP_MESSAGES = 4
+SUMMARY_MODEL = "gpt-4o-mini"
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_CACHE_SIZE = 512
+SUMMARY_INSTRUCTIONS = """You maintain a running summary of a debate between a student (USER) and an AI debate partner (ASSISTANT). Merge the new turns into the summary so far. Keep the topic, each side's stance, every distinct argument and piece of evidence, and any feedback given. Write at most 200 words."""
+
+######## TOKEN BUDGET #############
+# Token usage (prompt + completion) is totalled per session, per phase within a session, and for the
+# whole deployment (every worker process sharing BUDGET_DB_PATH) over a rolling BUDGET_WINDOW. 0 disables a budget. When less than
+# BUDGET_DEGRADE_FRACTION of a budget is left, replies are kept short; when not even a short reply
+# fits, the student gets BUDGET_EXHAUSTED_MESSAGE instead. Scoring runs are never refused.
+SESSION_TOKEN_BUDGET = 60000
+# Stops a student looping on a failing scored phase from spending without limit
+PHASE_TOKEN_BUDGET = 25000
+DEPLOYMENT_TOKEN_BUDGET = 0
+BUDGET_WINDOW = 24 * 3600
+BUDGET_DEGRADE_FRACTION = 0.2
+BUDGET_DEGRADED_MAX_TOKENS = 300
+BUDGET_DEGRADED_INSTRUCTIONS = "Keep this reply short: three sentences at most."
+BUDGET_EXHAUSTED_MESSAGE = "You've used all the AI feedback available for this debate. Please let your instructor know if you need more."
+# Each Assistants run may read at most this many prompt tokens (replies are capped at MAX_TOKENS)
+MAX_PROMPT_TOKENS = 20000
+# Dollars per million tokens, (prompt, completion), for the cost estimates in the budget export
+TOKEN_PRICES = {
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o-mini": (0.15, 0.6),
+}
+# Deployment usage (the last BUDGET_WINDOW of turns, and running totals per phase), shared by worker
+# processes on the same host
+BUDGET_DB_PATH = ".cache/budget.sqlite3"
+# Deployment totals (tokens and cost per phase and per session), exported in the background for dashboards;
+# `python budget.py forecast <students>` reads BUDGET_DB_PATH directly
+BUDGET_PATH = ".cache/budget.json"
+
+######## METRICS #############
+# Fraction of turns and reruns that are timed. Lower it in production to make instrumentation nearly free.
+METRICS_SAMPLE_RATE = 1.0
+# Prometheus text exposition file, rewritten at most every METRICS_FLUSH_INTERVAL seconds
+METRICS_PATH = ".cache/metrics.prom"
+METRICS_FLUSH_INTERVAL = 15
+# Log each sampled turn and rerun as a JSON line on stdout
+METRICS_JSON_LOGS = True
+# Records kept per session for the debug panel (shown when SCORING_DEBUG_MODE is on)
+METRICS_SESSION_RECORDS = 50
+
 ########## AI ASSISTANT CONFIGURATION #######
 ASSISTANT_NAME = "Debate Partner"
 ASSISTANT_INSTRUCTIONS = """
@@ -0,0 +1,260 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+import metrics
+from config import *
+from phases import WIDGET_ARGS, compile_phases
+
+# Debate definitions. "default" is PHASES in config.py; every <name>.json file in DEBATES_DIR (or
+# <name>.yaml / <name>.yml when PyYAML is installed) adds a debate opened with ?debate=<name>, so one
+# deployment can serve several courses. A definition is validated once when it is loaded, frozen
+# into an immutable Debate with its phases compiled, and kept in memory. Files are checked for
+# changes at most every DEBATE_RELOAD_INTERVAL seconds; a change that fails validation is reported
+# and the last good version stays in service.
+#
+# Each debate has its own namespace in the opening and response caches. Load time and in-memory
+# size are recorded per debate, and `python debates.py` checks and measures every file.
+
+DEFAULT_DEBATE = "default"
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+EXTENSIONS = (".json", ".yaml", ".yml")
+
+FIELD_TYPES = ("text_input", "text_area", "warning", "button", "radio", "markdown", "selectbox")
+DEBATE_KEYS = {"title", "intro", "phases"}
+PHASE_KEYS = set(WIDGET_ARGS) | {
+    "type", "instructions", "allow_skip", "no_submission", "button_label", "user_input",
+    "scored", "scored_phase", "rubric", "minimum_score", "prefilter",
+    "speculative", "cache_opening", "dedup", "personal",
+}
+PREFILTER_KEYS = {"keywords"} | {
+    f"{bound}_{measure}" for bound in ("min", "pass") for measure in ("words", "sentences", "paragraphs", "keywords")
+}
+
+Debate = namedtuple("Debate", "name title intro phases compiled namespace path mtime load_seconds size_bytes")
+
+
+class DebateConfigError(ValueError):
+    """A debate definition is malformed."""
+
+
+class DebateNotFound(LookupError):
+    """No debate definition has this name."""
+
+
+def freeze(value):
+    # Dicts become read-only mappings and lists become tuples, all the way down.
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def deep_size(value, seen=None):
+    """Approximate bytes held by a loaded definition."""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (dict, MappingProxyType)):
+        size += sum(deep_size(key, seen) + deep_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (tuple, list)):
+        size += sum(deep_size(item, seen) for item in value)
+    return size
+
+
+def validate(data, source):
+    def fail(problem):
+        raise DebateConfigError(f"{source}: {problem}")
+
+    if not isinstance(data, dict):
+        fail("a debate definition must be a mapping with a 'phases' key")
+    unknown = set(data) - DEBATE_KEYS
+    if unknown:
+        fail(f"unknown keys {sorted(unknown)}")
+    for key in ("title", "intro"):
+        if key in data and not isinstance(data[key], str):
+            fail(f"'{key}' must be text")
+    phases = data.get("phases")
+    if not isinstance(phases, dict) or not phases:
+        fail("'phases' must be a non-empty mapping of phase name to phase")
+    for name, phase in phases.items():
+        where = f"phase {name!r}"
+        if not isinstance(name, str) or not NAME_PATTERN.match(name):
+            fail(f"{where}: names may only use letters, digits, '_' and '-'")
+        if not isinstance(phase, dict):
+            fail(f"{where} must be a mapping")
+        unknown = set(phase) - PHASE_KEYS
+        if unknown:
+            fail(f"{where}: unknown keys {sorted(unknown)}")
+        field_type = phase.get("type")
+        if field_type not in FIELD_TYPES:
+            fail(f"{where}: 'type' must be one of {', '.join(FIELD_TYPES)}")
+        if field_type == "markdown":
+            if not isinstance(phase.get("body"), str):
+                fail(f"{where}: a markdown phase needs a 'body'")
+            continue
+        if not isinstance(phase.get("label"), str) or not phase["label"]:
+            fail(f"{where}: needs a 'label'")
+        if field_type in ("radio", "selectbox"):
+            options = phase.get("options")
+            if not isinstance(options, list) or not options or not all(isinstance(o, str) for o in options):
+                fail(f"{where}: needs a non-empty list of text 'options'")
+        for key in ("instructions", "value", "rubric", "button_label", "placeholder"):
+            if key in phase and not isinstance(phase[key], str):
+                fail(f"{where}: '{key}' must be text")
+        if "minimum_score" in phase and (isinstance(phase["minimum_score"], bool) or
+                                         not isinstance(phase["minimum_score"], (int, float))):
+            fail(f"{where}: 'minimum_score' must be a number")
+        if phase.get("scored_phase") and not phase.get("rubric"):
+            fail(f"{where}: a scored phase needs a 'rubric'")
+        if phase.get("scored_phase") and "minimum_score" not in phase:
+            # Without it nothing passes, not even an answer the pre-filter passed.
+            fail(f"{where}: a scored phase needs a 'minimum_score'")
+        prefilter = phase.get("prefilter", {})
+        if not isinstance(prefilter, dict):
+            fail(f"{where}: 'prefilter' must be a mapping")
+        unknown = set(prefilter) - PREFILTER_KEYS
+        if unknown:
+            fail(f"{where}: unknown prefilter keys {sorted(unknown)}")
+    if all(phase["type"] == "markdown" for phase in phases.values()):
+        fail("needs at least one phase the student answers")
+
+
+def compile_debate(name, data, source, path=None, mtime=None):
+    started = time.perf_counter()
+    validate(data, source)
+    phases = freeze(data["phases"])
+    debate = Debate(
+        name=name,
+        title=data.get("title", APP_TITLE),
+        intro=data.get("intro", APP_INTRO),
+        phases=phases,
+        compiled=compile_phases(phases),
+        # The default debate keeps the cache locations it had before there were several.
+        namespace="" if name == DEFAULT_DEBATE else name,
+        path=path,
+        mtime=mtime,
+        load_seconds=None,
+        size_bytes=None,
+    )
+    debate = debate._replace(load_seconds=time.perf_counter() - started, size_bytes=deep_size(debate))
+    metrics.registry.inc("debate_definition_loads_total", debate=name, result="ok")
+    metrics.registry.set("debate_definition_load_seconds", debate.load_seconds, debate=name)
+    metrics.registry.set("debate_definition_bytes", debate.size_bytes, debate=name)
+    return debate
+
+
+def parse(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".json"):
+        try:
+            return json.loads(text)
+        except ValueError as e:
+            raise DebateConfigError(f"{path}: invalid JSON ({e})")
+    try:
+        import yaml
+    except ImportError:
+        raise DebateConfigError(f"{path}: reading YAML needs PyYAML (pip install pyyaml), or use JSON")
+    try:
+        return yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        raise DebateConfigError(f"{path}: invalid YAML ({e})")
+
+
+def load_file(name, path):
+    # Parsing counts towards the load time; compile_debate times the rest.
+    started = time.perf_counter()
+    mtime = os.stat(path).st_mtime_ns
+    data = parse(path)
+    parsed = time.perf_counter() - started
+    debate = compile_debate(name, data, path, path, mtime)
+    debate = debate._replace(load_seconds=debate.load_seconds + parsed)
+    metrics.registry.set("debate_definition_load_seconds", debate.load_seconds, debate=name)
+    return debate
+
+
+class DebateLibrary:
+    """Loaded debates by name, reloaded when their file changes."""
+
+    def __init__(self, directory=DEBATES_DIR, reload_interval=DEBATE_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.debates = {DEFAULT_DEBATE: compile_debate(DEFAULT_DEBATE, {"phases": PHASES}, "config.PHASES")}
+        self.checked = {}
+
+    def path_for(self, name):
+        for extension in EXTENSIONS:
+            path = os.path.join(self.directory, name + extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def names(self):
+        names = {DEFAULT_DEBATE}
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                name, extension = os.path.splitext(filename)
+                if extension in EXTENSIONS and NAME_PATTERN.match(name):
+                    names.add(name)
+        return sorted(names)
+
+    def get(self, name=None):
+        name = name or DEFAULT_DEBATE
+        if name == DEFAULT_DEBATE:
+            return self.debates[DEFAULT_DEBATE]
+        if not NAME_PATTERN.match(name):
+            raise DebateNotFound(name)
+        with self.lock:
+            cached = self.debates.get(name)
+            now = time.monotonic()
+            if cached is not None and now - self.checked.get(name, 0) < self.reload_interval:
+                return cached
+            self.checked[name] = now
+            path = self.path_for(name)
+            if path is None:
+                self.debates.pop(name, None)
+                raise DebateNotFound(name)
+            if cached is not None and cached.path == path and cached.mtime == os.stat(path).st_mtime_ns:
+                return cached
+            try:
+                debate = load_file(name, path)
+            except (OSError, DebateConfigError) as e:
+                metrics.registry.inc("debate_definition_loads_total", debate=name, result="invalid")
+                if cached is None:
+                    raise
+                # Keep serving the last good version until the file is fixed.
+                print(f"Keeping the loaded {name!r} debate: {e}")
+                return cached
+            if cached is not None:
+                print(f"Reloaded debate {name!r} from {path}")
+            self.debates[name] = debate
+            return debate
+
+
+# Process-wide, like metrics.registry
+library = DebateLibrary()
+
+
+if __name__ == "__main__":
+    # python debates.py   -> validate every definition and show its load time and size
+    failed = False
+    for name in library.names():
+        try:
+            debate = library.get(name)
+        except DebateConfigError as e:
+            failed = True
+            print(f"{name:>20}: INVALID {e}")
+            continue
+        print(f"{name:>20}: {len(debate.compiled)} phases, loaded in {debate.load_seconds*1000:.1f} ms, "
+              f"{debate.size_bytes/1024:.1f} KB  ({debate.path or 'config.py'})")
+    sys.exit(1 if failed else 0)
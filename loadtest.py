@@ -0,0 +1,241 @@
+"""Drive simulated students through every phase of a debate and report latency percentiles.
+
+Each student is a headless Streamlit session (streamlit.testing AppTest) running main.py in this
+process, so rerun time, CPU and memory are the app's own. Run it against the stand-in server:
+
+    python loadtest.py --students 20 --start-server
+
+or against any server already running at --base-url. Nothing here is meant to touch the real API.
+--debate opens the students on ?debate=<name> instead of the default debate in config.PHASES.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import config
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {"ttft": [], "turn": [], "rerun": []}
+        self.errors = []
+        self.completed = 0
+
+    def add(self, name, value):
+        with self.lock:
+            self.samples[name].append(value)
+
+
+def essay(phase_name, student, paragraphs=3):
+    sentence = (f"Student {student} argues in {phase_name} that the evidence supports their position, "
+                "because the costs and benefits fall on different groups and the data over time point one way.")
+    return "\n\n".join(" ".join([sentence] * 3) for _ in range(paragraphs))
+
+
+def fill_phase(at, phase_name, phase_dict, student):
+    # Set the active (last rendered) widget of the phase's type, the way a student would.
+    field_type = phase_dict["type"]
+    if field_type == "text_input":
+        at.text_input[-1].input(f"Student {student}")
+    elif field_type == "text_area":
+        # Most students submit the prefilled essay unchanged. Without one, write an argument long
+        # enough to get past a scored phase's pre-filter.
+        at.text_area[-1].input(phase_dict.get("value") or essay(phase_name, student))
+    elif field_type == "selectbox":
+        at.selectbox[-1].select(random.choice(phase_dict["options"]))
+    elif field_type == "radio":
+        at.radio[-1].set_value(random.choice(phase_dict["options"]))
+
+
+def share_test_runtime():
+    # AppTest swaps a mock Runtime and the global.appTest config option in and out of process-wide
+    # globals around each run, which races when several sessions run at once. Set them once instead.
+    # It also compiles the script afresh for every run; compiling concurrently trips a CPython 3.11
+    # AST bug, so share one script cache the way a real Streamlit server does.
+    from contextlib import nullcontext
+
+    from streamlit import config
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    config.set_option("global.appTest", True)
+    app_test.patch_config_options = lambda options: nullcontext()
+    script_cache = app_test.ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+    last = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            last["runtime"] = cls._instance
+        return cls._instance or last["runtime"]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or "runtime" in last)
+
+
+def run_student(student, results, timeout, think_time, debate):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(HERE, "main.py"), default_timeout=timeout)
+    if debate.name != "default":
+        at.query_params["debate"] = debate.name
+    try:
+        started = time.perf_counter()
+        at.run()
+        results.add("rerun", time.perf_counter() - started)
+        for index, (phase_name, phase_dict) in enumerate(debate.phases.items()):
+            if phase_dict["type"] == "markdown":
+                continue
+            fill_phase(at, phase_name, phase_dict, student)
+            # Setting a widget value reruns the script, like a real widget change does.
+            started = time.perf_counter()
+            at.run()
+            results.add("rerun", time.perf_counter() - started)
+            time.sleep(think_time)
+
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+            started = time.perf_counter()
+            at.button(key=f"submit {index}").click().run()
+            results.add("turn", time.perf_counter() - started)
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+            ttft = at.session_state[f"{phase_name}_ai_ttft"] if f"{phase_name}_ai_ttft" in at.session_state else None
+            if ttft is not None:
+                results.add("ttft", ttft)
+        with results.lock:
+            results.completed += 1
+    except Exception as e:
+        with results.lock:
+            results.errors.append(f"student {student}: {e}")
+
+
+def start_server(args):
+    command = [sys.executable, os.path.join(HERE, "standin_server.py"), "--port", str(args.port)] + args.server_args
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # Wait for the listening line so the first request doesn't race the bind.
+    process.stdout.readline()
+    return process
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=10)
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds between student arrivals")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds a student spends before Submit")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds allowed per script run")
+    parser.add_argument("--base-url", default=None, help="API base URL (default: the stand-in on --port)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--start-server", action="store_true", help="launch standin_server.py for the run")
+    parser.add_argument("--backend", choices=("assistants", "chat"), default=None, help="override config.AI_BACKEND")
+    parser.add_argument("--debate", default=None, help="debate definition to run (default: config.PHASES)")
+    parser.add_argument("--json", dest="json_path", default=None, help="also write the report as JSON")
+    parser.add_argument("server_args", nargs="*", help="extra standin_server.py arguments, after --")
+    args = parser.parse_args(argv)
+
+    os.environ["OPENAI_BASE_URL"] = args.base_url or f"http://127.0.0.1:{args.port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stand-in")
+    server = start_server(args) if args.start_server else None
+
+    if args.backend:
+        # main.py re-imports its settings from the already-loaded config module on every run.
+        config.AI_BACKEND = args.backend
+    share_test_runtime()
+    # Stand-in usage goes to a budget of its own, not the deployment's shared totals.
+    import budget
+    budget.deployment = budget.DeploymentBudget(path=None, db_path=os.path.join(tempfile.mkdtemp(), "budget.sqlite3"))
+    from debates import library
+    debate = library.get(args.debate)
+    results = Results()
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    try:
+        workers = []
+        for student in range(args.students):
+            worker = threading.Thread(target=run_student, args=(student, results, args.timeout, args.think_time, debate))
+            worker.start()
+            workers.append(worker)
+            time.sleep(args.ramp)
+        for worker in workers:
+            worker.join()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+    # The app's metrics live in this process; write them out so the run leaves a full exposition file.
+    import metrics
+    import response_cache
+    metrics.registry.flush(force=True)
+
+    report = {
+        "backend": config.AI_BACKEND,
+        "debate": debate.name,
+        "students": args.students,
+        "completed": results.completed,
+        "errors": results.errors,
+        "wall_seconds": wall,
+        "time_to_first_token": summarize(results.samples["ttft"]),
+        "turn_latency": summarize(results.samples["turn"]),
+        "rerun_time": summarize(results.samples["rerun"]),
+        "app_cpu_seconds": cpu,
+        "app_cpu_percent": 100.0 * cpu / wall if wall else None,
+        # ru_maxrss is reported in kilobytes on Linux.
+        "app_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "response_cache": response_cache.hit_rates(metrics.registry),
+        "budget": budget.deployment.snapshot(),
+    }
+
+    print(f"{results.completed}/{args.students} students completed in {wall:.1f}s")
+    for name in ("time_to_first_token", "turn_latency", "rerun_time"):
+        stats = report[name]
+        if stats["count"]:
+            print(f"{name:>20}: p50 {stats['p50']*1000:8.1f} ms  p95 {stats['p95']*1000:8.1f} ms  "
+                  f"p99 {stats['p99']*1000:8.1f} ms  (n={stats['count']})")
+    print(f"{'app cpu':>20}: {cpu:.1f}s ({report['app_cpu_percent']:.0f}% of one core)")
+    print(f"{'app peak rss':>20}: {report['app_peak_rss_mb']:.0f} MB")
+    spend = report["budget"]
+    if spend["sessions"]:
+        print(f"{'model spend':>20}: {spend['tokens']} tokens, ${spend['cost']:.4f} "
+              f"({spend['per_session']['tokens']:.0f} tokens, ${spend['per_session']['cost']:.4f} per session)")
+    for variant, rate in sorted(report["response_cache"].items()):
+        print(f"{'cache ' + variant:>20}: {rate['hits']}/{rate['lookups']} hits ({rate['hit_rate']:.0%})")
+    for error in results.errors[:10]:
+        print(f"ERROR {error}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if not results.errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,30 @@
-import openai
 import os
-from dotenv import find_dotenv, load_dotenv
+from dotenv import load_dotenv
 import json
-import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import streamlit as st
-from streamlit_extras.stylable_container import stylable_container
-from streamlit_extras.let_it_rain import rain
 from contextlib import nullcontext
-from openai import OpenAI, AssistantEventHandler
 from config import *
-
-load_dotenv()
-client = openai.OpenAI()
+from streaming import StreamRenderer
+from opening_cache import opening_key, pick_variant, add_variant, warm_openings
+import response_cache
+from prefetch import Prefetcher
+from scheduler import AdmissionScheduler
+import session_store
+import budget
+import debates
+import transcript as transcripts
+from phases import build_scoring_instructions, extract_score, passed, score_submission
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import metrics
+
+# Only light modules are imported above, so the page can be drawn before anything touches the API.
+# The openai SDK (through backends, compaction, resilience and runs) is imported where it is first
+# needed: when the assistant is resolved, normally off the critical path or on the first Submit.
 
 function_map = {
     "text_input": st.text_input,
@@ -25,222 +38,414 @@ function_map = {
 
 user_input = {}
 
-def build_field(i, phases_dict):
-
-    phase_name = list(phases_dict.keys())[i]
-    phase_dict = list(phases_dict.values())[i]
-    field_type = phase_dict.get("type","")
-    field_label = phase_dict.get("label","")
-    field_body = phase_dict.get("body","")
-    field_value = phase_dict.get("value","")
-    field_max_chars = phase_dict.get("max_chars",None)
-    field_help = phase_dict.get("help","")
-    field_on_click = phase_dict.get("on_click",None)
-    field_options = phase_dict.get("options",[])
-    field_horizontal = phase_dict.get("horizontal",False)
-    field_height = phase_dict.get("height",None)
-    field_unsafe_html = phase_dict.get("unsafe_allow_html", False)
-    field_placeholder = phase_dict.get("placeholder","")
-
-    kwargs = {}
-    if field_label:
-        kwargs['label'] = field_label
-    if field_body:
-        kwargs['body'] = field_body
-    if field_value:
-        kwargs['value'] = field_value
-    if field_options:
-        kwargs['options'] = field_options
-    if field_max_chars:
-        kwargs['max_chars'] = field_max_chars
-    if field_help:
-        kwargs['help'] = field_help
-    if field_on_click:
-        kwargs['on_click'] = field_on_click
-    if field_horizontal:
-        kwargs['horizontal'] = field_horizontal
-    if field_height:
-        kwargs['height'] = field_height
-    if field_unsafe_html:
-        kwargs['unsafe_allow_html'] = field_unsafe_html
-    if field_placeholder:
-        kwargs['placeholder'] = field_placeholder
- 
-    key = f"{phase_name}_phase_status"
-    
-    #If the user has already answered this question:
-    if key in st.session_state and st.session_state[key]:
-        #Write their answer
-        if f"{phase_name}_user_input" in st.session_state:
-            if field_type != "selectbox":
-                kwargs['value'] = st.session_state[f"{phase_name}_user_input"]
-            kwargs['disabled'] = True
-        
+def build_field(phase):
+    # Only the active phase is a widget; completed phases are drawn from the transcript.
+    my_input_function = function_map[phase.type]
+    user_input[phase.name] = my_input_function(**phase.kwargs)
+
+
+def render_transcript(transcript):
+    # All completed phases so far go out as one element, then the list starts over.
+    if transcript:
+        st.markdown("\n\n".join(transcript), unsafe_allow_html=True)
+        transcript.clear()
+
+
+# Process-wide resources. Streamlit reruns main() on every widget change, so anything
+# that costs a network round trip is resolved once per process and shared by every session.
+@st.cache_resource
+def get_client():
+    import openai
+    load_dotenv()
+    # The client keeps a pooled HTTP connection and is safe to share across sessions.
+    # Retries are handled by resilience.py, so the client's own are turned off.
+    return openai.OpenAI(max_retries=0)
+
+
+@st.cache_resource(show_spinner=False)
+def get_created_assistant_id(name, instructions, tools, model):
+    # With no ASSISTANT_ID, one assistant is created per process and its ID kept for good, so the
+    # TTL below and refresh_assistant() re-retrieve it instead of creating another.
+    metrics.count_round_trip("assistants.create")
+    assistant_obj = get_client().beta.assistants.create(
+        name=name, instructions=instructions, tools=list(tools), model=model
+    )
+    metrics.log({"event": "assistant_created", "assistant": assistant_obj.id, "name": name, "model": model})
+    return assistant_obj.id
+
+
+@st.cache_resource(ttl=ASSISTANT_CACHE_TTL, show_spinner=False)
+def get_assistant(name=ASSISTANT_NAME, instructions=ASSISTANT_INSTRUCTIONS, tools=(), model=OPENAI_MODEL):
+    # Retrieve the configured assistant, or the one this process created if no ID is set.
+    assistant_id = ASSISTANT_ID or get_created_assistant_id(name, instructions, tools, model)
+    metrics.count_round_trip("assistants.retrieve")
+    return get_client().beta.assistants.retrieve(assistant_id=assistant_id)
+
+
+@st.cache_resource(show_spinner=False)
+def start_opening_prewarm(debate_name):
+    # Warm each debate's opening-statement cache once per process, off the request path.
+    from backends import make_backend
+    debate = debates.library.get(debate_name)
+    assistant = get_assistant() if AI_BACKEND == "assistants" else None
+    backend = make_backend(AI_BACKEND, get_client(), assistant, {}, debate.phases)
+    worker = threading.Thread(target=warm_openings, args=(backend, debate.phases, debate.namespace, budget.deployment), daemon=True)
+    worker.start()
+    return worker
+
+
+@st.cache_resource(show_spinner=False)
+def start_bootstrap_prewarm():
+    # Import the SDK and resolve the shared client and assistant in the background once the first
+    # page is drawn, so the first Submit in this process doesn't pay for them.
+    def warm():
+        try:
+            import backends
+            get_client()
+            if AI_BACKEND == "assistants":
+                get_assistant()
+        except Exception as e:
+            print(f"Warming the assistant failed: {e}")
+    worker = threading.Thread(target=warm, name="bootstrap-prewarm", daemon=True)
+    worker.start()
+    return worker
+
+
+@st.cache_resource
+def get_prefetch_executor():
+    # Shared by all sessions; each session keeps at most one speculative run in flight.
+    return ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="prefetch")
+
+
+@st.cache_resource
+def get_response_cache():
+    # The in-memory part of the response cache is shared by all sessions in the process.
+    return response_cache.ResponseCache()
+
 
-    my_input_function = function_map[field_type]
+@st.cache_resource
+def get_scheduler():
+    # One admission queue for the whole process, so a class pressing Submit together shares the rate limit.
+    return AdmissionScheduler()
 
-    with stylable_container(
-        key="large_label",
-        css_styles="""
-            label p {
-                font-weight: bold;
-                font-size: 28px;
-            }
-            """,
-    ):
 
-        user_input[phase_name] = my_input_function(**kwargs)
+@st.cache_resource
+def get_run_tracker():
+    # Knows every run in flight in this process, so orphaned ones can be cancelled.
+    from runs import RunTracker
+    return RunTracker(get_client())
+
+
+@st.cache_resource
+def get_session_store():
+    # One write-behind writer per process; None when sessions aren't persisted.
+    store = session_store.make_store(SESSION_STORE)
+    return session_store.WriteBehindStore(store) if store else None
+
+
+def refresh_assistant():
+    # Drop the cached assistant so the next access re-resolves it (e.g. after editing it on the platform).
+    # Only this process is refreshed; other worker processes pick the change up when their TTL expires.
+    get_assistant.clear()
+    metrics.log({"event": "assistant_refreshed"})
 
 
 class AssistantManager:
-    assistant_id = ASSISTANT_ID
-    thread_id = ASSISTANT_THREAD
-    
-    def __init__(self, model: str = OPENAI_MODEL):
-        self.client = client
-        self.model = OPENAI_MODEL
+
+    def __init__(self, model: str = OPENAI_MODEL, backend: str = AI_BACKEND, phases=PHASES):
+        self.client = get_client()
+        self.model = model
+        self.backend_name = backend
+        self.phases = phases
+        self.backend = None
         self.assistant = None
-        self.thread = None
         self.run = None
         self.summary = None
+        # How the latest model turn went: its budget verdict, and whether the reply was cut off
+        self.last_turn = None
 
-        # Retrieve existing assistant and thread if IDs are already set
-        if AssistantManager.assistant_id:
-            self.assistant = self.client.beta.assistants.retrieve(
-                assistant_id=AssistantManager.assistant_id
-            )
-        if AssistantManager.thread_id:
-            self.thread = self.client.beta.threads.retrieve(
-                thread_id=AssistantManager.thread_id
-            )
+    # The thread belongs to a single student, so it lives in session state rather than on the class.
+    @property
+    def thread(self):
+        return st.session_state.get('thread_obj') or None
 
     def create_assistant(self, name, instructions, tools):
-        if not self.assistant:
-            assistant_obj = self.client.beta.assistants.create(
-                name=name, instructions=instructions, tools=tools, model=self.model
-            )
-            AssistantManager.assistant_id = assistant_obj.id
-            self.assistant = assistant_obj
-            print(f"AssisID:::: {self.assistant.id}")
+        # Only the Assistants backend needs the assistant object. Only the first session in the
+        # process (or the first after the TTL expires) hits the API.
+        from backends import make_backend
+        if self.backend_name == "assistants":
+            self.assistant = get_assistant(name, instructions, tuple(tools), self.model)
+        self.backend = make_backend(self.backend_name, self.client, self.assistant, st.session_state, self.phases)
 
     def create_thread(self):
-        if not self.thread:
-            print(st.session_state['thread_obj'])
-            if st.session_state.thread_obj:
-                print(f"Grabbing existing thread...")
-                thread_obj = st.session_state.thread_obj
-            else:
-                print(f"Creating and saving new thread")
-                thread_obj = self.client.beta.threads.create()
-                st.session_state.thread_obj = thread_obj
-
-            AssistantManager.thread_id = thread_obj.id
-            self.thread = thread_obj
-            print(f"ThreadID::: {self.thread.id}")
-        else:
-            print(f"A thread already exists: {self.thread.id}")
-
-    # Create a MESSAGE within our thread. Indicate if the message is from the user or assistant.
-    def add_message_to_thread(self, role, content):
-        if self.thread:
-            self.client.beta.threads.messages.create(
-                thread_id=self.thread.id, 
-                role=role, 
-                content=content
-            )
-
-    # Create a RUN that sends the thread (with our messages) to the ASSISTANT
-    def run_assistant(self, instructions, current_phase, scoring_run=False, temperature = TEMPERATURE, response_format="auto"):
-        if self.thread and self.assistant:
-
-            # Create a RUN that sends the thread (with our messages) to the ASSISTANT
+        self.backend.start_session()
+
+    # Record an exchange that was answered without the model (e.g. from a cache).
+    def record_exchange(self, user_content, assistant_content):
+        self.backend.record_exchange(user_content, assistant_content)
+
+    # Show an already-known reply as if it were streaming, and store it like a live one.
+    def replay_response(self, text, current_phase):
+        renderer = StreamRenderer(st.info(body="", icon="🤖"))
+        turn = metrics.Turn(session_id(), current_phase, "replay")
+        result = renderer.replay(text)
+        if renderer.first_chunk_at:
+            turn.first_delta_at = renderer.first_chunk_at
+            st_store(renderer.first_chunk_at - turn.started,current_phase,"ai_ttft")
+        record_turn(turn.finish())
+        st_store(result,current_phase,"ai_response")
+        st_store(renderer.flushes,current_phase,"ai_response_flushes")
+        return result
+
+    # True when the latest turn's reply is complete and was written with the full budget, so it can be shared.
+    def full_reply(self):
+        return self.last_turn is not None and self.last_turn["verdict"] == "ok" and not self.last_turn["truncated"]
+
+    # Submit a whole turn in one request: the user's message rides along with the request, and the
+    # phase instructions apply to this turn only instead of being stored in the conversation.
+    def submit_turn(self, phase_instructions, current_phase, user_content=None, scoring_run=False, temperature=TEMPERATURE, response_format="auto"):
+        messages = []
+        if user_content:
+            messages.append({"role": "user", "content": user_content})
+        return self.run_assistant(
+            phase_instructions,
+            current_phase,
+            scoring_run=scoring_run,
+            temperature=temperature,
+            response_format=response_format,
+            additional_messages=messages,
+        )
+
+    # Send the conversation (with our messages) to the model and stream the reply
+    def run_assistant(self, instructions, current_phase, scoring_run=False, temperature = TEMPERATURE, response_format="auto", additional_messages=None):
+        if self.backend:
+            from compaction import estimate_tokens
+            from runs import record_wasted_tokens
+
+            #Check the session, phase and deployment token budgets before anything is shown
+            plan = budget.plan_turn(st.session_state, current_phase, budget.deployment, scoring_run)
+            if plan["verdict"] == "refused":
+                raise budget.BudgetExhausted(plan["scope"])
+            if plan["instructions"]:
+                instructions = f"{instructions or ''}\n\n{plan['instructions']}".strip()
+
+            res_box = None
+            prefix = ""
             if not scoring_run or (scoring_run and SCORING_DEBUG_MODE):
                 res_box = st.info(body="", icon="🤖")
-            report = []
-
-            stream = self.client.beta.threads.runs.create(
-                assistant_id=self.assistant.id,
-                thread_id=self.thread.id,
-                instructions=instructions,
-                temperature=temperature,
-                stream=True
-                )
-
-            context_manager = st.spinner('Checking Score...') if scoring_run else nullcontext()
-
-            with context_manager:
-                for event in stream:
-                    if event.data.object == "thread.message.delta":
-                        #Iterate over content in the delta
-                        for content in event.data.delta.content:
-                            if content.type == 'text':
-                                #Print the value field from text deltas
-                                report.append(content.text.value)
-                                result = "".join(report).strip()
-                                if scoring_run == False:
-                                    res_box.info(body=f'{result}', icon="🤖")
-                                if scoring_run and SCORING_DEBUG_MODE:
-                                    res_box.info(body=f'SCORE (DEBUG MODE): {result}', icon="🤖")
+            if scoring_run:
+                prefix = "SCORE (DEBUG MODE): "
+            renderer = StreamRenderer(res_box, prefix=prefix)
+            turn = metrics.Turn(session_id(), current_phase, "scoring" if scoring_run else "reply")
+
+            #Wait for an admission slot, showing the student their place in line meanwhile
+            wait_box = res_box if res_box is not None else st.empty()
+            def show_position(position):
+                wait_box.info(body=f"Lots of students are debating right now. You are number {position} in line; your reply will start shortly.", icon="⏳")
+            tracker = get_run_tracker()
+            #Wait for this session's abandoned runs to be cancelled, so they don't block the thread
+            tracker.settle(session_id())
+            scheduler = get_scheduler()
+            estimate = estimate_tokens(self.backend.history() + list(additional_messages or [])) + plan["max_tokens"]
+            ticket = scheduler.acquire(session_id(), estimate, on_wait=show_position)
+            if res_box is None:
+                wait_box.empty()
+
+            run_id = None
+            truncated = False
+            try:
+                events = self.backend.stream_turn(
+                    instructions,
+                    additional_messages or [],
+                    temperature=temperature,
+                    response_format=response_format,
+                    persist=not scoring_run,
+                    phase=current_phase,
+                    max_tokens=plan["max_tokens"],
+                    )
 
+                context_manager = st.spinner('Checking Score...') if scoring_run else nullcontext()
+
+                with context_manager:
+                    for kind, value in events:
+                        if kind == "delta":
+                            turn.first_delta()
+                            #Buffer the text; the renderer decides when to redraw
+                            renderer.append(value)
+                        elif kind == "usage":
+                            turn.usage(value)
+                            budget.record_usage(st.session_state, current_phase, value, budget.deployment, session_id())
+                        elif kind == "summary_usage":
+                            #Summarizing older turns for this one counts towards the same budgets
+                            budget.record_usage(st.session_state, current_phase, value, budget.deployment, session_id())
+                        elif kind == "reset":
+                            renderer.reset()
+                            truncated = False
+                        elif kind == "truncated":
+                            truncated = True
+                        elif kind == "run":
+                            run_id = value
+                            ctx = get_script_run_ctx()
+                            tracker.register(session_id(), self.thread.id, run_id, current_phase, ctx.session_id if ctx else None)
+            except Exception:
+                raise
+            except BaseException:
+                #Streamlit interrupts a rerun or a closed session by raising into the script; nobody will read the rest
+                events.close()
+                if run_id:
+                    tracker.abandon(run_id, "interrupted")
+                else:
+                    #Closing the stream stops generation; what was streamed so far is thrown away
+                    record_wasted_tokens(len(renderer.text()) // 4, self.backend_name, current_phase)
+                    metrics.registry.inc("debate_runs_abandoned_total", reason="interrupted")
+                raise
+            finally:
+                if run_id:
+                    tracker.complete(run_id)
+                used_tokens = None
+                if turn.prompt_tokens is not None:
+                    used_tokens = turn.prompt_tokens + turn.completion_tokens
+                scheduler.release(ticket, used_tokens)
+                record_turn(turn.finish())
+
+            result = renderer.close()
+            metrics.registry.observe("debate_stream_flushes", renderer.flushes, buckets=metrics.FLUSH_BUCKETS,
+                                     phase=current_phase, kind="scoring" if scoring_run else "reply")
+            self.last_turn = {"verdict": plan["verdict"], "truncated": truncated}
 
             if scoring_run == False:
                 st_store(result,current_phase,"ai_response")
+                st_store(renderer.flushes,current_phase,"ai_response_flushes")
+                if renderer.first_chunk_at:
+                    st_store(renderer.first_chunk_at - turn.started,current_phase,"ai_ttft")
             else:
                 st_store(result,current_phase,"ai_result")
+                st_store(renderer.flushes,current_phase,"ai_result_flushes")
                 score = extract_score(result)
                 st_store(score,current_phase,"ai_score")
 
+            return result
+
+
 
 
+# Resolve the shared assistant and create (or reuse) this session's thread. The assistant is
+# retrieved once per process, not on every rerun.
+def bootstrap(debate):
+    openai_assistant = AssistantManager(phases=debate.phases)
+    openai_assistant.create_assistant(
+        name=ASSISTANT_NAME,
+        instructions=ASSISTANT_INSTRUCTIONS,
+        tools=()
+    )
+    openai_assistant.create_thread()
+    return openai_assistant
+
+
+# Speculative work only runs when the admission queue is empty and a slot is free, so it never
+# delays a student who actually pressed Submit. Its tokens count towards the deployment budget whether
+# or not the guess is used; the session's budget is charged when the student gets the reply.
+def speculate_with_spare_capacity(backend, session, phase, history, user_content, instructions, max_tokens, cancel_event):
+    from compaction import estimate_tokens
+    scheduler = get_scheduler()
+    ticket = scheduler.try_acquire(session, estimate_tokens(history) + max_tokens)
+    if ticket is None:
+        return None
+    used_tokens = None
+    try:
+        speculated = backend.speculate(history, user_content, instructions, cancel_event, max_tokens=max_tokens)
+        if speculated is not None and speculated[1] is not None:
+            usage = speculated[1]
+            used_tokens = usage.prompt_tokens + usage.completion_tokens
+            budget.deployment.record(session, phase, usage.prompt_tokens, usage.completion_tokens)
+        return speculated
+    finally:
+        scheduler.release(ticket, used_tokens)
+
+
+# A stable ID for this browser session, used to attribute metrics.
+def session_id():
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
+
+
+# Restore the debate named by ?session= in the URL, or put this session's ID there so it can be resumed.
+def resume_session():
+    if 'session_id' in st.session_state:
+        return
+    store = get_session_store()
+    requested = st.query_params.get("session")
+    if store and requested:
+        data = store.load(requested)
+        if data:
+            session_store.restore(st.session_state, data)
+            st.session_state.session_id = requested
+            metrics.registry.inc("debate_session_resumes_total")
+            return
+    session_id()
+    if store:
+        st.query_params["session"] = st.session_state.session_id
+
+
+# The debate this session is in: ?debate=<name> in the URL when it starts, the default otherwise.
+# A resumed session keeps the debate it was saved with.
+def current_debate():
+    if 'debate' not in st.session_state:
+        st.session_state['debate'] = st.query_params.get("debate") or debates.DEFAULT_DEBATE
+    return debates.library.get(st.session_state['debate'])
+
+
+# Hand this rerun's state to the write-behind store; nothing is written to disk here.
+def save_session(debate):
+    store = get_session_store()
+    if store and 'session_id' in st.session_state:
+        data, finished = session_store.capture(st.session_state, debate.phases)
+        store.save(session_id(), data, finished)
+
+
+# Keep the latest sampled records for this session so the debug panel can show them.
+def record_turn(record):
+    if record:
+        records = st.session_state.setdefault('metrics_records', [])
+        records.append(record)
+        del records[:-METRICS_SESSION_RECORDS]
+
+
+def debug_panel():
+    records = st.session_state.get('metrics_records', [])
+    if records:
+        with st.expander("Debug: timings for this session", expanded=False):
+            st.dataframe(records)
+    if AI_BACKEND == "assistants":
+        with st.expander("Debug: assistant", expanded=False):
+            st.caption(f"Re-fetched from the platform every {ASSISTANT_CACHE_TTL} seconds")
+            if st.button("Re-fetch the assistant now", key="refresh assistant"):
+                refresh_assistant()
+                st.success("The next reply uses the assistant as it is on the platform now.")
+
 
 def st_store(input, phase_name, phase_key):
     key = f"{phase_name}_{phase_key}"
     st.session_state[key] = input
         
 
-def build_scoring_instructions(rubric):
-    scoring_instructions = """Please score the user's previous response based on the following rubric: \n """
-    scoring_instructions += rubric
-    scoring_instructions += """\n\nPlease output your response as JSON, using this format: { "[criteria 1]": "[score 1]", "[criteria 2]": "[score 2]", "total": "[total score]" }"""
-    return scoring_instructions
-
-def extract_score(text):
-    # Define the regular expression pattern
-    #regex has been modified to grab the total value whether or not it is returned inside double quotes. The AI seems to fluctuate between using quotes around values and not. 
-    pattern = r'"total":\s*"?(\d+)"?'
-    
-    # Use regex to find the score pattern in the text
-    match = re.search(pattern, text)
-    
-    # If a match is found, return the score, otherwise return None
-    if match:
-        return int(match.group(1))
-    else:
-        return 0
-
+def check_score(PHASE_NAME, PHASE_DICT):
+    status = passed(st.session_state[f"{PHASE_NAME}_ai_score"], PHASE_DICT)
+    st.session_state[f"{PHASE_NAME}_phase_status"] = status
+    return status
 
-def check_score(PHASE_NAME):
-    score = st.session_state[f"{PHASE_NAME}_ai_score"]
-    try:
-        if score >= PHASES[PHASE_NAME]["minimum_score"]:
-            st.session_state[f"{PHASE_NAME}_phase_status"] = True
-            return True
-        else:
-            st.session_state[f"{PHASE_NAME}_phase_status"] = False
-            return False
-    except:
-        st.session_state[f"{PHASE_NAME}_phase_status"] = False
-        return False
-
-def skip_phase(PHASE_NAME, No_Submit=False):
+def skip_phase(PHASE_NAME, phase_count, No_Submit=False):
     st_store(user_input[PHASE_NAME], PHASE_NAME, "user_input")
     if No_Submit == False:
         st.session_state[f"{PHASE_NAME}_ai_response"] = "This phase was skipped."
     st.session_state[f"{PHASE_NAME}_phase_status"] = True
-    st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(PHASES)-1)
+    st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, phase_count-1)
 
 
 def celebration():
+    # Only loaded when a debate is finished with COMPLETION_CELEBRATION on
+    from streamlit_extras.let_it_rain import rain
     rain(
         emoji="🥳",
         font_size=54,
@@ -251,13 +456,35 @@ def celebration():
 
 
 def main():
-    global ASSISTANT_ID
-
+    started = time.monotonic()
+    debate = None
+    try:
+        resume_session()
+        try:
+            debate = current_debate()
+        except (debates.DebateNotFound, debates.DebateConfigError) as e:
+            print(f"Debate {st.session_state['debate']!r} can't be opened: {e!r}")
+            st.error(DEBATE_UNAVAILABLE_MESSAGE, icon="🚨")
+            return
+        render_page(debate)
+    finally:
+        #Record how long this rerun took to render, even when it ends in st.rerun()
+        if debate is not None:
+            phases = debate.compiled
+            phase = phases[min(st.session_state.get('CURRENT_PHASE', 0), len(phases) - 1)].name
+            record_turn(metrics.observe_rerun(session_id(), phase, time.monotonic() - started))
+            save_session(debate)
+        metrics.registry.flush()
+
+
+def render_page(debate):
     if 'CURRENT_PHASE' not in st.session_state:
         st.session_state.thread_obj = []
 
-    st.title(APP_TITLE)
-    st.markdown(APP_INTRO)
+    st.title(debate.title)
+    #The page styles go out once, instead of once per phase
+    st.markdown(transcripts.PAGE_CSS, unsafe_allow_html=True)
+    st.markdown(debate.intro)
 
     if APP_HOW_IT_WORKS:
         with st.expander("Learn how this works", expanded=False):
@@ -272,50 +499,86 @@ def main():
                 file_name=SHARED_ASSET["name"],
                 mime="application/octet-stream")
 
-    #Create the assistant one time. Only if the Assistant ID is not found, create a new one. 
-    openai_assistant = AssistantManager()
-    
-    #Run the create_assistant. It only creates a new assistant if one is not found. 
-    openai_assistant.create_assistant(
-        name=ASSISTANT_NAME,
-        instructions=ASSISTANT_INSTRUCTIONS,
-        tools=""
-    )
+    #The assistant and this session's thread are resolved on first use (normally the first Submit),
+    #so the page is drawn without waiting on the API
+    openai_assistant = None
 
-    #Create a thread, or retrieve the existing thread if it exists in local Storage. 
-    openai_assistant.create_thread()
+    prefetcher = Prefetcher(get_prefetch_executor(), st.session_state)
     
     i=0
 
+    #The debate's phases were validated and compiled when it was loaded, and are indexed by position
+    phases = debate.compiled
+
     #Create a variable for the current phase, starting at 0
     if 'CURRENT_PHASE' not in st.session_state:
         st.session_state['CURRENT_PHASE'] = 0
+    #A reloaded definition may have fewer phases than this session has reached
+    st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'], len(phases) - 1)
 
+    final_key = f"{phases[-1].name}_ai_response"
+    #Completed phases collect here and are drawn as one read-only block before the active phase
+    transcript = []
 
     #Loop until you reach the currently active phase. 
     while  i <= st.session_state['CURRENT_PHASE']:
         submit_button = False
         skip_button = False
-        final_phase_name = list(PHASES.keys())[-1]
-        final_key = f"{final_phase_name}_ai_response"
-
 
-
-        # Build the field, according to the values in the PHASES dictionary
-        build_field(i, PHASES)
         #Store the Name of the Phase and the values for that Phase
-        PHASE_NAME = list(PHASES.keys())[i]
-        PHASE_DICT = list(PHASES.values())[i]
+        phase = phases[i]
+        PHASE_NAME = phase.name
+        PHASE_DICT = phase.config
 
         key = f"{PHASE_NAME}_phase_status"
-      
+
         #Check phase status to automatically continue if it's a markdown phase
-        if PHASE_DICT["type"] == "markdown":
+        if phase.type == "markdown":
             if key not in st.session_state:
                 st.session_state[key] = True
-                st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(PHASES) - 1)
+                st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(phases) - 1)
+
+        #A completed phase can't change any more, so it goes into the transcript instead of a widget
+        if st.session_state.get(key, False):
+            transcript.append(transcripts.phase_fragment(phase, st.session_state))
+            user_input[PHASE_NAME] = st.session_state.get(f"{PHASE_NAME}_user_input")
+            if final_key in st.session_state and i == st.session_state['CURRENT_PHASE']:
+                render_transcript(transcript)
+                st.success(COMPLETION_MESSAGE)
+                if COMPLETION_CELEBRATION:
+                    celebration()
+            i = min(i + 1, len(phases))
+            continue
+
+        render_transcript(transcript)
+        # Build the field, according to the values in the debate's phase definition
+        build_field(phase)
+
+        #Speculatively generate the reply for the current input of a deterministic phase
+        if (SPECULATIVE_PREFETCH and PHASE_DICT.get("speculative", False)
+                and i == st.session_state['CURRENT_PHASE']):
+            phase_value = user_input[PHASE_NAME]
+            if not phase_value:
+                #Nothing to guess from yet (e.g. an empty name field), so don't resolve the assistant or
+                #create a thread for a visitor who may never submit
+                prefetcher.cancel()
+            else:
+                cached_opening = PHASE_DICT.get("cache_opening", False) and pick_variant(
+                    opening_key(phase_value, PHASE_DICT.get("instructions","")), debate.namespace)
+                #Only guess while the reply could run with the full budget
+                if not cached_opening and budget.plan_turn(st.session_state, PHASE_NAME, budget.deployment)["verdict"] == "ok":
+                    openai_assistant = openai_assistant or bootstrap(debate)
+                    prefetcher.ensure(PHASE_NAME, phase_value, partial(
+                        speculate_with_spare_capacity,
+                        openai_assistant.backend,
+                        session_id(),
+                        PHASE_NAME,
+                        openai_assistant.backend.history(),
+                        phase_value,
+                        PHASE_DICT.get("instructions",""),
+                        MAX_TOKENS,
+                    ))
 
-        
         if key not in st.session_state:
             st.session_state[key] = False
         #If the phase isn't passed and it isn't a recap of the final phase, then give the user a submit button
@@ -344,46 +607,93 @@ def main():
                 st.info(st.session_state[key], icon ="🤖")
 
         if submit_button:
-            #Add INSTRUCTIONS message to the thread
-            openai_assistant.add_message_to_thread(
-                role="assistant", 
-                content=PHASE_DICT.get("instructions","")
-                )
             #Store the users input in a session variable
             st_store(user_input[PHASE_NAME], PHASE_NAME, "user_input")
-            #Add USER MESSAGE to the thread
-            openai_assistant.add_message_to_thread(
-                role="user", 
-                content=user_input[PHASE_NAME]
-                )
-            #Currently, all instructions are handled in the system prompts, so no need to add additional instructions here. 
-            instructions = ""
-            #Run the thread
-            openai_assistant.run_assistant(instructions, PHASE_NAME)
+            import openai
+            from resilience import ServiceUnavailable
+            try:
+                openai_assistant = openai_assistant or bootstrap(debate)
+                #Serve fixed-option openings from the cache when a full pool of variants exists
+                reply = None
+                full_reply = True
+                cache_key = None
+                if PHASE_DICT.get("cache_opening", False):
+                    cache_key = opening_key(user_input[PHASE_NAME], PHASE_DICT.get("instructions",""))
+                    reply = pick_variant(cache_key, debate.namespace)
+                #Otherwise use the speculative reply if one was started for exactly this input
+                if not reply and SPECULATIVE_PREFETCH and PHASE_DICT.get("speculative", False):
+                    speculated = prefetcher.take(PHASE_NAME, user_input[PHASE_NAME])
+                    if speculated and speculated[0]:
+                        reply, usage = speculated
+                        #The deployment was charged when the guess ran; now it's this session's turn
+                        budget.record_usage(st.session_state, PHASE_NAME, usage)
+                #Otherwise reuse the reply to an identical conversation, e.g. an unchanged prefilled essay
+                response_key = None
+                if not reply and RESPONSE_CACHE and PHASE_DICT.get("dedup", False):
+                    response_key = response_cache.conversation_key(PHASE_NAME, user_input[PHASE_NAME], st.session_state,
+                                                                   debate.phases)
+                    reply = get_response_cache().get(response_key, debate.namespace)
+                    metrics.registry.inc("debate_response_cache_requests_total", phase=PHASE_NAME,
+                                         variant=response_cache.variant(PHASE_DICT, user_input[PHASE_NAME]),
+                                         result="hit" if reply else "miss")
+                #A guess that take() didn't hand over (a cached reply was used, or it was for other input)
+                #would run to completion unread
+                prefetcher.cancel()
+                if reply:
+                    openai_assistant.record_exchange(user_input[PHASE_NAME], reply)
+                    openai_assistant.replay_response(reply, PHASE_NAME)
+                else:
+                    #Send the USER MESSAGE and the phase INSTRUCTIONS with the run in a single request
+                    reply = openai_assistant.submit_turn(
+                        PHASE_DICT.get("instructions",""),
+                        PHASE_NAME,
+                        user_content=user_input[PHASE_NAME]
+                        )
+                    #Shortened replies (a degraded budget, or cut off at the token cap) are this student's alone
+                    full_reply = openai_assistant.full_reply()
+                    #Store it for the next identical conversation, unless it's addressed to this student
+                    if response_key and full_reply and response_cache.shareable(reply, st.session_state, debate.phases):
+                        get_response_cache().put(response_key, reply, PHASE_NAME, debate.namespace)
+                #Fresh openings fill the pool until it is full. Live ones follow the student's earlier turns,
+                #so one that greets them by name is never replayed to others
+                if cache_key and full_reply and response_cache.shareable(reply, st.session_state, debate.phases):
+                    add_variant(cache_key, reply, user_input[PHASE_NAME], debate.namespace)
             
-            if PHASE_DICT.get("scored_phase","") == True:
-                if "rubric" in PHASE_DICT:
-                    scoring_instructions = build_scoring_instructions(PHASE_DICT["rubric"])
-                    openai_assistant.add_message_to_thread(
-                    role="assistant", 
-                    content=scoring_instructions,
-                    )
-                    openai_assistant.run_assistant(instructions, PHASE_NAME, True, temperature=.2,response_format="json")
-                    if check_score(PHASE_NAME):
-                        st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(PHASES)-1)
+                if PHASE_DICT.get("scored_phase","") == True:
+                    if "rubric" in PHASE_DICT:
+                        scoring_instructions = build_scoring_instructions(PHASE_DICT["rubric"])
+                        #Clear passes and fails are settled locally; only borderline answers get a scoring run.
+                        #The scoring instructions ride along with the scoring run, like the phase instructions
+                        outcome = score_submission(user_input[PHASE_NAME], PHASE_DICT, partial(
+                            openai_assistant.submit_turn, scoring_instructions, PHASE_NAME,
+                            scoring_run=True, temperature=.2, response_format="json"))
+                        st_store(outcome["result"], PHASE_NAME, "ai_result")
+                        st_store(outcome["score"], PHASE_NAME, "ai_score")
+                        if check_score(PHASE_NAME, PHASE_DICT):
+                            st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(phases)-1)
+                        elif outcome["verdict"] == "unreadable":
+                            st.warning("Your answer couldn't be scored this time. Please submit it again.")
+                        else:
+                            st.warning("You haven't passed. Please try again.")
                     else:
-                        st.warning("You haven't passed. Please try again.")
-                else:
-                    st.error('You need to include a rubric for a scored phase', icon="🚨")
-            else: 
-                st.session_state[f"{PHASE_NAME}_phase_status"] = True
-                st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(PHASES)-1)
-
-            #Rerun Streamlit to refresh the page
-            st.rerun()
+                        st.error('You need to include a rubric for a scored phase', icon="🚨")
+                else: 
+                    st.session_state[f"{PHASE_NAME}_phase_status"] = True
+                    st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(phases)-1)
+            except budget.BudgetExhausted as e:
+                #Nothing was sent; the student is told instead of getting a reply
+                print(f"{PHASE_NAME} turn refused: {e}")
+                st.warning(BUDGET_EXHAUSTED_MESSAGE, icon="⏳")
+            except (ServiceUnavailable, openai.OpenAIError) as e:
+                #Keep the student's input; submitting again picks the same turn back up
+                print(f"{PHASE_NAME} turn failed: {e}")
+                st.error(SERVICE_UNAVAILABLE_MESSAGE, icon="🚨")
+            else:
+                #Rerun Streamlit to refresh the page
+                st.rerun()
 
         if skip_button:
-            skip_phase(PHASE_NAME)
+            skip_phase(PHASE_NAME, len(phases))
             st.rerun()
 
 
@@ -393,7 +703,15 @@ def main():
                 celebration()
 
         #Increment i, but never more than the number of possible phases
-        i = min(i + 1, len(PHASES))
+        i = min(i + 1, len(phases))
+
+    render_transcript(transcript)
+    #With the page drawn, get the assistant ready for the first Submit
+    start_bootstrap_prewarm()
+    if OPENING_CACHE_PREWARM:
+        start_opening_prewarm(debate.name)
+    if SCORING_DEBUG_MODE:
+        debug_panel()
 
 
 
@@ -0,0 +1,190 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from config import METRICS_SAMPLE_RATE, METRICS_PATH, METRICS_FLUSH_INTERVAL, METRICS_JSON_LOGS
+
+# Process-wide metrics. Counters and histograms are kept in memory, written out in Prometheus text
+# format to METRICS_PATH, and each sampled turn is also logged as one JSON line.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+# Redraws of the reply box per streamed reply
+FLUSH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+
+logger = logging.getLogger("debate.metrics")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.last_flush = 0.0
+        self.flush_lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"bounds": buckets, "buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(histogram["bounds"]):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{fmt(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append(f"{name}{fmt(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                for bound, count in zip(histogram["bounds"], histogram["buckets"]):
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{fmt(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{name}_count{fmt(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self, path=METRICS_PATH, force=False):
+        # Rewrite the exposition file at most every METRICS_FLUSH_INTERVAL seconds.
+        if not path:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_flush < METRICS_FLUSH_INTERVAL:
+            return
+        # Another session is already writing the file; skip rather than wait.
+        if not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self.last_flush = now
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+        finally:
+            self.flush_lock.release()
+
+
+registry = Registry()
+_current_turn = contextvars.ContextVar("current_turn", default=None)
+
+
+def sampled():
+    return METRICS_SAMPLE_RATE >= 1 or random.random() < METRICS_SAMPLE_RATE
+
+
+def count_round_trip(call):
+    # Every API request is counted; the active turn (if any) also gets the round trip.
+    registry.inc("debate_api_requests_total", call=call)
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.round_trips += 1
+
+
+class Turn:
+    """Timings for one model response (a reply, a scoring run or a cached replay)."""
+
+    def __init__(self, session_id, phase, kind):
+        self.session_id = session_id
+        self.phase = phase
+        self.kind = kind
+        self.sampled = sampled()
+        self.started = time.monotonic()
+        self.first_delta_at = None
+        self.round_trips = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self._token = _current_turn.set(self)
+
+    def first_delta(self):
+        if self.first_delta_at is None:
+            self.first_delta_at = time.monotonic()
+
+    def usage(self, usage):
+        if usage is not None:
+            self.prompt_tokens = usage.prompt_tokens
+            self.completion_tokens = usage.completion_tokens
+
+    def finish(self):
+        _current_turn.reset(self._token)
+        if not self.sampled:
+            return None
+        ended = time.monotonic()
+        record = {
+            "event": "turn",
+            "session": self.session_id,
+            "phase": self.phase,
+            "kind": self.kind,
+            "round_trips": self.round_trips,
+            "ttft": None if self.first_delta_at is None else self.first_delta_at - self.started,
+            "stream_duration": None if self.first_delta_at is None else ended - self.first_delta_at,
+            "duration": ended - self.started,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+        labels = {"phase": self.phase, "kind": self.kind}
+        registry.inc("debate_turns_total", **labels)
+        registry.inc("debate_turn_round_trips_total", self.round_trips, **labels)
+        if record["ttft"] is not None:
+            registry.observe("debate_time_to_first_delta_seconds", record["ttft"], **labels)
+            registry.observe("debate_stream_duration_seconds", record["stream_duration"], **labels)
+        if self.kind == "scoring":
+            registry.observe("debate_scoring_overhead_seconds", record["duration"], phase=self.phase)
+        if self.prompt_tokens is not None:
+            # Per-turn input size, to check that prompt tokens stay bounded as the debate grows.
+            registry.observe("debate_prompt_tokens_per_turn", self.prompt_tokens, buckets=TOKEN_BUCKETS, **labels)
+            registry.inc("debate_tokens_total", self.prompt_tokens, type="prompt", **labels)
+            registry.inc("debate_tokens_total", self.completion_tokens, type="completion", **labels)
+        log(record)
+        return record
+
+
+def observe_rerun(session_id, phase, seconds):
+    if not sampled():
+        return None
+    registry.observe("debate_rerun_seconds", seconds, phase=phase)
+    record = {"event": "rerun", "session": session_id, "phase": phase, "duration": seconds}
+    log(record)
+    return record
+
+
+def log(record):
+    if METRICS_JSON_LOGS:
+        logger.info(json.dumps(record))
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+
+import budget
+from config import *
+
+# Opening statements for fixed options depend only on the option, the prompts and the model settings,
+# so they are generated once and reused. Each key holds a small pool of variants so students don't
+# all read the same reply. Each debate keeps its pools in its own namespace (a subdirectory; the
+# default debate's is the top level).
+
+_lock = threading.Lock()
+
+
+def opening_key(topic, instructions, model=OPENAI_MODEL, temperature=TEMPERATURE):
+    payload = json.dumps({
+        "topic": topic,
+        "instructions": instructions,
+        "assistant_instructions": ASSISTANT_INSTRUCTIONS,
+        "model": model,
+        "temperature": temperature,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _path(key, namespace=""):
+    return os.path.join(OPENING_CACHE_DIR, namespace, f"{key}.json")
+
+
+def load_variants(key, namespace=""):
+    try:
+        with open(_path(key, namespace), "r", encoding="utf-8") as f:
+            return json.load(f).get("variants", [])
+    except (OSError, ValueError):
+        return []
+
+
+def add_variant(key, text, topic="", namespace=""):
+    # Returns True if the variant was stored. Full pools are left alone.
+    if not text:
+        return False
+    with _lock:
+        variants = load_variants(key, namespace)
+        if len(variants) >= OPENING_CACHE_VARIANTS or text in variants:
+            return False
+        variants.append(text)
+        path = _path(key, namespace)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so a concurrent reader never sees a half-written pool.
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"topic": topic, "variants": variants}, f)
+        os.replace(tmp_path, path)
+    return True
+
+
+def pick_variant(key, namespace=""):
+    # Only serve from a full pool; until then live generations keep filling it.
+    variants = load_variants(key, namespace)
+    if len(variants) < OPENING_CACHE_VARIANTS:
+        return None
+    return random.choice(variants)
+
+
+def warm_openings(backend, phases=PHASES, namespace="", deployment=None):
+    # Fill the variant pool for every option of every phase marked cache_opening. Openings are
+    # generated with the backend's speculate(), so warming never touches a student's conversation.
+    # Their tokens are recorded in the deployment budget, and warming stops once it runs low.
+    never_cancelled = threading.Event()
+    generated = 0
+    for phase_name, phase_dict in phases.items():
+        if not phase_dict.get("cache_opening"):
+            continue
+        instructions = phase_dict.get("instructions", "")
+        for topic in phase_dict.get("options", []):
+            key = opening_key(topic, instructions)
+            while len(load_variants(key, namespace)) < OPENING_CACHE_VARIANTS:
+                if deployment is not None and budget.plan_turn({}, phase_name, deployment)["verdict"] != "ok":
+                    print("Deployment token budget is running low; stopped warming openings")
+                    return generated
+                text, usage = backend.speculate([], topic, instructions, never_cancelled)
+                if usage is not None and deployment is not None:
+                    deployment.record("", phase_name, usage.prompt_tokens, usage.completion_tokens)
+                if not add_variant(key, text, topic, namespace):
+                    break
+                generated += 1
+        print(f"Opening cache for {phase_name} is warm")
+    return generated
+
+
+if __name__ == "__main__":
+    # python opening_cache.py warm [debate]
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != "warm":
+        print("Usage: python opening_cache.py warm [debate]")
+        sys.exit(2)
+    from backends import make_backend
+    from debates import library
+    from main import get_assistant, get_client
+    debate = library.get(sys.argv[2] if len(sys.argv) == 3 else None)
+    assistant = get_assistant() if AI_BACKEND == "assistants" else None
+    count = warm_openings(make_backend(AI_BACKEND, get_client(), assistant, {}, debate.phases), debate.phases, debate.namespace,
+                          budget.deployment)
+    print(f"Generated {count} opening statements into {os.path.join(OPENING_CACHE_DIR, debate.namespace)}")
@@ -0,0 +1,144 @@
+import json
+import re
+from collections import namedtuple
+from types import MappingProxyType
+
+import metrics
+
+# Phase logic shared by the Streamlit app (main.py) and the headless batch runner (batch.py).
+# Nothing here touches Streamlit.
+#
+# Scored phases are scored in two stages. A local pre-filter, declared as "prefilter" next to the
+# phase's "rubric", settles clear passes and fails from the answer's length, keywords and structure.
+# Only answers it can't settle are scored by the model.
+
+# Phase definition keys passed straight through to the phase's Streamlit widget
+WIDGET_ARGS = ("label", "body", "value", "options", "max_chars", "help", "on_click", "horizontal", "height",
+               "unsafe_allow_html", "placeholder")
+
+Phase = namedtuple("Phase", "index name config type kwargs")
+
+
+def compile_phases(phases):
+    """The phases as a tuple of Phase, in order, with their widget arguments resolved.
+
+    Each debate is compiled once when it is loaded (see debates.py), so reruns index into the
+    result instead of walking the definitions again.
+    """
+    return tuple(
+        Phase(index, name, phase_dict, phase_dict.get("type", ""),
+              MappingProxyType({arg: phase_dict[arg] for arg in WIDGET_ARGS if phase_dict.get(arg)}))
+        for index, (name, phase_dict) in enumerate(phases.items())
+    )
+
+
+def build_scoring_instructions(rubric):
+    scoring_instructions = """Please score the user's previous response based on the following rubric: \n """
+    scoring_instructions += rubric
+    scoring_instructions += """\n\nPlease output your response as JSON, using this format: { "[criteria 1]": "[score 1]", "[criteria 2]": "[score 2]", "total": "[total score]" }"""
+    return scoring_instructions
+
+def extract_score(text):
+    """The rubric total from a scoring reply, or None if the reply can't be read.
+
+    Scoring runs ask for JSON, but totals still come back as numbers or strings ("3", "3/5"),
+    and the object is sometimes wrapped in prose or a code fence.
+    """
+    data = _json_object(text)
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if str(key).strip().lower() == "total" and _number(value) is not None:
+                return _number(value)
+        # No usable total: add up the criteria instead.
+        numbers = [_number(value) for value in data.values() if _number(value) is not None]
+        if numbers:
+            return sum(numbers)
+    #Last resort for replies that aren't JSON at all
+    match = re.search(r'"?total"?\s*[:=]\s*"?(-?\d+(?:\.\d+)?)', text or "", re.IGNORECASE)
+    return _number(match.group(1)) if match else None
+
+
+def _json_object(text):
+    text = (text or "").strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+    return None
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        match = re.match(r"\s*(-?\d+(?:\.\d+)?)", value)
+        if match:
+            return float(match.group(1)) if "." in match.group(1) else int(match.group(1))
+    return None
+
+
+def prescore(text, phase_dict):
+    """Return (verdict, details). The verdict is "pass" or "fail" for clear cases, None otherwise.
+
+    "prefilter" may set min_<measure> (below it fails) and pass_<measure> (meeting every one passes)
+    for the measures words, sentences, paragraphs and keywords, the last counting how many of its
+    "keywords" list appear in the answer.
+    """
+    checks = phase_dict.get("prefilter")
+    if not checks:
+        return None, {}
+    text = text or ""
+    lowered = text.lower()
+    found = [keyword for keyword in checks.get("keywords", [])
+             if re.search(r"\b" + re.escape(keyword.lower()) + r"\b", lowered)]
+    measures = {
+        "words": len(re.findall(r"\w+(?:['-]\w+)*", text)),
+        "sentences": len(re.findall(r"[^.!?\s][^.!?]*(?:[.!?]+|$)", text)),
+        "paragraphs": len([paragraph for paragraph in text.split("\n") if paragraph.strip()]),
+        "keywords": len(found),
+    }
+    details = dict(measures, matched_keywords=found)
+    for measure, value in measures.items():
+        if value < checks.get(f"min_{measure}", 0):
+            details["failed"] = f"min_{measure}"
+            return "fail", details
+    thresholds = {measure: checks[f"pass_{measure}"] for measure in measures if f"pass_{measure}" in checks}
+    if thresholds and all(measures[measure] >= minimum for measure, minimum in thresholds.items()):
+        return "pass", details
+    return None, details
+
+
+def score_submission(text, phase_dict, run_model):
+    """Score an answer, calling run_model() for the model's scoring reply only when the pre-filter
+    can't settle it. Returns {"stage", "verdict", "score", "result"}."""
+    verdict, details = prescore(text, phase_dict)
+    if verdict is not None:
+        score = phase_dict.get("minimum_score", 0) if verdict == "pass" else 0
+        outcome = {"stage": "prefilter", "verdict": verdict, "score": score,
+                   "result": json.dumps(dict(details, stage="prefilter", verdict=verdict))}
+    else:
+        result = run_model()
+        score = extract_score(result)
+        if score is None:
+            verdict = "unreadable"
+        else:
+            verdict = "pass" if passed(score, phase_dict) else "fail"
+        outcome = {"stage": "model", "verdict": verdict, "score": score, "result": result}
+    metrics.registry.inc("debate_scoring_submissions_total", stage=outcome["stage"], verdict=verdict)
+    return outcome
+
+
+def passed(score, phase_dict):
+    # A phase without a usable minimum_score can't be passed by scoring.
+    try:
+        return score >= phase_dict["minimum_score"]
+    except (KeyError, TypeError):
+        return False
@@ -0,0 +1,52 @@
+import threading
+
+from config import *
+
+# Speculative prefetch: when a phase's input is deterministic (e.g. a selectbox), the next reply is
+# generated in the background while the student is still looking at the form. The work is the
+# backend's speculate(), which never touches the student's real conversation, so a cancelled guess
+# leaves no trace.
+
+
+class Prefetcher:
+    """Binds at most one speculative run to a session, keyed by phase and input value."""
+
+    def __init__(self, executor, state):
+        self.executor = executor
+        self.state = state
+
+    def ensure(self, phase_name, value, work):
+        # Start `work(cancel_event)` for this value unless it is already running; stale work is cancelled.
+        current = self.state.get('prefetch')
+        if current and current["phase"] == phase_name and current["value"] == value:
+            return
+        self.cancel()
+        if not value:
+            return
+        cancel_event = threading.Event()
+        self.state['prefetch'] = {
+            "phase": phase_name,
+            "value": value,
+            "cancel": cancel_event,
+            "future": self.executor.submit(work, cancel_event),
+        }
+        print(f"Prefetching {phase_name} reply")
+
+    def cancel(self):
+        current = self.state.pop('prefetch', None)
+        if current:
+            current["cancel"].set()
+            current["future"].cancel()
+
+    def take(self, phase_name, value, timeout=SPECULATIVE_WAIT_TIMEOUT):
+        # Return the buffered reply for exactly this input, waiting for it if it is still streaming.
+        current = self.state.get('prefetch')
+        if not current or current["phase"] != phase_name or current["value"] != value:
+            return None
+        self.state.pop('prefetch', None)
+        try:
+            return current["future"].result(timeout=timeout)
+        except Exception as e:
+            print(f"Prefetch for {phase_name} failed: {e}")
+            current["cancel"].set()
+            return None
@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+
+import openai
+
+import metrics
+from config import *
+
+# Retries with jittered exponential backoff, behind a process-wide circuit breaker. The OpenAI
+# client's own retries are turned off (see get_client) so that every retry goes through here.
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    # Also raised when a stream breaks off after the response started
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class ServiceUnavailable(Exception):
+    """Raised when the API keeps failing, or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after RETRY_BREAKER_THRESHOLD consecutive failures and rejects calls for
+    RETRY_BREAKER_COOLDOWN seconds; after that one trial call is let through.
+
+    before_call() returns a token for the trial call (None otherwise). Callers hand it back to
+    end_call() however the call ends, so a trial that is abandoned or fails in some other way
+    doesn't keep the breaker shut.
+    """
+
+    def __init__(self, threshold=RETRY_BREAKER_THRESHOLD, cooldown=RETRY_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial = None
+
+    @property
+    def trial_in_flight(self):
+        return self.trial is not None
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return None
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial is not None:
+                metrics.registry.inc("debate_breaker_rejections_total")
+                raise ServiceUnavailable("The AI service is temporarily unavailable.")
+            self.trial = object()
+            return self.trial
+
+    def end_call(self, trial):
+        # The trial ended without success() or failure(): let the next call be the trial instead.
+        with self.lock:
+            if trial is not None and self.trial is trial:
+                self.trial = None
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = None
+            metrics.registry.set("debate_breaker_open", 0)
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = None
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+                metrics.registry.set("debate_breaker_open", 1)
+
+
+breaker = CircuitBreaker()
+
+
+def backoff_delay(attempt):
+    # "Full jitter": a random delay up to the exponential cap spreads out a class's retries.
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def pause_before_retry(name, error, attempt):
+    """Record a failed attempt and sleep before the next one; raise once attempts run out."""
+    breaker.failure()
+    metrics.registry.inc("debate_api_retries_total", call=name, error=type(error).__name__)
+    if attempt >= RETRY_ATTEMPTS - 1:
+        raise ServiceUnavailable(f"{name} failed after {RETRY_ATTEMPTS} attempts: {error}") from error
+    delay = backoff_delay(attempt)
+    print(f"{name} failed ({type(error).__name__}); retrying in {delay:.2f}s")
+    time.sleep(delay)
+
+
+def call_with_retry(call, name, *args, **kwargs):
+    """Run call(*args, **kwargs), retrying transient API errors."""
+    for attempt in range(RETRY_ATTEMPTS):
+        trial = breaker.before_call()
+        try:
+            metrics.count_round_trip(name)
+            result = call(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            pause_before_retry(name, e, attempt)
+        else:
+            breaker.success()
+            return result
+        finally:
+            # Also covers errors that aren't retried, which end a trial without deciding it.
+            breaker.end_call(trial)
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from config import *
+
+# Content-addressed replies for phases marked "dedup". The key is the normalized conversation so
+# far: every earlier phase input (except phases marked "personal"), this phase's input and
+# instructions, and the model settings. Many students submit the prefilled essays unchanged, so
+# their turns are answered from here instead of by a new generation.
+#
+# Entries sit in an in-memory LRU in front of one JSON file per key under RESPONSE_CACHE_DIR.
+# Both honour RESPONSE_CACHE_TTL; the directory is trimmed to RESPONSE_CACHE_MAX_BYTES, oldest first.
+# Each debate's entries live in its own namespace (a subdirectory), under the one size cap.
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", str(text or "")).strip()
+
+
+def conversation_key(phase_name, user_content, state, phases=PHASES, model=OPENAI_MODEL, temperature=TEMPERATURE):
+    inputs = []
+    for name, phase_dict in phases.items():
+        if name == phase_name:
+            break
+        if phase_dict["type"] == "markdown" or phase_dict.get("personal", False):
+            continue
+        inputs.append([name, normalize(state.get(f"{name}_user_input"))])
+    payload = json.dumps({
+        "phase": phase_name,
+        "inputs": inputs,
+        "input": normalize(user_content),
+        "instructions": phases[phase_name].get("instructions", ""),
+        "assistant_instructions": ASSISTANT_INSTRUCTIONS,
+        "model": model,
+        "temperature": temperature,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def variant(phase_dict, user_content):
+    # Hit rates are reported separately for untouched prefilled answers and edited ones.
+    if phase_dict.get("value") and normalize(user_content) == normalize(phase_dict["value"]):
+        return "prefilled"
+    return "edited"
+
+
+def shareable(reply, state, phases=PHASES):
+    # A reply that mentions a student's personal input (e.g. their name) can't be served to others.
+    lowered = reply.lower()
+    for name, phase_dict in phases.items():
+        if phase_dict.get("personal", False):
+            value = normalize(state.get(f"{name}_user_input")).lower()
+            if len(value) >= 2 and re.search(r"\b" + re.escape(value) + r"\b", lowered):
+                return False
+    return True
+
+
+def hit_rates(registry):
+    """{variant: {"hits", "lookups", "hit_rate"}} from debate_response_cache_requests_total."""
+    rates = {}
+    for (name, labels), value in list(registry.counters.items()):
+        if name != "debate_response_cache_requests_total":
+            continue
+        labels = dict(labels)
+        rate = rates.setdefault(labels["variant"], {"hits": 0, "lookups": 0})
+        rate["lookups"] += value
+        if labels["result"] == "hit":
+            rate["hits"] += value
+    for rate in rates.values():
+        rate["hit_rate"] = rate["hits"] / rate["lookups"]
+    return rates
+
+
+class ResponseCache:
+    def __init__(self, directory=RESPONSE_CACHE_DIR, ttl=RESPONSE_CACHE_TTL,
+                 memory_entries=RESPONSE_CACHE_MEMORY_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        # Bytes on disk, measured on the first write and kept up to date after that.
+        self.disk_bytes = None
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _fresh(self, entry):
+        return time.time() - entry["created"] < self.ttl
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key, namespace=""):
+        key = os.path.join(namespace, key)
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if self._fresh(entry):
+                    self.memory.move_to_end(key)
+                    return entry["reply"]
+                del self.memory[key]
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not self._fresh(entry):
+            return None
+        with self.lock:
+            self._remember(key, entry)
+        return entry["reply"]
+
+    def put(self, key, reply, phase="", namespace=""):
+        if not reply:
+            return
+        key = os.path.join(namespace, key)
+        path = self._path(key)
+        entry = {"reply": reply, "phase": phase, "created": time.time()}
+        data = json.dumps(entry)
+        with self.lock:
+            self._remember(key, entry)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so a concurrent reader never sees half an entry.
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            if self.disk_bytes is None:
+                self.disk_bytes = self._measure()
+            else:
+                self.disk_bytes += len(data)
+            if self.disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _measure(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        # Expired entries go first, then the oldest, until the directory is back to 90% of the cap.
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes * 0.9 and now - mtime < self.ttl:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.memory.pop(os.path.relpath(path, self.directory)[:-len(".json")], None)
+        self.disk_bytes = total
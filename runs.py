@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+import metrics
+from config import *
+from resilience import call_with_retry
+
+# Lifecycle of Assistants runs started for students. A run is registered when it is created and
+# completed when its stream ends. If the script is interrupted first (a rerun, a reload, a closed
+# tab) or the browser session disappears, the run is orphaned: nobody will read the rest, so it is
+# cancelled in the background instead of generating up to MAX_TOKENS.
+
+ACTIVE_STATUSES = ("queued", "in_progress", "requires_action", "cancelling")
+
+
+def cancel_run(client, thread_id, run_id, timeout=RESUME_TIMEOUT):
+    """Cancel a run and wait until it has stopped. Returns the final run."""
+    try:
+        run = call_with_retry(client.beta.threads.runs.cancel, "runs.cancel", run_id=run_id, thread_id=thread_id)
+    except openai.BadRequestError:
+        # It finished (or was cancelled) before the request arrived.
+        run = call_with_retry(client.beta.threads.runs.retrieve, "runs.retrieve", run_id=run_id, thread_id=thread_id)
+    deadline = time.monotonic() + timeout
+    while run.status in ACTIVE_STATUSES and time.monotonic() < deadline:
+        time.sleep(RESUME_POLL_INTERVAL)
+        run = call_with_retry(client.beta.threads.runs.retrieve, "runs.retrieve", run_id=run_id, thread_id=thread_id)
+    return run
+
+
+def streamlit_session_alive(streamlit_session):
+    # Streamlit drops a browser session a little while after its tab disconnects.
+    from streamlit.runtime import Runtime
+    if not streamlit_session or not Runtime.exists():
+        return True
+    return Runtime.instance().is_active_session(streamlit_session)
+
+
+class RunTracker:
+    def __init__(self, client, sweep_interval=RUN_SWEEP_INTERVAL):
+        self.client = client
+        self.lock = threading.Lock()
+        self.active = {}
+        self.cancelling = {}
+        self.executor = ThreadPoolExecutor(max_workers=RUN_CANCEL_WORKERS, thread_name_prefix="run-cancel")
+        if sweep_interval:
+            threading.Thread(target=self._sweep_forever, args=(sweep_interval,), name="run-sweeper", daemon=True).start()
+
+    def register(self, session_id, thread_id, run_id, phase="", streamlit_session=None):
+        with self.lock:
+            self.active[run_id] = {
+                "session": session_id,
+                "thread_id": thread_id,
+                "phase": phase,
+                "streamlit_session": streamlit_session,
+                "started": time.monotonic(),
+            }
+        metrics.registry.set("debate_runs_in_flight", len(self.active))
+
+    def complete(self, run_id):
+        with self.lock:
+            self.active.pop(run_id, None)
+        metrics.registry.set("debate_runs_in_flight", len(self.active))
+
+    def abandon(self, run_id, reason):
+        """Cancel a run whose reply nobody will read. Returns at once; the cancel runs in the background."""
+        with self.lock:
+            run = self.active.pop(run_id, None)
+            if run is None:
+                return
+            future = self.executor.submit(self._cancel, run_id, run, reason)
+            self.cancelling.setdefault(run["session"], []).append(future)
+        future.add_done_callback(lambda done: self._forget(run["session"], done))
+        metrics.registry.set("debate_runs_in_flight", len(self.active))
+        metrics.registry.inc("debate_runs_abandoned_total", reason=reason)
+
+    def _forget(self, session_id, future):
+        with self.lock:
+            futures = self.cancelling.get(session_id, [])
+            if future in futures:
+                futures.remove(future)
+            if not futures:
+                self.cancelling.pop(session_id, None)
+
+    def settle(self, session_id, timeout=RESUME_TIMEOUT):
+        # A new turn waits for the session's own cancels, so its thread isn't blocked by them.
+        with self.lock:
+            futures = self.cancelling.pop(session_id, [])
+        for future in futures:
+            try:
+                future.result(timeout=timeout)
+            except Exception as e:
+                print(f"Cancelling an abandoned run failed: {e}")
+
+    def sweep(self):
+        with self.lock:
+            orphans = [run_id for run_id, run in self.active.items()
+                       if not streamlit_session_alive(run["streamlit_session"])]
+        for run_id in orphans:
+            self.abandon(run_id, "session_closed")
+
+    def _sweep_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Run sweep failed: {e}")
+
+    def _cancel(self, run_id, run, reason):
+        final = cancel_run(self.client, run["thread_id"], run_id)
+        record_wasted_tokens(final.usage.completion_tokens if final.usage else None, "assistants", run["phase"])
+        print(f"Cancelled {reason} run {run_id} ({final.status})")
+        return final
+
+
+def record_wasted_tokens(tokens, backend, phase=""):
+    # Tokens generated for a reply that was thrown away.
+    if tokens:
+        metrics.registry.inc("debate_wasted_tokens_total", tokens, backend=backend, phase=phase)
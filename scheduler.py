@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+from config import *
+
+# Process-wide admission control between the app and the model API. A turn waits here until
+# it is first in line (sessions are served round-robin, each in FIFO order), a concurrency slot is
+# free, and the request and token buckets can cover it. Waiting turns are told their position so
+# the page can show it instead of an empty reply box.
+
+
+class TokenBucket:
+    """Refills continuously at `per_minute`; a rate of 0 means unlimited."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60.0)
+        self.updated = now
+
+    def can_take(self, amount):
+        if not self.per_minute:
+            return True
+        self._refill()
+        return self.tokens >= min(amount, self.capacity)
+
+    def take(self, amount):
+        if self.per_minute:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount):
+        # Negative refunds charge for usage above the estimate.
+        if self.per_minute:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Ticket:
+    def __init__(self, session_id, tokens):
+        self.session_id = session_id
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = None
+
+
+class AdmissionScheduler:
+    def __init__(self, max_concurrency=MAX_CONCURRENT_REQUESTS, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.cond = threading.Condition()
+        self.queues = OrderedDict()
+        self.active = 0
+
+    def _head(self):
+        # Round-robin across sessions: the first session in line offers its oldest ticket.
+        for queue in self.queues.values():
+            return queue[0]
+        return None
+
+    def _position(self, ticket):
+        sessions = list(self.queues)
+        queue = self.queues[ticket.session_id]
+        return sessions.index(ticket.session_id) + 1 + queue.index(ticket) * len(sessions)
+
+    def _can_admit(self, ticket):
+        return (self.active < self.max_concurrency
+                and self.requests.can_take(1)
+                and self.tokens.can_take(ticket.tokens))
+
+    def _grant(self, ticket):
+        queue = self.queues[ticket.session_id]
+        queue.popleft()
+        # The session goes to the back of the line for its next ticket.
+        del self.queues[ticket.session_id]
+        if queue:
+            self.queues[ticket.session_id] = queue
+        self.active += 1
+        self.requests.take(1)
+        self.tokens.take(ticket.tokens)
+        ticket.granted = time.monotonic()
+        self._export()
+        metrics.registry.observe("debate_queue_wait_seconds", ticket.granted - ticket.enqueued)
+
+    def _export(self):
+        metrics.registry.set("debate_queue_depth", sum(len(q) for q in self.queues.values()))
+        metrics.registry.set("debate_active_requests", self.active)
+
+    def acquire(self, session_id, tokens, on_wait=None):
+        """Block until the turn may start. on_wait(position) is called whenever its position changes."""
+        ticket = Ticket(session_id, tokens)
+        with self.cond:
+            self.queues.setdefault(session_id, deque()).append(ticket)
+            self._export()
+        reported = None
+        try:
+            while True:
+                with self.cond:
+                    if self._head() is ticket and self._can_admit(ticket):
+                        self._grant(ticket)
+                        self.cond.notify_all()
+                        return ticket
+                    position = self._position(ticket)
+                    if position == reported or on_wait is None:
+                        # Buckets refill with time, so wake up periodically even without a notify.
+                        self.cond.wait(QUEUE_POLL_INTERVAL)
+                        continue
+                # Report outside the lock; the callback draws to the page.
+                reported = position
+                on_wait(position)
+        except BaseException:
+            # Streamlit interrupts a rerun by raising into the script; don't leave the ticket behind.
+            self.cancel(ticket)
+            raise
+
+    def try_acquire(self, session_id, tokens):
+        # Admit only if nobody is waiting and capacity is free right now (used for speculative work).
+        ticket = Ticket(session_id, tokens)
+        with self.cond:
+            if self.queues or not self._can_admit(ticket):
+                metrics.registry.inc("debate_admissions_skipped_total")
+                return None
+            self.queues[session_id] = deque([ticket])
+            self._grant(ticket)
+            return ticket
+
+    def cancel(self, ticket):
+        # Remove a ticket that is still waiting (e.g. the script was interrupted while queued).
+        with self.cond:
+            queue = self.queues.get(ticket.session_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self.queues[ticket.session_id]
+                self._export()
+                self.cond.notify_all()
+
+    def release(self, ticket, used_tokens=None):
+        with self.cond:
+            self.active -= 1
+            if used_tokens is not None:
+                self.tokens.refund(ticket.tokens - used_tokens)
+            self._export()
+            self.cond.notify_all()
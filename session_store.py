@@ -0,0 +1,182 @@
+import atexit
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import metrics
+import storage
+from config import *
+
+# Debate sessions persisted outside the Streamlit process, so a student can resume on any worker
+# (or after a restart) by opening the page with ?session=<id>. Reruns only hand a serialized
+# snapshot to a background writer; the writer commits all sessions that changed in one batch.
+#
+# A store implements load(session_id) and save_many({session_id: (payload, finished)}), where the
+# payload is the session's JSON.
+
+PHASE_KEYS = ("user_input", "ai_response", "ai_result", "ai_score", "phase_status")
+# Per-session backend state that has to travel with the session (see backends.py and budget.py)
+BACKEND_KEYS = ("transcript", "thread_messages", "pending_messages", "context_summary", "open_turn", "token_usage")
+
+
+def make_store(name, path=SESSION_DB_PATH):
+    if not name:
+        return None
+    if name == "sqlite":
+        return SQLiteSessionStore(path)
+    raise ValueError(f"Unknown SESSION_STORE {name!r}; expected 'sqlite' or None")
+
+
+def capture(state, phases=PHASES):
+    """Return (data, finished): the persistable part of a session's state."""
+    data = {"CURRENT_PHASE": state.get('CURRENT_PHASE', 0), "phases": {}}
+    if 'debate' in state:
+        data["debate"] = state['debate']
+    for phase_name in phases:
+        values = {suffix: state[f"{phase_name}_{suffix}"] for suffix in PHASE_KEYS if f"{phase_name}_{suffix}" in state}
+        if values:
+            data["phases"][phase_name] = values
+    final_phase = list(phases)[-1]
+    finished = "ai_response" in data["phases"].get(final_phase, {})
+    if finished:
+        # Finished debates keep only what was said and scored.
+        return data, True
+    thread = state.get('thread_obj')
+    if thread:
+        data["thread"] = thread.model_dump()
+    for key in BACKEND_KEYS:
+        if key in state:
+            data[key] = state[key]
+    return data, False
+
+
+def restore(state, data):
+    state['CURRENT_PHASE'] = data.get("CURRENT_PHASE", 0)
+    if "debate" in data:
+        state['debate'] = data["debate"]
+    for phase_name, values in data.get("phases", {}).items():
+        for suffix, value in values.items():
+            state[f"{phase_name}_{suffix}"] = value
+    if data.get("thread"):
+        from openai.types.beta import Thread
+        state['thread_obj'] = Thread.model_validate(data["thread"])
+    for key in BACKEND_KEYS:
+        if key in data:
+            state[key] = data[key]
+
+
+class SQLiteSessionStore:
+    """One row per session holding zlib-compressed JSON. WAL mode lets several worker processes
+    on the same host share the file."""
+
+    def __init__(self, path):
+        # Pinned now, so later writes don't follow the working directory
+        self.path = os.path.abspath(path)
+        storage.create(
+            path,
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY,"
+            " state BLOB NOT NULL,"
+            " finished INTEGER NOT NULL DEFAULT 0,"
+            " updated_at REAL NOT NULL)",
+        )
+
+    def load(self, session_id):
+        connection = storage.connect(self.path)
+        try:
+            row = connection.execute("SELECT state FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        finally:
+            connection.close()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def save_many(self, sessions):
+        rows = [
+            (session_id, zlib.compress(payload.encode("utf-8")), int(finished), time.time())
+            for session_id, (payload, finished) in sessions.items()
+        ]
+        connection = storage.connect(self.path)
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO sessions (id, state, finished, updated_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT(id) DO UPDATE SET state = excluded.state,"
+                    " finished = excluded.finished, updated_at = excluded.updated_at",
+                    rows,
+                )
+        finally:
+            connection.close()
+
+
+class WriteBehindStore:
+    """Coalesces saves in memory and commits them every SESSION_FLUSH_INTERVAL seconds.
+
+    save() never touches the disk: it serializes the snapshot, skips it if nothing changed, and
+    leaves it for the writer thread. Only the latest snapshot of each session is written.
+    """
+
+    def __init__(self, store, interval=SESSION_FLUSH_INTERVAL, saved_size=SESSION_SAVED_CACHE_SIZE):
+        self.store = store
+        self.interval = interval
+        self.saved_size = saved_size
+        self.lock = threading.Lock()
+        # Held for a whole flush, so an older batch can never commit after a newer one.
+        self.flush_lock = threading.Lock()
+        self.dirty = {}
+        # Hash of the last written snapshot per session, least recently written first. Sessions that
+        # fall off the end are just written again if they come back unchanged.
+        self.saved = OrderedDict()
+        self.wake = threading.Event()
+        self.writer = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self.writer.start()
+        atexit.register(self.flush)
+
+    def save(self, session_id, data, finished=False):
+        payload = json.dumps(data, separators=(",", ":"))
+        with self.lock:
+            pending = self.dirty.get(session_id)
+            if pending and pending[0] == payload or not pending and self.saved.get(session_id) == hash(payload):
+                return
+            self.dirty[session_id] = (payload, finished)
+        if finished:
+            # Don't leave a finished debate waiting for the next tick.
+            self.wake.set()
+
+    def load(self, session_id):
+        with self.lock:
+            if session_id in self.dirty:
+                return json.loads(self.dirty[session_id][0])
+        return self.store.load(session_id)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.dirty = self.dirty, {}
+            if not batch:
+                return
+            started = time.monotonic()
+            try:
+                self.store.save_many(batch)
+            except Exception as e:
+                # Keep the batch for the next tick, unless a newer snapshot replaced it meanwhile.
+                print(f"Session store write failed: {e}")
+                with self.lock:
+                    for session_id, entry in batch.items():
+                        self.dirty.setdefault(session_id, entry)
+                return
+            with self.lock:
+                for session_id, (payload, _) in batch.items():
+                    self.saved[session_id] = hash(payload)
+                    self.saved.move_to_end(session_id)
+                while len(self.saved) > self.saved_size:
+                    self.saved.popitem(last=False)
+        metrics.registry.inc("debate_session_writes_total", len(batch))
+        metrics.registry.observe("debate_session_flush_seconds", time.monotonic() - started)
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
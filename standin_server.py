@@ -0,0 +1,472 @@
+"""Local stand-in for the subset of the OpenAI API that this app uses (Assistants and Chat Completions).
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1 (any OPENAI_API_KEY works) to
+exercise the full phase flow without spending tokens:
+
+    python standin_server.py --port 8765 --first-token-latency 0.4 --tokens-per-second 60
+
+Replies are filler text of a configurable length. Scoring runs (instructions mentioning a rubric)
+get a JSON score back. Latency, token rate and failures (429s, 500s and streams cut off
+mid-response) are configurable so load tests are reproducible.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the evidence suggests that telemedicine access outcomes patients data privacy wearable "
+         "benefits risks however moreover consider studies show policy care quality cost").split()
+
+
+def _id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def _now():
+    return int(time.time())
+
+
+class StandInState:
+    def __init__(self, settings):
+        self.settings = settings
+        self.lock = threading.RLock()
+        self.assistants = {}
+        self.threads = {}
+        self.messages = {}
+        self.runs = {}
+        self.requests = 0
+        self.dropped = 0
+
+    def assistant(self, assistant_id, **fields):
+        with self.lock:
+            if assistant_id not in self.assistants:
+                self.assistants[assistant_id] = {
+                    "id": assistant_id, "object": "assistant", "created_at": _now(),
+                    "name": fields.get("name"), "instructions": fields.get("instructions"),
+                    "model": fields.get("model", "gpt-4-turbo"), "tools": [], "metadata": {},
+                }
+            return self.assistants[assistant_id]
+
+    def thread(self, thread_id=None):
+        with self.lock:
+            thread_id = thread_id or _id("thread")
+            if thread_id not in self.threads:
+                self.threads[thread_id] = {"id": thread_id, "object": "thread", "created_at": _now(), "metadata": {}}
+                self.messages[thread_id] = []
+            return self.threads[thread_id]
+
+    def add_message(self, thread_id, role, content, run_id=None, assistant_id=None):
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        message = {
+            "id": _id("msg"), "object": "thread.message", "created_at": _now(),
+            "thread_id": thread_id, "role": role, "run_id": run_id, "assistant_id": assistant_id,
+            "status": "completed", "attachments": [], "metadata": {},
+            "content": [{"type": "text", "text": {"value": content, "annotations": []}}],
+        }
+        with self.lock:
+            self.thread(thread_id)
+            self.messages[thread_id].append(message)
+        return message
+
+    def reply_text(self, instructions):
+        settings = self.settings
+        if "rubric" in (instructions or ""):
+            score = random.randint(0, 3)
+            return json.dumps({"argument": str(score), "total": str(score)})
+        count = max(1, int(random.gauss(settings.reply_tokens, settings.reply_tokens * 0.1)))
+        return " ".join(random.choice(WORDS) for _ in range(count)).capitalize() + "."
+
+    def usage(self, thread_id, completion_text, last_messages=None):
+        messages = self.messages.get(thread_id, [])
+        if last_messages:
+            messages = messages[-last_messages:]
+        prompt_chars = sum(len(m["content"][0]["text"]["value"]) for m in messages)
+        prompt_tokens = prompt_chars // 4
+        completion_tokens = len(completion_text.split())
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        if self.state.settings.verbose:
+            super().log_message(format, *args)
+
+    # -- plumbing ----------------------------------------------------------------------------
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message, error_type="server_error"):
+        self._send_json({"error": {"message": message, "type": error_type, "code": None}}, status)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _event(self, event, data):
+        payload = data if isinstance(data, str) else json.dumps(data)
+        self._chunk(f"event: {event}\ndata: {payload}\n\n")
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _drop_point(self):
+        # Where to cut a stream: None keeps it whole, -1 drops the connection before any response
+        # (the run exists but the client never learns its id), otherwise after that many pieces.
+        if random.random() >= self.state.settings.drop_rate:
+            return None
+        return random.randint(-1, 8)
+
+    def _drop(self):
+        # Close without the terminating chunk, like a connection lost mid-response.
+        self.close_connection = True
+        with self.state.lock:
+            self.state.dropped += 1
+
+    def _inject_failure(self):
+        settings = self.state.settings
+        roll = random.random()
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            # Drain the body so the kept-alive connection stays usable.
+            self._body()
+        if roll < settings.rate_limit_rate:
+            self._error(429, "Rate limit reached (stand-in)", "rate_limit_error")
+            return True
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            self._error(500, "Internal error (stand-in)")
+            return True
+        return False
+
+    def _route(self, method):
+        with self.state.lock:
+            self.state.requests += 1
+        time.sleep(self.state.settings.request_latency)
+        path = self.path.split("?", 1)[0]
+        path = re.sub(r"^/v1", "", path).rstrip("/")
+        for pattern, handler_method, name in ROUTES:
+            if handler_method != method:
+                continue
+            match = re.fullmatch(pattern, path)
+            if match:
+                if method != "GET" and self._inject_failure():
+                    return
+                return getattr(self, name)(*match.groups())
+        self._error(404, f"No stand-in route for {method} {path}", "invalid_request_error")
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def _query(self):
+        if "?" not in self.path:
+            return {}
+        pairs = [p.split("=", 1) for p in self.path.split("?", 1)[1].split("&") if "=" in p]
+        return dict(pairs)
+
+    # -- assistants / threads / messages -----------------------------------------------------
+
+    def create_assistant(self):
+        body = self._body()
+        self._send_json(self.state.assistant(_id("asst"), **body))
+
+    def retrieve_assistant(self, assistant_id):
+        self._send_json(self.state.assistant(assistant_id))
+
+    def create_thread(self):
+        body = self._body()
+        thread = self.state.thread()
+        for message in body.get("messages") or []:
+            self.state.add_message(thread["id"], message["role"], message["content"])
+        self._send_json(thread)
+
+    def retrieve_thread(self, thread_id):
+        if thread_id not in self.state.threads:
+            return self._error(404, f"No thread found with id '{thread_id}'.", "invalid_request_error")
+        self._send_json(self.state.threads[thread_id])
+
+    def delete_thread(self, thread_id):
+        with self.state.lock:
+            self.state.threads.pop(thread_id, None)
+            self.state.messages.pop(thread_id, None)
+        self._send_json({"id": thread_id, "object": "thread.deleted", "deleted": True})
+
+    def create_message(self, thread_id):
+        body = self._body()
+        self._send_json(self.state.add_message(thread_id, body["role"], body["content"]))
+
+    def list_messages(self, thread_id):
+        query = self._query()
+        messages = list(self.state.messages.get(thread_id, []))
+        if query.get("run_id"):
+            messages = [m for m in messages if m["run_id"] == query["run_id"]]
+        if query.get("order", "desc") == "desc":
+            messages.reverse()
+        self._send_json({"object": "list", "data": messages, "has_more": False,
+                         "first_id": messages[0]["id"] if messages else None,
+                         "last_id": messages[-1]["id"] if messages else None})
+
+    # -- runs --------------------------------------------------------------------------------
+
+    def _new_run(self, thread_id, body):
+        run = {
+            "id": _id("run"), "object": "thread.run", "created_at": _now(), "thread_id": thread_id,
+            "assistant_id": body.get("assistant_id"), "status": "queued", "model": body.get("model") or "gpt-4-turbo",
+            "instructions": body.get("instructions") or "", "tools": [], "metadata": body.get("metadata") or {},
+            "temperature": body.get("temperature"), "usage": None, "parallel_tool_calls": True,
+            "truncation_strategy": body.get("truncation_strategy") or {"type": "auto", "last_messages": None},
+            "max_completion_tokens": body.get("max_completion_tokens"), "max_prompt_tokens": body.get("max_prompt_tokens"),
+            "incomplete_details": None,
+            "response_format": body.get("response_format") or "auto", "tool_choice": "auto",
+            "additional_instructions": body.get("additional_instructions"),
+        }
+        with self.state.lock:
+            self.state.runs[run["id"]] = run
+        for message in body.get("additional_messages") or []:
+            self.state.add_message(thread_id, message["role"], message["content"])
+        return run
+
+    def _generate(self, run):
+        # Yields reply words at the configured token rate; the run may be cancelled in between.
+        settings = self.state.settings
+        instructions = (run.get("instructions") or "") + (run.get("additional_instructions") or "")
+        text = self.state.reply_text(instructions)
+        limit = run.get("max_completion_tokens")
+        words = text.split(" ")
+        if limit and len(words) > limit:
+            # Upstream stops at the cap and ends the run as incomplete.
+            words = words[:limit]
+            run["incomplete_details"] = {"reason": "max_completion_tokens"}
+        time.sleep(settings.first_token_latency)
+        for index, word in enumerate(words):
+            if run["status"] == "cancelling":
+                return
+            yield word if index == 0 else " " + word
+            if settings.tokens_per_second:
+                time.sleep(1.0 / settings.tokens_per_second)
+
+    def _finish_run(self, run, text, status=None):
+        thread_id = run["thread_id"]
+        # Usage is counted before the reply joins the thread, honouring the run's truncation strategy.
+        run["usage"] = self.state.usage(thread_id, text, run["truncation_strategy"].get("last_messages"))
+        message = self.state.add_message(thread_id, "assistant", text, run_id=run["id"], assistant_id=run["assistant_id"])
+        if status is None:
+            status = "incomplete" if run.get("incomplete_details") else "completed"
+        run["status"] = "cancelled" if run["status"] == "cancelling" else status
+        return message
+
+    def create_run(self, thread_id):
+        self._run(thread_id, self._body())
+
+    def create_thread_and_run(self):
+        # threads.create_and_run: a new thread seeded with the body's messages, and a run on it.
+        body = self._body()
+        thread = self.state.thread()
+        for message in (body.get("thread") or {}).get("messages") or []:
+            self.state.add_message(thread["id"], message["role"], message["content"])
+        self._run(thread["id"], body, thread)
+
+    def _run(self, thread_id, body, new_thread=None):
+        with self.state.lock:
+            active = [r["id"] for r in self.state.runs.values()
+                      if r["thread_id"] == thread_id and r["status"] in ("queued", "in_progress", "cancelling")]
+        if active:
+            return self._error(400, f"Thread {thread_id} already has an active run {active[0]}.", "invalid_request_error")
+        run = self._new_run(thread_id, body)
+        if not body.get("stream"):
+            # Non-streaming runs complete in the background; clients poll them.
+            def complete():
+                run["status"] = "in_progress"
+                self._finish_run(run, "".join(self._generate(run)))
+            threading.Thread(target=complete, daemon=True).start()
+            return self._send_json(run)
+
+        drop_at = self._drop_point()
+        pieces = self._generate(run)
+        parts = []
+
+        def finish_in_background():
+            # The client is gone but the run carries on server-side, as it would upstream.
+            def complete():
+                run["status"] = "in_progress"
+                parts.extend(pieces)
+                self._finish_run(run, "".join(parts))
+            threading.Thread(target=complete, daemon=True).start()
+
+        if drop_at == -1:
+            finish_in_background()
+            return self._drop()
+        try:
+            self._start_stream()
+            if new_thread:
+                self._event("thread.created", new_thread)
+            self._event("thread.run.created", run)
+            run["status"] = "in_progress"
+            self._event("thread.run.in_progress", run)
+            message_id = _id("msg")
+            self._event("thread.message.created", {
+                "id": message_id, "object": "thread.message", "created_at": _now(), "thread_id": thread_id,
+                "role": "assistant", "run_id": run["id"], "assistant_id": run["assistant_id"], "status": "in_progress",
+                "content": [], "attachments": [], "metadata": {},
+            })
+            for piece in pieces:
+                if len(parts) == drop_at:
+                    parts.append(piece)
+                    finish_in_background()
+                    return self._drop()
+                parts.append(piece)
+                self._event("thread.message.delta", {
+                    "id": message_id, "object": "thread.message.delta",
+                    "delta": {"content": [{"index": 0, "type": "text", "text": {"value": piece}}]},
+                })
+        except (BrokenPipeError, ConnectionResetError):
+            # The client hung up; closing a stream doesn't stop the run.
+            self.close_connection = True
+            return finish_in_background()
+        self._finish_run(run, "".join(parts))
+        self._event(f"thread.run.{run['status']}", run)
+        self._chunk("event: done\ndata: [DONE]\n\n")
+        self._end_stream()
+
+    def retrieve_run(self, thread_id, run_id):
+        run = self.state.runs.get(run_id)
+        if not run:
+            return self._error(404, f"No run found with id '{run_id}'.", "invalid_request_error")
+        self._send_json(run)
+
+    def list_runs(self, thread_id):
+        runs = [r for r in self.state.runs.values() if r["thread_id"] == thread_id]
+        runs.sort(key=lambda r: r["created_at"], reverse=True)
+        self._send_json({"object": "list", "data": runs, "has_more": False,
+                         "first_id": runs[0]["id"] if runs else None, "last_id": runs[-1]["id"] if runs else None})
+
+    def cancel_run(self, thread_id, run_id):
+        run = self.state.runs.get(run_id)
+        if not run:
+            return self._error(404, f"No run found with id '{run_id}'.", "invalid_request_error")
+        if run["status"] not in ("queued", "in_progress"):
+            return self._error(400, f"Cannot cancel run with status '{run['status']}'.", "invalid_request_error")
+        run["status"] = "cancelling"
+        self._send_json(run)
+
+
+    # -- chat completions --------------------------------------------------------------------
+
+    def chat_completion(self):
+        body = self._body()
+        messages = body.get("messages") or []
+        instructions = " ".join(m["content"] for m in messages if m.get("role") == "system" and isinstance(m.get("content"), str))
+        run = {"status": "in_progress", "instructions": instructions,
+               "max_completion_tokens": body.get("max_completion_tokens") or body.get("max_tokens")}
+        completion_id = _id("chatcmpl")
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        if not body.get("stream"):
+            text = "".join(self._generate(run))
+            completion_tokens = len(text.split())
+            return self._send_json({
+                "id": completion_id, "object": "chat.completion", "created": _now(), "model": body.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            })
+
+        def chunk(delta, finish_reason=None, usage=None, choices=True):
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": _now(),
+                    "model": body.get("model"), "usage": usage,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else []}
+
+        drop_at = self._drop_point()
+        if drop_at == -1:
+            return self._drop()
+        self._start_stream()
+        self._chunk(f"data: {json.dumps(chunk({'role': 'assistant', 'content': ''}))}\n\n")
+        completion_tokens = 0
+        for piece in self._generate(run):
+            if completion_tokens == drop_at:
+                return self._drop()
+            completion_tokens += 1
+            self._chunk(f"data: {json.dumps(chunk({'content': piece}))}\n\n")
+        self._chunk(f"data: {json.dumps(chunk({}, 'length' if run.get('incomplete_details') else 'stop'))}\n\n")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                     "total_tokens": prompt_tokens + completion_tokens}
+            self._chunk(f"data: {json.dumps(chunk({}, usage=usage, choices=False))}\n\n")
+        self._chunk("data: [DONE]\n\n")
+        self._end_stream()
+
+
+ROUTES = [
+    (r"/chat/completions", "POST", "chat_completion"),
+    (r"/assistants", "POST", "create_assistant"),
+    (r"/assistants/([^/]+)", "GET", "retrieve_assistant"),
+    (r"/threads", "POST", "create_thread"),
+    (r"/threads/runs", "POST", "create_thread_and_run"),
+    (r"/threads/([^/]+)", "GET", "retrieve_thread"),
+    (r"/threads/([^/]+)", "DELETE", "delete_thread"),
+    (r"/threads/([^/]+)/messages", "POST", "create_message"),
+    (r"/threads/([^/]+)/messages", "GET", "list_messages"),
+    (r"/threads/([^/]+)/runs", "POST", "create_run"),
+    (r"/threads/([^/]+)/runs", "GET", "list_runs"),
+    (r"/threads/([^/]+)/runs/([^/]+)", "GET", "retrieve_run"),
+    (r"/threads/([^/]+)/runs/([^/]+)/cancel", "POST", "cancel_run"),
+]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--request-latency", type=float, default=0.05, help="seconds added to every request")
+    parser.add_argument("--first-token-latency", type=float, default=0.4, help="seconds before the first delta")
+    parser.add_argument("--tokens-per-second", type=float, default=60, help="0 streams as fast as possible")
+    parser.add_argument("--reply-tokens", type=int, default=150, help="mean words per reply")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of writes answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of writes answered with 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of streams cut off mid-response")
+    parser.add_argument("--verbose", action="store_true")
+    return parser
+
+
+def make_server(settings):
+    handler = type("StandInHandler", (Handler,), {"state": StandInState(settings)})
+    return ThreadingHTTPServer((settings.host, settings.port), handler)
+
+
+if __name__ == "__main__":
+    settings = build_parser().parse_args()
+    server = make_server(settings)
+    print(f"Stand-in API listening on http://{settings.host}:{server.server_port}/v1")
+    server.serve_forever()
@@ -0,0 +1,128 @@
+"""Measure how quickly a fresh app process starts and draws its first page.
+
+Every sample runs in a new Python process, so nothing is warm:
+
+- import time: importing main.py on top of Streamlit (which the Streamlit server has loaded already),
+  plus the modules that contribute most to it;
+- first paint: the first session's first script run in that process (headless, via AppTest),
+  and a second session's first run once the background warm-up has finished.
+
+The first page shouldn't need the API, so no server is required. With --start-server the stand-in
+answers the background assistant warm-up instead of refusing it:
+
+    python startup_benchmark.py --runs 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from loadtest import HERE, start_server, summarize
+
+IMPORT_SAMPLE = """
+import json, sys, time
+started = time.perf_counter()
+import streamlit
+imported_streamlit = time.perf_counter()
+import main
+imported_main = time.perf_counter()
+print(json.dumps({"streamlit": imported_streamlit - started, "app": imported_main - imported_streamlit,
+                  "openai_loaded": "openai" in sys.modules}))
+"""
+
+PAINT_SAMPLE = """
+import json, sys, threading, time
+from streamlit.testing.v1 import AppTest
+import config
+paints = []
+for session in range(2):
+    started = time.perf_counter()
+    at = AppTest.from_file("main.py", default_timeout=60)
+    at.run()
+    paints.append(time.perf_counter() - started)
+    if at.exception or not at.title or at.title[0].value != config.APP_TITLE:
+        raise SystemExit(f"first page wasn't drawn: {[e.message for e in at.exception]}")
+    for thread in threading.enumerate():
+        if thread.name == "bootstrap-prewarm":
+            thread.join()
+print(json.dumps({"first": paints[0], "warm": paints[1]}))
+"""
+
+
+def sample(code, env):
+    result = subprocess.run([sys.executable, "-c", code], cwd=HERE, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "sample failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(env, count):
+    # Direct imports of main.py (after Streamlit) by cumulative time, from python -X importtime.
+    code = "import streamlit; import main"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=HERE, env=env,
+                            capture_output=True, text=True)
+    modules, children = [], []
+    # Lines come out as each import finishes, so a module's children are listed before it.
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((int(cumulative) / 1e6, name.strip()))
+        elif depth == 0:
+            if name.strip() == "main":
+                modules = children
+            children = []
+    return sorted(modules, reverse=True)[:count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports to list")
+    parser.add_argument("--base-url", default=None, help="API base URL (default: the stand-in on --port)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--start-server", action="store_true", help="launch standin_server.py for the run")
+    parser.add_argument("--json", dest="json_path", default=None, help="also write the report as JSON")
+    parser.add_argument("server_args", nargs="*", help="extra standin_server.py arguments, after --")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env["OPENAI_BASE_URL"] = args.base_url or f"http://127.0.0.1:{args.port}/v1"
+    env.setdefault("OPENAI_API_KEY", "stand-in")
+    server = start_server(args) if args.start_server else None
+    try:
+        imports = [sample(IMPORT_SAMPLE, env) for _ in range(args.runs)]
+        paints = [sample(PAINT_SAMPLE, env) for _ in range(args.runs)]
+        slowest = top_imports(env, args.top)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "streamlit_import": summarize([s["streamlit"] for s in imports]),
+        "app_import": summarize([s["app"] for s in imports]),
+        "openai_imported_at_startup": any(s["openai_loaded"] for s in imports),
+        "first_paint": summarize([s["first"] for s in paints]),
+        "warm_first_paint": summarize([s["warm"] for s in paints]),
+        "slowest_imports": slowest,
+    }
+
+    print(f"{args.runs} fresh processes per measurement")
+    for name in ("streamlit_import", "app_import", "first_paint", "warm_first_paint"):
+        stats = report[name]
+        print(f"{name:>20}: p50 {stats['p50']*1000:8.1f} ms  p95 {stats['p95']*1000:8.1f} ms")
+    print(f"{'openai at startup':>20}: {'imported' if report['openai_imported_at_startup'] else 'deferred'}")
+    for seconds, module in slowest:
+        print(f"{'import ' + module:>20}: {seconds*1000:8.1f} ms")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+import os
+import sqlite3
+
+# SQLite files shared by the worker processes on one host (session_store.py, budget.py). WAL mode
+# lets readers and a writer from different processes use the file at the same time.
+
+
+def connect(path):
+    # Connections are cheap and not shared between threads.
+    return sqlite3.connect(path, timeout=30)
+
+
+def create(path, *statements):
+    """Create the file (and its directory) in WAL mode and run the CREATE statements."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = connect(path)
+    try:
+        with connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            for statement in statements:
+                connection.execute(statement)
+    finally:
+        connection.close()
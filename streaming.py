@@ -0,0 +1,63 @@
+import time
+
+from config import STREAM_FLUSH_INTERVAL, STREAM_FLUSH_CHARS, STREAM_REPLAY_CHUNK, STREAM_REPLAY_DELAY
+
+
+class StreamRenderer:
+    """Collects streamed text and redraws a Streamlit element on a time/size budget.
+
+    Appending is O(1); the full text is only joined when the box is redrawn, so a long
+    reply costs a handful of redraws instead of one per delta.
+    """
+
+    def __init__(self, box=None, prefix="", icon="🤖", flush_interval=STREAM_FLUSH_INTERVAL, flush_chars=STREAM_FLUSH_CHARS):
+        self.box = box
+        self.prefix = prefix
+        self.icon = icon
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.parts = []
+        self.flushes = 0
+        self.first_chunk_at = None
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+
+    def append(self, chunk):
+        if not chunk:
+            return
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.monotonic()
+        self.parts.append(chunk)
+        self._pending_chars += len(chunk)
+        if (self._pending_chars >= self.flush_chars
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def text(self):
+        return "".join(self.parts).strip()
+
+    def flush(self):
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        if self.box is None:
+            return
+        self.box.info(body=f"{self.prefix}{self.text()}", icon=self.icon)
+        self.flushes += 1
+
+    def reset(self):
+        # The reply is starting over (e.g. a retried stream); drop what was drawn so far.
+        self.parts = []
+        self._pending_chars = 1
+
+    def close(self):
+        # Final flush so the last partial chunk is always drawn.
+        if self._pending_chars or self.flushes == 0:
+            self.flush()
+        return self.text()
+
+    def replay(self, text, chunk_chars=STREAM_REPLAY_CHUNK, delay=STREAM_REPLAY_DELAY):
+        # Stream already-known text locally so a cached reply reads like a live one.
+        for start in range(0, len(text), chunk_chars):
+            self.append(text[start:start + chunk_chars])
+            time.sleep(delay)
+        return self.close()
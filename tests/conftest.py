@@ -0,0 +1,49 @@
+import argparse
+import os
+import socket
+
+import pytest
+
+# The phase-flow tests run against standin_server.py, never the real API.
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def standin():
+    """Base URL of a fast stand-in API server, running for the whole test session."""
+    from loadtest import start_server
+
+    port = free_port()
+    args = argparse.Namespace(port=port, server_args=[
+        "--request-latency", "0", "--first-token-latency", "0", "--tokens-per-second", "0", "--reply-tokens", "30",
+    ])
+    server = start_server(args)
+    base_url = f"http://127.0.0.1:{port}/v1"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stand-in")
+    yield base_url
+    server.terminate()
+    server.wait()
+
+
+@pytest.fixture
+def client(standin):
+    import openai
+    return openai.OpenAI(base_url=standin, api_key="stand-in", max_retries=0)
+
+
+@pytest.fixture(scope="module")
+def app_dir(tmp_path_factory):
+    # main.py keeps its caches and sessions under .cache in the working directory
+    import budget
+
+    directory = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(directory)
+        patch.setattr(budget, "deployment", budget.DeploymentBudget(path=None, db_path=str(directory / "budget.sqlite3")))
+        yield
@@ -0,0 +1,150 @@
+import threading
+
+import pytest
+
+import config
+from backends import make_backend
+
+ANSWERED = [(name, phase) for name, phase in config.PHASES.items() if phase["type"] != "markdown"]
+
+
+@pytest.fixture
+def backend(request, client):
+    assistant = None
+    if request.param == "assistants":
+        assistant = client.beta.assistants.create(model=config.OPENAI_MODEL, instructions=config.ASSISTANT_INSTRUCTIONS)
+    backend = make_backend(request.param, client, assistant, {})
+    backend.start_session()
+    return backend
+
+
+def run(backend, content, **kwargs):
+    events = list(backend.stream_turn(kwargs.pop("instructions", ""), [{"role": "user", "content": content}], **kwargs))
+    text = "".join(value for event, value in events if event == "delta")
+    return text, events
+
+
+def thread_messages(client, backend):
+    return list(client.beta.threads.messages.list(thread_id=backend.thread.id, limit=100))
+
+
+@pytest.mark.parametrize("backend", ["assistants", "chat"], indirect=True)
+def test_phases_build_the_conversation(backend, client):
+    for name, phase in ANSWERED:
+        reply, events = run(backend, f"My answer to {name}", instructions=phase.get("instructions", ""), phase=name)
+        assert reply
+        assert any(event == "usage" for event, _ in events)
+        if phase.get("scored_phase"):
+            # Scoring runs answer without leaving anything in the conversation
+            run(backend, "Score it", persist=False, phase=name, temperature=.2, response_format="json")
+
+    history = backend.history()
+    assert [message["role"] for message in history] == ["user", "assistant"] * len(ANSWERED)
+    assert [message["content"] for message in history[::2]] == [f"My answer to {name}" for name, _ in ANSWERED]
+    assert "Score it" not in str(history)
+    if backend.name == "assistants":
+        assert len(thread_messages(client, backend)) == len(history)
+
+
+@pytest.mark.parametrize("backend", ["assistants", "chat"], indirect=True)
+def test_exchanges_answered_without_the_model_join_the_history(backend, client):
+    backend.record_exchange("Sam", "Welcome, Sam!")
+    run(backend, "My argument", phase="argument")
+    history = backend.history()
+    assert [message["content"] for message in history[:3]] == ["Sam", "Welcome, Sam!", "My argument"]
+    if backend.name == "assistants":
+        assert len(thread_messages(client, backend)) == 4
+
+
+@pytest.mark.parametrize("backend", ["assistants"], indirect=True)
+def test_scoring_takes_a_single_request(backend, client, monkeypatch):
+    import backends
+    run(backend, "My argument", phase="argument")
+
+    def unexpected(*args, **kwargs):
+        raise AssertionError("scoring should only call create_and_run")
+
+    monkeypatch.setattr(client.beta.threads, "create", unexpected)
+    monkeypatch.setattr(client.beta.threads.runs, "create", unexpected)
+    deleted = threading.Event()
+    monkeypatch.setattr(backends, "delete_scratch_thread", lambda client, thread_id: deleted.set())
+    score, events = run(backend, "Score it", persist=False, phase="argument", response_format="json")
+    assert score and any(event == "usage" for event, _ in events)
+    # The scratch thread is deleted in the background, after the reply was read
+    assert deleted.wait(5)
+    assert len(thread_messages(client, backend)) == 2
+
+
+@pytest.mark.parametrize("backend", ["assistants", "chat"], indirect=True)
+def test_replies_cut_off_at_the_token_cap_are_flagged(backend):
+    _, events = run(backend, "A long answer, please", phase="argument", max_tokens=5)
+    assert ("truncated" in [event for event, _ in events])
+
+
+@pytest.mark.parametrize("backend", ["assistants", "chat"], indirect=True)
+def test_speculation_is_capped_and_reports_its_usage(backend):
+    text, usage = backend.speculate([], "Nuclear power", "", threading.Event())
+    assert text and usage.completion_tokens > 0
+    # A guess cut off at the cap isn't served, but what it cost is still reported
+    text, usage = backend.speculate([], "Nuclear power", "", threading.Event(), max_tokens=5)
+    assert text is None
+    assert usage.completion_tokens <= 5
+
+
+@pytest.mark.parametrize("backend", ["assistants", "chat"], indirect=True)
+def test_summaries_report_their_usage(backend, monkeypatch):
+    import compaction
+    monkeypatch.setattr(compaction, "CONTEXT_TOKEN_BUDGET", 0)
+    summaries = []
+    for turn in range(4):
+        _, events = run(backend, f"Argument {turn}", phase="argument")
+        summaries += [value for event, value in events if event == "summary_usage"]
+    assert summaries and all(usage.total_tokens > 0 for usage in summaries)
+
+
+def test_warming_openings_is_recorded_in_the_deployment_budget(client, tmp_path, monkeypatch):
+    import budget
+    import opening_cache
+    monkeypatch.setattr(opening_cache, "OPENING_CACHE_DIR", str(tmp_path / "openings"))
+    phases = {"topic": {"type": "selectbox", "label": "Topic", "options": ["Nuclear power"], "cache_opening": True}}
+    deployment = budget.DeploymentBudget(path=None, db_path=str(tmp_path / "budget.sqlite3"))
+    backend = make_backend("chat", client, None, {}, phases)
+    assert opening_cache.warm_openings(backend, phases, deployment=deployment) == opening_cache.OPENING_CACHE_VARIANTS
+    assert deployment.snapshot()["phases"]["topic"]["turns"] == opening_cache.OPENING_CACHE_VARIANTS
+
+
+@pytest.mark.parametrize("backend_name, student", [("assistants", 1), ("chat", 2)])
+def test_app_runs_every_phase(app_dir, standin, monkeypatch, backend_name, student):
+    import debates
+    from loadtest import Results, run_student
+
+    monkeypatch.setattr(config, "AI_BACKEND", backend_name)
+    results = Results()
+    run_student(student, results, timeout=60, think_time=0, debate=debates.library.get())
+    assert results.errors == []
+    assert results.completed == 1
+    assert len(results.samples["turn"]) == len(ANSWERED)
+
+
+
+def test_debug_panel_refetches_the_assistant(app_dir, standin, monkeypatch):
+    import os
+
+    import metrics
+    from streamlit.testing.v1 import AppTest
+
+    def retrieves():
+        return metrics.registry.counters.get(("debate_api_requests_total", (("call", "assistants.retrieve"),)), 0)
+
+    monkeypatch.setattr(config, "AI_BACKEND", "assistants")
+    monkeypatch.setattr(config, "SCORING_DEBUG_MODE", True)
+    at = AppTest.from_file(os.path.join(os.path.dirname(config.__file__), "main.py"), default_timeout=60)
+    at.run()
+    at.text_input[-1].input("Sam").run()
+    at.button(key="submit 1").click().run()
+    before = retrieves()
+    at.button(key="refresh assistant").click().run()
+    at.selectbox[-1].select(config.PHASES["debate_topic"]["options"][1]).run()
+    at.button(key="submit 2").click().run()
+    assert not at.exception
+    assert retrieves() == before + 1
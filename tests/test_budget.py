@@ -0,0 +1,132 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import budget
+from budget import DeploymentBudget, forecast, plan_turn, record_usage
+
+
+@pytest.fixture(autouse=True)
+def budgets(monkeypatch):
+    monkeypatch.setattr(budget, "SESSION_TOKEN_BUDGET", 10000)
+    monkeypatch.setattr(budget, "PHASE_TOKEN_BUDGET", 5000)
+    monkeypatch.setattr(budget, "BUDGET_DEGRADE_FRACTION", 0.2)
+    monkeypatch.setattr(budget, "BUDGET_DEGRADED_MAX_TOKENS", 300)
+    monkeypatch.setattr(budget, "MAX_TOKENS", 1000)
+
+
+def deployment(tmp_path, limit=0):
+    return DeploymentBudget(limit=limit, window=3600, path=None, db_path=str(tmp_path / "budget.sqlite3"))
+
+
+def usage(prompt_tokens, completion_tokens=0):
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+def test_fresh_session_runs_normally():
+    plan = plan_turn({}, "argument")
+    assert plan == {"verdict": "ok", "scope": None, "max_tokens": 1000, "instructions": ""}
+
+
+def test_nearly_spent_phase_gets_short_replies():
+    state = {}
+    record_usage(state, "argument", usage(4000, 200))
+    plan = plan_turn(state, "argument")
+    assert plan["verdict"] == "degraded" and plan["scope"] == "phase"
+    assert plan["max_tokens"] == 300
+    assert plan["instructions"]
+    # Other phases still have their own budget
+    assert plan_turn(state, "defence")["verdict"] == "ok"
+
+
+def test_spent_session_is_refused():
+    state = {}
+    record_usage(state, "argument", usage(4000))
+    record_usage(state, "defence", usage(4000))
+    record_usage(state, "closing", usage(1800))
+    plan = plan_turn(state, "rebuttal")
+    assert plan["verdict"] == "refused" and plan["scope"] == "session"
+
+
+def test_scoring_runs_are_never_refused():
+    state = {}
+    record_usage(state, "argument", usage(5000))
+    assert plan_turn(state, "argument")["verdict"] == "refused"
+    assert plan_turn(state, "argument", scoring_run=True)["verdict"] == "ok"
+
+
+def test_session_usage_is_kept_in_state():
+    state = {}
+    record_usage(state, "argument", usage(100, 20))
+    record_usage(state, "argument", None)
+    assert state["token_usage"]["phases"]["argument"] == {"prompt_tokens": 100, "completion_tokens": 20, "turns": 1}
+
+
+def test_deployment_limit_is_shared_by_every_instance(tmp_path):
+    # Two instances on one file stand in for two worker processes
+    first, second = deployment(tmp_path, limit=2000), deployment(tmp_path, limit=2000)
+    record_usage({}, "argument", usage(900, 100), first, session_id="s1")
+    assert second.used() == 1000
+    assert plan_turn({}, "argument", second)["verdict"] == "ok"
+    record_usage({}, "argument", usage(800, 100), second, session_id="s2")
+    plan = plan_turn({}, "argument", first)
+    assert plan["verdict"] == "refused" and plan["scope"] == "deployment"
+
+
+def test_uncapped_deployment_is_not_queried(tmp_path, monkeypatch):
+    shared = deployment(tmp_path)
+    monkeypatch.setattr(shared, "used", lambda: pytest.fail("used() queried without a cap"))
+    assert plan_turn({}, "argument", shared)["verdict"] == "ok"
+
+
+def test_deployment_window_drops_old_turns_but_keeps_totals(tmp_path):
+    shared = deployment(tmp_path)
+    shared.record("s1", "argument", 500, 0, new_session=True)
+    shared.window = 0
+    assert shared.used() == 0
+    shared.record("s1", "argument", 200, 0)
+    connection = shared._connect()
+    try:
+        assert connection.execute("SELECT COUNT(*) FROM recent_turns").fetchone()[0] == 1
+    finally:
+        connection.close()
+    snapshot = shared.snapshot()
+    assert snapshot["tokens"] == 700
+    assert snapshot["phases"]["argument"]["turns"] == 2
+    assert snapshot["sessions"] == 1
+
+
+def test_first_turn_counts_the_session(tmp_path):
+    shared = deployment(tmp_path)
+    state = {}
+    record_usage(state, "argument", usage(100), shared, session_id="s1")
+    record_usage(state, "defence", usage(100), shared, session_id="s1")
+    assert shared.snapshot()["sessions"] == 1
+
+
+def test_export_writes_the_snapshot_once_usage_changes(tmp_path):
+    shared = DeploymentBudget(limit=0, window=3600, path=str(tmp_path / "budget.json"), db_path=str(tmp_path / "budget.sqlite3"))
+    shared.export_changes()
+    assert not (tmp_path / "budget.json").exists()
+    shared.record("s1", "argument", 100, 50, new_session=True)
+    assert shared.exporter is not None
+    shared.export_changes()
+    assert json.loads((tmp_path / "budget.json").read_text())["tokens"] == 150
+
+
+def test_snapshot_and_forecast(tmp_path, monkeypatch):
+    monkeypatch.setattr(budget, "TOKEN_PRICES", {"test-model": (1.0, 2.0)})
+    shared = deployment(tmp_path)
+    assert forecast(shared.snapshot(), 10) is None
+    shared.record("s1", "argument", 1000, 500, model="test-model", new_session=True)
+    shared.record("s2", "argument", 3000, 500, model="test-model", new_session=True)
+    shared.record("s2", "defence", 0, 1000, model="test-model")
+    snapshot = shared.snapshot()
+    assert snapshot["sessions"] == 2
+    assert snapshot["phases"]["argument"]["turns"] == 2
+    assert snapshot["tokens"] == 6000
+    assert snapshot["cost"] == pytest.approx(0.008)
+    estimate = forecast(snapshot, 10)
+    assert estimate["tokens"] == 30000
+    assert estimate["cost"] == pytest.approx(0.04)
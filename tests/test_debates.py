@@ -0,0 +1,109 @@
+import json
+import os
+
+import pytest
+
+import debates
+from debates import DebateConfigError, DebateLibrary, DebateNotFound, validate
+from phases import compile_phases
+
+ANSWER = {"type": "text_area", "label": "Your argument"}
+
+
+def definition(**phases):
+    return {"title": "Test", "phases": phases or {"argument": dict(ANSWER)}}
+
+
+@pytest.mark.parametrize("data, problem", [
+    ([], "must be a mapping"),
+    ({"phases": {}}, "non-empty mapping"),
+    ({"phases": {"a": ANSWER}, "theme": "dark"}, "unknown keys"),
+    (definition(argument=dict(ANSWER, colour="red")), "unknown keys"),
+    (definition(**{"bad name": ANSWER}), "names may only use"),
+    (definition(argument=dict(ANSWER, type="slider")), "'type' must be one of"),
+    (definition(argument={"type": "text_area"}), "needs a 'label'"),
+    (definition(intro={"type": "markdown"}, argument=ANSWER), "needs a 'body'"),
+    (definition(side={"type": "radio", "label": "Side?", "options": []}), "'options'"),
+    (definition(argument=dict(ANSWER, minimum_score="3")), "must be a number"),
+    (definition(argument=dict(ANSWER, scored_phase=True, minimum_score=3)), "needs a 'rubric'"),
+    (definition(argument=dict(ANSWER, scored_phase=True, rubric="Score it")), "needs a 'minimum_score'"),
+    (definition(argument=dict(ANSWER, prefilter={"max_words": 10})), "unknown prefilter keys"),
+    (definition(intro={"type": "markdown", "body": "Hi"}), "at least one phase"),
+])
+def test_validate_rejects(data, problem):
+    with pytest.raises(DebateConfigError, match=problem):
+        validate(data, "test.json")
+
+
+def test_validate_accepts_a_scored_phase():
+    validate(definition(argument=dict(ANSWER, scored_phase=True, rubric="Score it", minimum_score=3,
+                                      prefilter={"min_words": 5, "keywords": ["energy"]})), "test.json")
+
+
+def test_shipped_debates_are_valid():
+    library = DebateLibrary(os.path.join(os.path.dirname(debates.__file__), "debates"))
+    for name in library.names():
+        library.get(name)
+
+
+def test_loaded_definitions_are_read_only():
+    debate = debates.compile_debate("test", definition(), "test.json")
+    with pytest.raises(TypeError):
+        debate.phases["argument"]["label"] = "changed"
+    assert debate.namespace == "test"
+
+
+def test_compile_phases_keeps_order_and_widget_arguments():
+    phases = compile_phases({
+        "intro": {"type": "markdown", "body": "Hi", "no_submission": True},
+        "name": {"type": "text_input", "label": "Name?", "instructions": "Greet them", "max_chars": 0},
+    })
+    assert [(phase.index, phase.name, phase.type) for phase in phases] == [(0, "intro", "markdown"), (1, "name", "text_input")]
+    # Only widget arguments are passed on, and falsy ones are left out
+    assert dict(phases[1].kwargs) == {"label": "Name?"}
+    with pytest.raises(TypeError):
+        phases[1].kwargs["label"] = "changed"
+
+
+@pytest.fixture
+def library(tmp_path):
+    return DebateLibrary(str(tmp_path), reload_interval=0)
+
+
+def write(tmp_path, name, data, mtime):
+    path = tmp_path / f"{name}.json"
+    path.write_text(json.dumps(data))
+    # Explicit mtimes, so quick successive writes still look like edits
+    os.utime(path, ns=(mtime, mtime))
+    return path
+
+
+def test_library_reloads_edited_files(library, tmp_path):
+    write(tmp_path, "energy", definition(), 1_000_000_000)
+    assert library.get("energy").phases["argument"]["label"] == "Your argument"
+    write(tmp_path, "energy", definition(argument=dict(ANSWER, label="Make your case")), 2_000_000_000)
+    assert library.get("energy").phases["argument"]["label"] == "Make your case"
+
+
+def test_library_keeps_the_last_good_version(library, tmp_path):
+    write(tmp_path, "energy", definition(), 1_000_000_000)
+    loaded = library.get("energy")
+    write(tmp_path, "energy", {"phases": {}}, 2_000_000_000)
+    assert library.get("energy") is loaded
+
+
+def test_library_rejects_unknown_and_malformed_names(library, tmp_path):
+    with pytest.raises(DebateNotFound):
+        library.get("missing")
+    with pytest.raises(DebateNotFound):
+        library.get("../config")
+    write(tmp_path, "broken", {"phases": {}}, 1_000_000_000)
+    with pytest.raises(DebateConfigError):
+        library.get("broken")
+
+
+def test_library_reads_yaml(library, tmp_path):
+    yaml = pytest.importorskip("yaml")
+    (tmp_path / "energy.yaml").write_text(yaml.safe_dump(definition()))
+    assert library.get("energy").phases["argument"]["type"] == "text_area"
+    assert library.names() == ["default", "energy"]
@@ -0,0 +1,84 @@
+import pytest
+
+from phases import extract_score, passed, prescore, score_submission
+
+
+@pytest.mark.parametrize("text, score", [
+    ('{"clarity": 2, "evidence": 1, "total": 3}', 3),
+    ('{"total": "4"}', 4),
+    ('{"total": "3/5"}', 3),
+    ('{"total": 2.5}', 2.5),
+    ('Here you go:\n```json\n{"total": 5}\n```', 5),
+    ('{"clarity": "2", "evidence": 1}', 3),
+    ('Total: 4', 4),
+    ("I can't score this.", None),
+    ("", None),
+    (None, None),
+])
+def test_extract_score(text, score):
+    assert extract_score(text) == score
+
+
+def test_extract_score_ignores_booleans():
+    assert extract_score('{"passed": true}') is None
+
+
+def test_prescore_without_prefilter_settles_nothing():
+    assert prescore("anything", {"rubric": "r"}) == (None, {})
+
+
+def test_prescore_fails_below_a_minimum():
+    verdict, details = prescore("Too short.", {"prefilter": {"min_words": 5}})
+    assert verdict == "fail"
+    assert details["failed"] == "min_words"
+    assert details["words"] == 2
+
+
+def test_prescore_passes_when_every_threshold_is_met():
+    text = "Telemedicine improves access.\n\nIt also protects privacy when done well."
+    checks = {"pass_paragraphs": 2, "pass_sentences": 2, "keywords": ["access", "privacy", "cost"], "pass_keywords": 2}
+    verdict, details = prescore(text, {"prefilter": checks})
+    assert verdict == "pass"
+    assert details["matched_keywords"] == ["access", "privacy"]
+
+
+def test_prescore_leaves_borderline_answers_to_the_model():
+    verdict, _ = prescore("one two three four five six", {"prefilter": {"min_words": 3, "pass_words": 10}})
+    assert verdict is None
+
+
+def test_prescore_matches_whole_words_only():
+    _, details = prescore("Accessibility matters.", {"prefilter": {"keywords": ["access"]}})
+    assert details["keywords"] == 0
+
+
+def test_score_submission_skips_the_model_for_clear_cases():
+    phase = {"prefilter": {"pass_words": 2}, "minimum_score": 3}
+
+    def run_model():
+        raise AssertionError("the model shouldn't be asked")
+
+    outcome = score_submission("plenty of words here", phase, run_model)
+    assert outcome["stage"] == "prefilter"
+    assert outcome["verdict"] == "pass"
+    assert passed(outcome["score"], phase)
+
+
+def test_score_submission_asks_the_model_for_borderline_answers():
+    phase = {"prefilter": {"min_words": 1, "pass_words": 100}, "minimum_score": 3}
+    outcome = score_submission("a short answer", phase, lambda: '{"total": 2}')
+    assert outcome == {"stage": "model", "verdict": "fail", "score": 2, "result": '{"total": 2}'}
+
+
+def test_score_submission_reports_unreadable_scores():
+    outcome = score_submission("answer", {"minimum_score": 1}, lambda: "no JSON here")
+    assert outcome["verdict"] == "unreadable"
+    assert outcome["score"] is None
+
+
+def test_passed_needs_a_minimum_score():
+    assert passed(5, {"minimum_score": 3})
+    assert not passed(2, {"minimum_score": 3})
+    assert not passed(5, {})
+    assert not passed(None, {"minimum_score": 3})
+
@@ -0,0 +1,78 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import config
+from opening_cache import OPENING_CACHE_VARIANTS, add_variant, opening_key
+from prefetch import Prefetcher
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def prefetcher():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        yield Prefetcher(executor, {})
+
+
+def guess(reply):
+    def work(cancel_event):
+        return reply, None
+    return work
+
+
+def test_take_hands_over_the_guess_for_the_same_input(prefetcher):
+    prefetcher.ensure("topic", "Nuclear power", guess("Opening"))
+    assert prefetcher.take("topic", "Solar power") is None
+    assert prefetcher.take("topic", "Nuclear power") == ("Opening", None)
+    assert "prefetch" not in prefetcher.state
+
+
+def test_changed_or_cleared_input_cancels_the_guess(prefetcher):
+    prefetcher.ensure("topic", "Nuclear power", guess("Opening"))
+    first = prefetcher.state["prefetch"]["cancel"]
+    prefetcher.ensure("topic", "Solar power", guess("Other opening"))
+    assert first.is_set()
+    second = prefetcher.state["prefetch"]["cancel"]
+    prefetcher.ensure("topic", "", guess("Unused"))
+    assert second.is_set() and "prefetch" not in prefetcher.state
+
+
+@pytest.fixture
+def app(app_dir, standin, monkeypatch):
+    from streamlit.testing.v1 import AppTest
+
+    monkeypatch.setattr(config, "AI_BACKEND", "assistants")
+    monkeypatch.setattr(config, "SPECULATIVE_PREFETCH", True)
+    return AppTest.from_file(os.path.join(HERE, "main.py"), default_timeout=60)
+
+
+def test_empty_input_starts_nothing(app):
+    app.run()
+    assert not app.session_state["thread_obj"]
+    assert "prefetch" not in app.session_state
+    app.text_input[-1].input("Sam").run()
+    assert app.session_state["thread_obj"]
+    assert "prefetch" in app.session_state
+
+
+def test_guess_is_cancelled_when_a_cached_opening_is_served(app):
+    topic_phase = config.PHASES["debate_topic"]
+    topic = topic_phase["options"][0]
+    app.run()
+    app.text_input[-1].input("Sam").run()
+    app.button(key="submit 1").click().run()
+    app.selectbox[-1].select(topic).run()
+    cancel = app.session_state["prefetch"]["cancel"]
+
+    # Other students fill the pool while this one is still reading
+    key = opening_key(topic, topic_phase["instructions"])
+    for variant in range(OPENING_CACHE_VARIANTS):
+        add_variant(key, f"Cached opening {variant}", topic)
+    app.button(key="submit 2").click().run()
+    assert not app.exception
+    assert app.session_state["debate_topic_ai_response"].startswith("Cached opening")
+    assert cancel.is_set()
+    assert "prefetch" not in app.session_state
@@ -0,0 +1,127 @@
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, ServiceUnavailable
+
+
+def opened(threshold=2, cooldown=60):
+    breaker = CircuitBreaker(threshold=threshold, cooldown=cooldown)
+    for _ in range(threshold):
+        breaker.before_call()
+        breaker.failure()
+    return breaker
+
+
+def cooled(breaker):
+    breaker.opened_at -= breaker.cooldown + 1
+    return breaker
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    # call_with_retry uses the module's breaker; give each test its own, and don't sleep between tries.
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    monkeypatch.setattr(resilience, "breaker", breaker)
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt: 0)
+    monkeypatch.setattr(resilience, "RETRYABLE_ERRORS", (TimeoutError,))
+    return breaker
+
+
+def test_closed_breaker_lets_calls_through():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    assert breaker.before_call() is None
+    breaker.failure()
+    assert breaker.before_call() is None
+
+
+def test_opens_after_threshold_and_rejects_during_cooldown():
+    breaker = opened()
+    with pytest.raises(ServiceUnavailable):
+        breaker.before_call()
+
+
+def test_lets_one_trial_through_after_cooldown():
+    breaker = cooled(opened())
+    trial = breaker.before_call()
+    assert trial is not None and breaker.trial_in_flight
+    with pytest.raises(ServiceUnavailable):
+        breaker.before_call()
+
+
+def test_successful_trial_closes_the_breaker():
+    breaker = cooled(opened())
+    trial = breaker.before_call()
+    breaker.success()
+    breaker.end_call(trial)
+    assert breaker.opened_at is None
+    assert breaker.before_call() is None
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = cooled(opened())
+    trial = breaker.before_call()
+    breaker.failure()
+    breaker.end_call(trial)
+    with pytest.raises(ServiceUnavailable):
+        breaker.before_call()
+
+
+def test_abandoned_trial_is_handed_back():
+    breaker = cooled(opened())
+    trial = breaker.before_call()
+    # Neither success() nor failure(): e.g. the stream was closed by a rerun
+    breaker.end_call(trial)
+    assert not breaker.trial_in_flight
+    assert breaker.before_call() is not None
+
+
+def test_a_stale_token_does_not_release_a_newer_trial():
+    breaker = cooled(opened())
+    first = breaker.before_call()
+    breaker.end_call(first)
+    second = breaker.before_call()
+    breaker.end_call(first)
+    assert breaker.trial_in_flight
+    breaker.end_call(second)
+    assert not breaker.trial_in_flight
+
+
+def test_call_with_retry_retries_transient_errors(breaker):
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 2:
+            raise TimeoutError("dropped")
+        return "ok"
+
+    assert resilience.call_with_retry(flaky, "test") == "ok"
+    assert len(calls) == 2
+    assert breaker.failures == 0
+
+
+def test_call_with_retry_gives_up_after_its_attempts(breaker, monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_ATTEMPTS", 3)
+    breaker.threshold = 10
+
+    def broken():
+        raise TimeoutError("down")
+
+    with pytest.raises(ServiceUnavailable):
+        resilience.call_with_retry(broken, "test")
+    assert breaker.failures == 3
+
+
+def test_non_retryable_error_during_a_trial_releases_it(breaker):
+    breaker.failure()
+    breaker.failure()
+    cooled(breaker)
+
+    def not_found():
+        raise KeyError("no such run")
+
+    with pytest.raises(KeyError):
+        resilience.call_with_retry(not_found, "test")
+    assert not breaker.trial_in_flight
+    assert resilience.call_with_retry(lambda: "back", "test") == "back"
+    assert breaker.opened_at is None
@@ -0,0 +1,109 @@
+import threading
+import time
+
+from scheduler import AdmissionScheduler, TokenBucket
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def queued(scheduler):
+    with scheduler.cond:
+        return sum(len(queue) for queue in scheduler.queues.values())
+
+
+def test_token_bucket_limits_and_refunds():
+    bucket = TokenBucket(600)
+    assert bucket.can_take(600)
+    bucket.take(600)
+    assert not bucket.can_take(100)
+    bucket.refund(200)
+    assert bucket.can_take(100)
+
+
+def test_unlimited_bucket_always_admits():
+    bucket = TokenBucket(0)
+    bucket.take(10 ** 9)
+    assert bucket.can_take(10 ** 9)
+
+
+def test_acquire_waits_for_a_free_slot():
+    scheduler = AdmissionScheduler(max_concurrency=1, requests_per_minute=0, tokens_per_minute=0)
+    first = scheduler.acquire("a", 10)
+    granted = threading.Event()
+    waiter = threading.Thread(target=lambda: (scheduler.acquire("b", 10), granted.set()))
+    waiter.start()
+    wait_for(lambda: queued(scheduler) == 1)
+    assert not granted.is_set()
+    scheduler.release(first)
+    assert granted.wait(5)
+    waiter.join()
+
+
+def test_sessions_are_served_round_robin():
+    scheduler = AdmissionScheduler(max_concurrency=1, requests_per_minute=0, tokens_per_minute=0)
+    running = scheduler.acquire("a", 1)
+    order, positions, tickets = [], {}, []
+
+    def student(name, label):
+        ticket = scheduler.acquire(name, 1, on_wait=lambda position: positions.setdefault(label, position))
+        order.append(label)
+        tickets.append(ticket)
+
+    workers = []
+    for count, (name, label) in enumerate([("a", "a2"), ("a", "a3"), ("b", "b1")], 1):
+        worker = threading.Thread(target=student, args=(name, label))
+        worker.start()
+        workers.append(worker)
+        wait_for(lambda: queued(scheduler) == count)
+    wait_for(lambda: len(positions) == 3)
+    # b joined last but is served before a's second waiting turn
+    assert positions["b1"] == 2
+
+    scheduler.release(running)
+    for served in range(1, 4):
+        wait_for(lambda: len(order) == served)
+        scheduler.release(tickets[-1])
+    for worker in workers:
+        worker.join()
+    assert order == ["a2", "b1", "a3"]
+    assert scheduler.active == 0
+
+
+def test_try_acquire_only_uses_spare_capacity():
+    scheduler = AdmissionScheduler(max_concurrency=1, requests_per_minute=0, tokens_per_minute=0)
+    ticket = scheduler.try_acquire("speculative", 10)
+    assert ticket is not None
+    assert scheduler.try_acquire("other", 10) is None
+    scheduler.release(ticket)
+    assert scheduler.try_acquire("other", 10) is not None
+
+
+def test_token_budget_holds_back_large_turns_and_release_refunds():
+    scheduler = AdmissionScheduler(max_concurrency=5, requests_per_minute=0, tokens_per_minute=1000)
+    ticket = scheduler.acquire("a", 900)
+    assert scheduler.try_acquire("b", 500) is None
+    # The turn used far less than estimated; the difference goes back in the bucket
+    scheduler.release(ticket, used_tokens=100)
+    assert scheduler.try_acquire("b", 500) is not None
+
+
+def test_interrupted_wait_leaves_no_ticket_behind():
+    scheduler = AdmissionScheduler(max_concurrency=1, requests_per_minute=0, tokens_per_minute=0)
+    scheduler.acquire("a", 1)
+
+    class Interrupted(BaseException):
+        pass
+
+    def interrupt(position):
+        raise Interrupted()
+
+    try:
+        scheduler.acquire("b", 1, on_wait=interrupt)
+    except Interrupted:
+        pass
+    assert queued(scheduler) == 0
@@ -0,0 +1,113 @@
+import pytest
+
+import session_store
+from session_store import SQLiteSessionStore, WriteBehindStore, capture, restore
+
+PHASES = {"welcome": {"type": "markdown"}, "name": {"type": "text_input"}, "essay": {"type": "text_area"}}
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"))
+
+
+@pytest.fixture
+def store(sqlite_store):
+    # A long interval, so only explicit flushes write
+    return WriteBehindStore(sqlite_store, interval=3600)
+
+
+def test_capture_and_restore_round_trip():
+    state = {
+        "CURRENT_PHASE": 2,
+        "debate": "energy-policy",
+        "name_user_input": "Sam",
+        "name_ai_response": "Hello Sam",
+        "name_phase_status": True,
+        "pending_messages": [{"role": "user", "content": "Sam"}],
+        "thread_messages": [],
+        "token_usage": {"phases": {"name": {"prompt_tokens": 10, "completion_tokens": 5, "turns": 1}}},
+        "unrelated": "not saved",
+    }
+    data, finished = capture(state, PHASES)
+    assert not finished
+    assert "unrelated" not in str(data)
+
+    restored = {}
+    restore(restored, data)
+    for key in ("CURRENT_PHASE", "debate", "name_user_input", "name_ai_response", "name_phase_status",
+                "pending_messages", "thread_messages", "token_usage"):
+        assert restored[key] == state[key]
+
+
+def test_finished_sessions_keep_only_what_was_said():
+    state = {"essay_user_input": "Done", "essay_ai_response": "Well argued", "pending_messages": [{"role": "user"}]}
+    data, finished = capture(state, PHASES)
+    assert finished
+    assert "pending_messages" not in data
+
+
+def test_sqlite_store_saves_and_loads(sqlite_store):
+    sqlite_store.save_many({"s1": ('{"CURRENT_PHASE": 1}', False)})
+    sqlite_store.save_many({"s1": ('{"CURRENT_PHASE": 2}', False)})
+    assert sqlite_store.load("s1") == {"CURRENT_PHASE": 2}
+    assert sqlite_store.load("missing") is None
+
+
+def test_write_behind_serves_unflushed_saves(store, sqlite_store):
+    store.save("s1", {"CURRENT_PHASE": 1})
+    assert sqlite_store.load("s1") is None
+    assert store.load("s1") == {"CURRENT_PHASE": 1}
+    store.flush()
+    assert sqlite_store.load("s1") == {"CURRENT_PHASE": 1}
+
+
+def test_write_behind_keeps_only_the_latest_snapshot(store, sqlite_store, monkeypatch):
+    batches = []
+    save_many = sqlite_store.save_many
+    monkeypatch.setattr(sqlite_store, "save_many", lambda sessions: (batches.append(dict(sessions)), save_many(sessions)))
+    store.save("s1", {"CURRENT_PHASE": 1})
+    store.save("s1", {"CURRENT_PHASE": 2})
+    store.flush()
+    assert len(batches) == 1 and len(batches[0]) == 1
+    assert sqlite_store.load("s1") == {"CURRENT_PHASE": 2}
+
+
+def test_write_behind_skips_unchanged_sessions(store):
+    store.save("s1", {"CURRENT_PHASE": 1})
+    store.flush()
+    store.save("s1", {"CURRENT_PHASE": 1})
+    assert store.dirty == {}
+
+
+def test_write_behind_remembers_a_bounded_number_of_sessions(sqlite_store):
+    store = WriteBehindStore(sqlite_store, interval=3600, saved_size=2)
+    for session_id in ("s1", "s2", "s3"):
+        store.save(session_id, {"CURRENT_PHASE": 1})
+        store.flush()
+    assert list(store.saved) == ["s2", "s3"]
+    # A forgotten session is written again, and still loads
+    store.save("s1", {"CURRENT_PHASE": 1})
+    assert "s1" in store.dirty
+    store.flush()
+    assert list(store.saved) == ["s3", "s1"]
+    assert sqlite_store.load("s1") == {"CURRENT_PHASE": 1}
+
+
+def test_write_behind_keeps_a_failed_batch_for_the_next_flush(store, sqlite_store, monkeypatch):
+    def broken(sessions):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(sqlite_store, "save_many", broken)
+    store.save("s1", {"CURRENT_PHASE": 1})
+    store.flush()
+    assert "s1" in store.dirty
+    monkeypatch.undo()
+    store.flush()
+    assert sqlite_store.load("s1") == {"CURRENT_PHASE": 1}
+
+
+def test_make_store():
+    assert session_store.make_store(None) is None
+    with pytest.raises(ValueError):
+        session_store.make_store("redis")
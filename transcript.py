@@ -0,0 +1,56 @@
+import html
+from functools import lru_cache
+
+from config import *
+
+# Completed phases can't change any more, so instead of rebuilding a disabled widget in its own
+# styled container on every rerun, each one is drawn as a fragment of a single read-only markdown
+# block. A fragment depends only on the phase and what was said, so it is built once per process.
+
+# Injected once per page: sizes the active phase's label and styles the transcript.
+PAGE_CSS = """<style>
+[data-testid="stWidgetLabel"] p, .phase-label { font-weight: bold; font-size: 28px; }
+.phase-answer { padding: 0.5rem 0.75rem; margin-bottom: 1rem; border: 1px solid rgba(49, 51, 63, 0.2); border-radius: 0.5rem; opacity: 0.7; }
+.phase-reply { padding: 0.75rem 1rem; margin-bottom: 1rem; border-radius: 0.5rem; background-color: rgba(28, 131, 225, 0.1); }
+</style>"""
+
+
+def _text(value):
+    # Student input is shown as typed: escaped, with its line breaks kept.
+    return html.escape(str(value)).replace("\n", "<br>")
+
+
+def _reply(value):
+    # Replies are markdown, so they sit between blank lines inside their block to be parsed as such.
+    # Only the HTML is escaped; markdown syntax still renders.
+    return f'<div class="phase-reply">\n\n🤖 {html.escape(str(value), quote=False)}\n\n</div>'
+
+
+@lru_cache(maxsize=TRANSCRIPT_CACHE_SIZE)
+def fragment(phase_type, label, body, answer, reply, result):
+    parts = []
+    if phase_type == "markdown":
+        parts.append(body)
+    else:
+        if label:
+            parts.append(f'<p class="phase-label">{_text(label)}</p>')
+        if answer is not None:
+            parts.append(f'<div class="phase-answer">{_text(answer)}</div>')
+    if reply is not None:
+        parts.append(_reply(reply))
+    if result is not None and SCORING_DEBUG_MODE:
+        parts.append(_reply(result))
+    return "\n\n".join(parts)
+
+
+def phase_fragment(phase, state):
+    """The read-only fragment for a completed phase, from the answer and replies stored in state."""
+    name = phase.name
+    return fragment(
+        phase.type,
+        phase.kwargs.get("label", ""),
+        phase.kwargs.get("body", ""),
+        state.get(f"{name}_user_input"),
+        state.get(f"{name}_ai_response"),
+        state.get(f"{name}_ai_result"),
+    )